@@ -7,6 +7,7 @@ from datetime import timedelta, datetime
 import logging
 import cgi
 import json
+import sys
 import ConfigParser
 from urllib import urlencode
 
@@ -25,11 +26,16 @@ from django.views.decorators.vary import vary_on_cookie
 from boto.s3.connection import S3Connection
 
 from AWS.s3_telemetry import create_s3_conn
+from AWS.s3t3_cache import T3FileCache, set_t3_file_cache
+from AWS.s3t3_fetch import T3_FETCH_CONCURRENCY
+from AWS.s3t3_index import T3KeyIndex, set_t3_key_index
 from AWS.s3t3_telemetry import get_client_events,  T3_EVENT_CLASS_FILE_PREFIXES, get_pinger_events, \
     get_latest_device_info_event, get_trouble_ticket_events
 from core.auth import nacho_cache, nachotoken_required
 
 from PyWBXMLDecoder.ASCommandResponse import ASCommandResponse
+from misc.event_merge import epoch_us_key, merge_events, sort_events
+from misc.threadpool import ThreadPool, ThreadPoolThread
 from misc.utc_datetime import UtcDateTime
 
 T3_TYPES = ['ALL',
@@ -63,6 +69,12 @@ tmp_logger = logging.getLogger('telemetry')
 
 default_span = 1
 
+if settings.T3_CACHE_DIR:
+    set_t3_file_cache(T3FileCache(settings.T3_CACHE_DIR, max_size=settings.T3_CACHE_SIZE,
+                                  memory_size=settings.T3_CACHE_MEMORY_SIZE, logger=tmp_logger))
+if settings.T3_INDEX_FILE:
+    set_t3_key_index(T3KeyIndex(settings.T3_INDEX_FILE, logger=tmp_logger))
+
 
 class LoginForm(forms.Form):
     #username = forms.CharField()
@@ -107,9 +119,16 @@ def _aws_s3_connection(project):
     if not project in _aws_s3_connection_cache:
         if not project in projects:
             raise ValueError('Project %s is not present in projects.cfg' % project)
-        _aws_s3_connection_cache[project] = create_s3_conn(projects_cfg.get(project, 'access_key_id'), projects_cfg.get(project, 'secret_access_key'), debug=BOTO_DEBUG)
+        _aws_s3_connection_cache[project] = _new_aws_s3_connection(project)
     return _aws_s3_connection_cache[project]
 
+def _new_aws_s3_connection(project):
+    """
+    A connection of its own, for a thread. boto connections are not thread-safe.
+    :return: boto.s3.connection.S3Connection
+    """
+    return create_s3_conn(projects_cfg.get(project, 'access_key_id'), projects_cfg.get(project, 'secret_access_key'), debug=BOTO_DEBUG)
+
 def _parse_junk(junk, mapping):
     retval = dict()
     lines = junk.splitlines()
@@ -497,19 +516,65 @@ def get_trouble_tickets(project, conn, logger):
     events = get_trouble_ticket_events(conn, bucket_name, logger=logger)
     return events
 
+class T3ClassFetchThread(ThreadPoolThread):
+    """
+    Get the events of one event class, sorted by timestamp, using its own S3 connection
+    and fetching at most concurrency files at a time.
+    """
+    def __init__(self, project, userid, deviceid, search, threadid, after, before, concurrency, logger, results):
+        ThreadPoolThread.__init__(self)
+        self.daemon = True
+        self.project = project
+        self.userid = userid
+        self.deviceid = deviceid
+        self.search = search
+        self.threadid = threadid
+        self.after = after
+        self.before = before
+        self.concurrency = concurrency
+        self.logger = logger
+        self.results = results
+        self.conn = None
+
+    def process(self, ev_class):
+        try:
+            if self.conn is None:
+                self.conn = _new_aws_s3_connection(self.project)
+            conn = self.conn
+            if ev_class == 'PINGER':
+                events = get_pinger_telemetry(self.project, conn, self.userid, self.deviceid, self.after, self.before,
+                                              self.search)
+            else:
+                bucket_name = projects_cfg.get(self.project, 'client_t3_%s_bucket' % T3_EVENT_CLASS_FILE_PREFIXES[ev_class])
+                events = get_client_events(conn, bucket_name, self.userid, self.deviceid, self.after, self.before,
+                                           ev_class, self.search, self.threadid, logger=self.logger,
+                                           concurrency=self.concurrency)
+            # mostly in order already (the file open at the start of the window comes last)
+            sort_events(events, key=epoch_us_key)
+            self.results[ev_class] = (events, None)
+        except Exception:
+            self.results[ev_class] = (None, sys.exc_info())
+
 def get_t3_events(project, userid, deviceid, event_class, search, threadid, after, before):
     logger = logging.getLogger('telemetry').getChild('client_telemetry')
     conn = _aws_s3_connection(project)
     event_classes = T3_EVENT_CLASS_FILE_PREFIXES[event_class]
     if isinstance(event_classes, list):
-        all_events = []
+        # each class is in its own bucket. get them all at once, sharing the fetch budget, and merge
+        results = dict()
+        concurrency = max(1, T3_FETCH_CONCURRENCY // len(event_classes))
+        thread_pool = ThreadPool(len(event_classes), T3ClassFetchThread, project, userid, deviceid, search, threadid,
+                                 after, before, concurrency, logger, results)
+        for (thread, ev_class) in zip(thread_pool.threads, event_classes):
+            thread.obj_queue.put(ev_class)
+            thread.obj_queue.put(None)
+        thread_pool.start()
+        thread_pool.wait()
         for ev_class in event_classes:
-            if ev_class == 'PINGER':
-               some_events = get_pinger_telemetry(project, conn, userid, deviceid, after, before, search)
-            else:
-                bucket_name = projects_cfg.get(project, 'client_t3_%s_bucket' % T3_EVENT_CLASS_FILE_PREFIXES[ev_class])
-                some_events = get_client_events(conn, bucket_name, userid, deviceid, after, before, ev_class, search, threadid, logger=logger)
-            all_events.extend(some_events)
+            (events, exc_info) = results[ev_class]
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+        return merge_events([results[ev_class][0] for ev_class in event_classes], key=epoch_us_key)
     else:
         if event_class == 'PINGER':
             all_events = get_pinger_telemetry(project, conn, userid, deviceid, after, before, search)
@@ -518,8 +583,7 @@ def get_t3_events(project, userid, deviceid, event_class, search, threadid, afte
         else:
             bucket_name = projects_cfg.get(project, 'client_t3_%s_bucket' % T3_EVENT_CLASS_FILE_PREFIXES[event_class])
             all_events = get_client_events(conn, bucket_name, userid, deviceid, after, before, event_class, search, threadid, logger=logger)
-    all_events = sorted(all_events, key=lambda x: x['timestamp'])
-    return all_events
+    return sort_events(all_events, key=epoch_us_key)
 
 def get_last_device_info_event(project, userid, deviceid, after, before):
     logger = logging.getLogger('telemetry').getChild('client_telemetry')
@@ -75,6 +75,17 @@ DATABASES = {
 SESSION_ENGINE = 'django.contrib.sessions.backends.file'
 SESSION_COOKIE_HTTPONLY = True
 
+# Local cache of downloaded T3 files. Set T3_CACHE_DIR to None to disable.
+T3_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 't3')
+T3_CACHE_SIZE = 4*1024*1024*1024
+T3_CACHE_MEMORY_SIZE = 256*1024*1024
+
+# Local index of the T3 bucket listings. Set T3_INDEX_FILE to None to disable.
+T3_INDEX_FILE = os.path.join(BASE_DIR, 'cache', 't3_index.sqlite')
+
+# Keep Redshift connections open between requests. Set DB_CONN_POOL to False to connect for each report.
+DB_CONN_POOL = True
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.6/topics/i18n/
 
@@ -15,6 +15,7 @@ urlpatterns = patterns('',
     url(r'^$', 'Bugfix.views.index', name='index'),
     url(r'^db/log-report-form$', 'db.views.db_log_report_form', name="log-report-form"),
     url(r'^db/log-report/(?P<project>\w+)/(?P<from_date>%s)/(?P<to_date>%s)/$' % (timestamp_regex, timestamp_regex), 'db.views.db_log_report'),
+    url(r'^db/log-report/(?P<project>\w+)/(?P<from_date>%s)/(?P<to_date>%s)/counts/$' % (timestamp_regex, timestamp_regex), 'db.views.db_log_counts_report'),
      url(r'^db/syncfail-report-form$', 'db.views.db_syncfail_report_form', name="syncfail-report-form"),
     url(r'^db/syncfail-report/(?P<project>\w+)/(?P<from_date>%s)/(?P<to_date>%s)/(?P<delta_value>\d*)/$' % (timestamp_regex, timestamp_regex), 'db.views.db_syncfail_report'),
     url(r'^db/help$', 'db.views.db_help', name="db-help"),
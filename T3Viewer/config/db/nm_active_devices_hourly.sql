@@ -0,0 +1 @@
+../../../config/db/nm_active_devices_hourly.sql
\ No newline at end of file
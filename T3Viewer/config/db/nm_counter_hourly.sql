@@ -0,0 +1 @@
+../../../config/db/nm_counter_hourly.sql
\ No newline at end of file
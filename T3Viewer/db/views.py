@@ -6,13 +6,16 @@ from datetime import timedelta, datetime, date
 from gettext import gettext as _
 
 from django import forms
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
 from django.http import HttpResponseRedirect
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 
-from AWS.db_reports import log_report, execute_sql, classify_log_events, syncfail_report
+from AWS.db_cache import get_db_result_cache, normalize_sql
+from AWS.db_pool import DBConnectionPool, set_db_conn_pool
+from AWS.db_reports import log_report, execute_sql, syncfail_report, is_select
 from AWS.redshift_handler import delete_logs, upload_logs, create_tables, list_tables, delete_tables
 from AWS.s3t3_telemetry import T3_EVENT_CLASS_FILE_PREFIXES
 from Bugfix.views import entry_page
@@ -31,6 +34,13 @@ tmp_logger = logging.getLogger('telemetry')
 
 default_span = 1
 
+if settings.DB_CONN_POOL:
+    set_db_conn_pool(DBConnectionPool(logger=tmp_logger))
+
+# Most rows shown by the query page, and most ERROR and WARN events by the log report
+query_row_limit = 10000
+log_report_row_limit = 1000
+
 _t3_redshift_config_cache = {}
 
 
@@ -45,6 +55,16 @@ def get_t3_redshift_config(project, file_name):
     return _t3_redshift_config_cache[project]
 
 
+def cached_report(logger, config, name, args, start, end, compute, cacheable=None):
+    """
+    Return compute(), from the result cache of the config (see AWS.db_cache) if it has one.
+    """
+    cache = get_db_result_cache(config, logger=logger)
+    if cache is None:
+        return compute()
+    return cache.get(config['general_config']['project'], name, args, start, end, compute, cacheable=cacheable)
+
+
 class DBDeleteLogsForm(forms.Form):
     project = forms.ChoiceField(choices=[(x, x.capitalize()) for x in projects])
     from_date = forms.DateTimeField(initial=datetime.now(), required=False)
@@ -195,6 +215,8 @@ class DBReportForm(forms.Form):
     project = forms.ChoiceField(choices=[(x, x.capitalize()) for x in projects])
     from_date = forms.DateTimeField(initial=datetime.fromordinal((datetime.now() - timedelta(1)).toordinal()))
     to_date = forms.DateTimeField(initial=datetime.fromordinal((datetime.now()).toordinal()) - timedelta(seconds=1))
+    counts_only = forms.BooleanField(required=False, help_text="Only the event counts (from the hourly rollup "
+                                                               "when the dates are on the hour)")
 
     def clean_from_date(self):
         from_date = self.cleaned_data.get('from_date', '')
@@ -461,6 +483,8 @@ def db_log_report_form(request):
     kwargs['project'] = form.cleaned_data['project']
     kwargs['from_date'] = UtcDateTime(form.cleaned_data['from_date'])
     kwargs['to_date'] = UtcDateTime(form.cleaned_data['to_date'])
+    if form.cleaned_data['counts_only']:
+        return HttpResponseRedirect(reverse(db_log_counts_report, kwargs=kwargs))
     return HttpResponseRedirect(reverse(db_log_report, kwargs=kwargs))
 
 
@@ -504,14 +528,22 @@ def db_syncfail_report(request, project, from_date, to_date, delta_value):
     t3_redshift_config = get_t3_redshift_config(project, projects_cfg.get(project, 'report_config_file'))
     error_list = []
     warning_list = []
-    summary, device_list = syncfail_report(logger, t3_redshift_config['general_config']['project'],
-                                           t3_redshift_config, from_datetime, to_datetime, int(delta_value))
+    device_list = []
+    result = cached_report(
+        logger, t3_redshift_config, 'syncfail_report', (int(delta_value),),
+        from_datetime, to_datetime,
+        lambda: syncfail_report(logger, t3_redshift_config['general_config']['project'],
+                                t3_redshift_config, from_datetime, to_datetime, int(delta_value)),
+        cacheable=lambda result: result is not None)
+    # None if the report failed (see the log). Show the empty report
+    if result is not None:
+        summary, device_list = result
     report_data = {'summary': summary, 'devices': device_list, 'general_config': t3_redshift_config["general_config"]}
     return render_to_response('syncfail_report.html', report_data,
                               context_instance=RequestContext(request))
 
 
-def db_log_report(request, project, from_date, to_date):
+def db_log_report(request, project, from_date, to_date, counts_only=False):
     logger = logging.getLogger('telemetry').getChild('db')
     logger.debug("Running log report for Project:%s, "
                  "From Date:%s, To Date:%s",
@@ -525,10 +557,16 @@ def db_log_report(request, project, from_date, to_date):
     t3_redshift_config = get_t3_redshift_config(project, projects_cfg.get(project, 'report_config_file'))
     error_list = []
     warning_list = []
-    summary, error_list, warning_list = log_report(logger, t3_redshift_config['general_config']['project'],
-                                                   t3_redshift_config, from_datetime, to_datetime)
-    clustered_error_list = classify_log_events(error_list)
-    clustered_warning_list = classify_log_events(warning_list)
+    clustered_error_list = []
+    clustered_warning_list = []
+    result = cached_report(
+        logger, t3_redshift_config, 'log_report', (log_report_row_limit, counts_only), from_datetime, to_datetime,
+        lambda: log_report(logger, t3_redshift_config['general_config']['project'], t3_redshift_config,
+                           from_datetime, to_datetime, limit=log_report_row_limit, aggregate_only=counts_only),
+        cacheable=lambda result: result is not None)
+    # None if the report failed (see the log). Show the empty report
+    if result is not None:
+        summary, error_list, warning_list, clustered_error_list, clustered_warning_list = result
     report_data = {'summary': summary, 'clustered_errors': clustered_error_list,
                    'clustered_warnings': clustered_warning_list,
                    'errors': error_list, 'warnings': warning_list,
@@ -537,6 +575,10 @@ def db_log_report(request, project, from_date, to_date):
                               context_instance=RequestContext(request))
 
 
+def db_log_counts_report(request, project, from_date, to_date):
+    return db_log_report(request, project, from_date, to_date, counts_only=True)
+
+
 @nachotoken_required
 def db_help(request):
     logger = logging.getLogger('telemetry').getChild('db')
@@ -563,7 +605,16 @@ def db_query(request):
     sql_query = form.cleaned_data['sql_query']
     project = form.cleaned_data['project']
     t3_redshift_config = get_t3_redshift_config(project, projects_cfg.get(project, 'report_config_file'))
-    error, col_names, results = execute_sql(logger, project, t3_redshift_config, sql_query, entry_page)
+    run_query = lambda: execute_sql(logger, project, t3_redshift_config, sql_query, entry_page,
+                                    limit=query_row_limit)
+    if is_select(sql_query):
+        error, col_names, results = cached_report(logger, t3_redshift_config, 'execute_sql',
+                                                  (project, normalize_sql(sql_query), query_row_limit), None, None,
+                                                  run_query, cacheable=lambda result: not result[0])
+    else:
+        error, col_names, results = run_query()
+    if not error and len(results) == query_row_limit:
+        error = "Only the first %d rows are shown" % query_row_limit
     report_data = {'results': results, 'rowcount': len(results), 'col_names': col_names, 'message': error,
                    "general_config": t3_redshift_config["general_config"], 'form': form}
     return render_to_response('db_query.html', report_data,
@@ -33,6 +33,7 @@ from AWS.query import Query
 from AWS.selectors import SelectorEqual, SelectorLessThanEqual, SelectorBetween, SelectorContains, SelectorGreaterThanEqual
 from AWS.tables import TelemetryTable
 from monitors.monitor_base import Monitor
+from misc.event_merge import merge_events, sort_events
 from misc.support import Support
 from misc.utc_datetime import UtcDateTime
 
@@ -561,10 +562,9 @@ def entry_page_base(project, client, after, before, params, logger, pinger_only=
         except DynamoDBError, e:
             return HttpResponseBadRequest('fail to query device info - %s', str(e))
 
+    pinger_objs = []
     try:
         pinger_objs = get_pinger_telemetry(project, client, UtcDateTime(str(after)), UtcDateTime(str(before)))
-        if pinger_objs:
-            event_list.extend(pinger_objs)
     except Exception as e:
         print e
 
@@ -572,12 +572,13 @@ def entry_page_base(project, client, after, before, params, logger, pinger_only=
     params = dict()
     params['start'] = after
     params['stop'] = before
-    params['event_count'] = len(event_list)
+    params['event_count'] = len(event_list) + len(pinger_objs)
     if len(client_list) > 0:
         # Get the data from the LAST client-entry
         params.update(client_list[-1])
 
-    event_list = sorted(event_list, key=lambda x: x['timestamp'])
+    # the client events come back from Query.events() in order already
+    event_list = merge_events([event_list, sort_events(pinger_objs)])
     # Generate the events JSON
     omit_list = ['uploaded_at',]
     if client:
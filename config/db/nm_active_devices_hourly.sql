@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS %snm_active_devices_hourly (
+ "hour" timestamp not null encode raw,
+ "build_version" varchar(64) not null encode bytedict,
+ "device_count" int not null encode lzo
+)
+diststyle even
+compound sortkey (hour, build_version);
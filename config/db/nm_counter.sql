@@ -1,11 +1,13 @@
 CREATE TABLE IF NOT EXISTS %snm_counter (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "counter_name" varchar(64),
- "counter_start" timestamp,
- "counter_end" timestamp,
- "count" int
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "counter_name" varchar(64) encode bytedict,
+ "counter_start" timestamp encode lzo,
+ "counter_end" timestamp encode lzo,
+ "count" int encode lzo
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
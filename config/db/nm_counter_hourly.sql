@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS %snm_counter_hourly (
+ "hour" timestamp not null encode raw,
+ "counter_name" varchar(64) not null encode bytedict,
+ "count_sum" bigint not null encode lzo,
+ "event_count" bigint not null encode lzo,
+ "device_count" int not null encode lzo
+)
+diststyle even
+compound sortkey (hour, counter_name);
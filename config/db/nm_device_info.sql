@@ -1,12 +1,14 @@
 CREATE TABLE IF NOT EXISTS %snm_device_info (
- "id" varchar(64) not null unique primary key,
- "timestamped" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "os_type" varchar(64),
- "os_version" varchar(64),
- "device_model" varchar(64),
- "build_version" varchar(64),
- "build_number" varchar(64),
- "fresh_install" boolean
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "timestamped" timestamp encode raw,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "os_type" varchar(64) encode bytedict,
+ "os_version" varchar(64) encode bytedict,
+ "device_model" varchar(64) encode bytedict,
+ "build_version" varchar(64) encode bytedict,
+ "build_number" varchar(64) encode bytedict,
+ "fresh_install" boolean encode runlength
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
@@ -1,11 +1,13 @@
 CREATE TABLE IF NOT EXISTS %snm_log (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "uploaded_at" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "thread_id" int,
- "module" varchar(64),
- "message" varchar(65535)
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "uploaded_at" timestamp encode lzo,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "thread_id" int encode lzo,
+ "module" varchar(64) encode bytedict,
+ "message" varchar(65535) encode lzo
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS %snm_log_hourly (
+ "hour" timestamp not null encode raw,
+ "event_type" varchar(64) not null encode bytedict,
+ "build_version" varchar(64) not null encode bytedict,
+ "event_count" bigint not null encode lzo,
+ "device_count" int not null encode lzo
+)
+diststyle even
+compound sortkey (hour, event_type);
@@ -1,13 +1,15 @@
 CREATE TABLE IF NOT EXISTS %snm_plog (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "uploaded_at" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "session" varchar(64),
- "context" varchar(64),
- "module" varchar(64),
- "pinger" varchar(64),
- "message" varchar(256)
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "uploaded_at" timestamp encode lzo,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "session" varchar(64) encode lzo,
+ "context" varchar(64) encode bytedict,
+ "module" varchar(64) encode bytedict,
+ "pinger" varchar(64) encode bytedict,
+ "message" varchar(256) encode lzo
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
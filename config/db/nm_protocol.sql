@@ -1,8 +1,10 @@
 CREATE TABLE IF NOT EXISTS %snm_protocol (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "payload" varchar(65535)
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "payload" varchar(65535) encode lzo
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
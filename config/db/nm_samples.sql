@@ -1,11 +1,13 @@
 CREATE TABLE IF NOT EXISTS %snm_samples (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "samples_name" varchar(64),
- "sample_int" int,
- "sample_string" varchar(256),
- "sample_float" float
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "samples_name" varchar(64) encode bytedict,
+ "sample_int" int encode lzo,
+ "sample_string" varchar(256) encode lzo,
+ "sample_float" float encode raw
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
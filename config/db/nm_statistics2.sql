@@ -1,13 +1,15 @@
 CREATE TABLE IF NOT EXISTS %snm_statistics2 (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "stat2_name" varchar(64),
- "max" int,
- "min" int,
- "sum" int,
- "sum2" int,
- "count" int
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "stat2_name" varchar(64) encode bytedict,
+ "max" int encode lzo,
+ "min" int encode lzo,
+ "sum" int encode lzo,
+ "sum2" int encode lzo,
+ "count" int encode lzo
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
@@ -1,12 +1,14 @@
 CREATE TABLE IF NOT EXISTS %snm_time_series (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "time_series_timestamp" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "time_series_name" varchar(64),
- "time_series_int" int,
- "time_series_string" varchar(256),
- "time_series_float" float
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "time_series_timestamp" timestamp encode lzo,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "time_series_name" varchar(64) encode bytedict,
+ "time_series_int" int encode lzo,
+ "time_series_string" varchar(256) encode lzo,
+ "time_series_float" float encode raw
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
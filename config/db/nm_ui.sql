@@ -1,11 +1,13 @@
 CREATE TABLE IF NOT EXISTS %snm_ui (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "ui_type" varchar(64),
- "ui_object" varchar(64),
- "ui_string" varchar(128),
- "ui_long" int
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "ui_type" varchar(64) encode bytedict,
+ "ui_object" varchar(64) encode bytedict,
+ "ui_string" varchar(128) encode lzo,
+ "ui_long" int encode lzo
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
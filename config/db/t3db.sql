@@ -1,99 +1,117 @@
 CREATE TABLE nm_log (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "uploaded_at" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "thread_id" int,
- "module" varchar(64),
- "message" varchar(65535)
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "uploaded_at" timestamp encode lzo,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "thread_id" int encode lzo,
+ "module" varchar(64) encode bytedict,
+ "message" varchar(65535) encode lzo
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
 CREATE TABLE nm_plog (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "uploaded_at" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "session" varchar(64),
- "context" varchar(64),
- "module" varchar(64),
- "pinger" varchar(64),
- "message" varchar(256)
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "uploaded_at" timestamp encode lzo,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "session" varchar(64) encode lzo,
+ "context" varchar(64) encode bytedict,
+ "module" varchar(64) encode bytedict,
+ "pinger" varchar(64) encode bytedict,
+ "message" varchar(256) encode lzo
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
 CREATE TABLE nm_support (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "support" varchar(65535)
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "support" varchar(65535) encode lzo
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
 CREATE TABLE nm_protocol (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "payload" varchar(65535)
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "payload" varchar(65535) encode lzo
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
 CREATE TABLE nm_ui (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "ui_type" varchar(64),
- "ui_object" varchar(64),
- "ui_string" varchar(128),
- "ui_long" int
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "ui_type" varchar(64) encode bytedict,
+ "ui_object" varchar(64) encode bytedict,
+ "ui_string" varchar(128) encode lzo,
+ "ui_long" int encode lzo
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
 CREATE TABLE nm_device_info (
- "id" varchar(64) not null unique primary key,
- "timestamped" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "os_type" varchar(64),
- "os_version" varchar(64),
- "device_model" varchar(64),
- "build_version" varchar(64),
- "build_number" varchar(64),
- "fresh_install" boolean
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "timestamped" timestamp encode raw,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "os_type" varchar(64) encode bytedict,
+ "os_version" varchar(64) encode bytedict,
+ "device_model" varchar(64) encode bytedict,
+ "build_version" varchar(64) encode bytedict,
+ "build_number" varchar(64) encode bytedict,
+ "fresh_install" boolean encode runlength
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
 CREATE TABLE nm_counter (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "counter_name" varchar(64),
- "counter_start" timestamp,
- "counter_end" timestamp,
- "count" int
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "counter_name" varchar(64) encode bytedict,
+ "counter_start" timestamp encode lzo,
+ "counter_end" timestamp encode lzo,
+ "count" int encode lzo
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
 CREATE TABLE nm_statistics2 (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "stat2_name" varchar(64),
- "max" int,
- "min" int,
- "sum" int,
- "sum2" int,
- "count" int
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "stat2_name" varchar(64) encode bytedict,
+ "max" int encode lzo,
+ "min" int encode lzo,
+ "sum" int encode lzo,
+ "sum2" int encode lzo,
+ "count" int encode lzo
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
 
 CREATE TABLE nm_samples (
- "id" varchar(64) not null unique primary key,
- "event_type" varchar(64) not null,
- "timestamped" timestamp,
- "user_id" varchar(64),
- "device_id" varchar(64),
- "samples_name" varchar(64),
- "sample_value" int
-);
+ "id" varchar(64) not null unique primary key encode lzo,
+ "event_type" varchar(64) not null encode bytedict,
+ "timestamped" timestamp encode raw,
+ "user_id" varchar(64) encode lzo,
+ "device_id" varchar(64) encode lzo,
+ "samples_name" varchar(64) encode bytedict,
+ "sample_value" int encode lzo
+)
+distkey (device_id)
+compound sortkey (timestamped, device_id);
 
 COMMIT;
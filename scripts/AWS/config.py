@@ -19,6 +19,11 @@ class AwsConfig(SectionConfig):
         'support_t3_bucket',
         'pinger_t3_bucket',
         'isT3',
+        't3_fetch_concurrency',
+        't3_cache_dir',
+        't3_cache_size',
+        't3_cache_memory_size',
+        't3_index_file',
     )
 
     def __init__(self, config_file):
@@ -27,6 +32,8 @@ class AwsConfig(SectionConfig):
     def __getattr__(self, key):
         if key == 'isT3':
             return self.config_file.getbool(AwsConfig.SECTION, key)
+        if key in ('t3_fetch_concurrency', 't3_cache_size', 't3_cache_memory_size'):
+            return self.config_file.getint(AwsConfig.SECTION, key)
         return SectionConfig.__getattr__(self, key)
 
 class CliFunc(object):
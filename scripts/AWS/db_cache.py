@@ -0,0 +1,165 @@
+# Copyright 2015, NachoCove, Inc
+import cPickle
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from misc.utc_datetime import UtcDateTime
+
+# How long a result whose time window has not been loaded completely is kept
+DB_CACHE_TTL = 15 * 60
+
+# The result caches of the processes, by file. Reports and loaders sharing a config share its cache.
+_db_result_caches = {}
+_db_result_caches_lock = threading.Lock()
+
+
+def get_db_result_cache(config, logger=None):
+    """
+    Return the result cache of a T3 Redshift config (general_config db_cache_file), or None if it has none.
+
+    The loader (T3RedShiftLoader.py) invalidates the results of what it loads in that
+    file, so it must run on the host of the viewer, with a config naming the same file
+    on a local disk. SQLite locking is not reliable over a network file system, and a
+    loader writing to another file leaves the viewer serving stale results.
+    """
+    db_path = config.get('general_config', {}).get('db_cache_file')
+    if not db_path:
+        return None
+    with _db_result_caches_lock:
+        if db_path not in _db_result_caches:
+            _db_result_caches[db_path] = DBResultCache(db_path, logger=logger)
+        return _db_result_caches[db_path]
+
+
+def normalize_sql(sql_query):
+    """
+    Collapse the white space and drop the trailing semicolons, so that the same query typed
+    twice has the same key.
+    """
+    return re.sub(r'\s+', ' ', sql_query).strip().rstrip(';').strip()
+
+
+class DBResultCache(object):
+    """
+    A local SQLite cache of the results of Redshift reports and queries.
+
+    A result is keyed by project, a name (e.g. the report) and its arguments (e.g.
+    the normalized SQL), and remembers its time window. Once the loader has marked
+    the whole window as loaded, the result is kept until a load touches the window
+    again. Otherwise, or if it has no window, it is kept ttl seconds. The loaders
+    invalidate the results whose window overlaps what they load, and those without
+    a window.
+    """
+    TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS db_results ("
+        "key TEXT NOT NULL PRIMARY KEY, project TEXT NOT NULL, start TEXT, end TEXT, expires_at REAL, "
+        "result BLOB NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS db_results_project ON db_results (project, start)",
+        "CREATE TABLE IF NOT EXISTS db_loaded ("
+        "project TEXT NOT NULL PRIMARY KEY, loaded_through TEXT NOT NULL)",
+    )
+
+    def __init__(self, db_path, ttl=None, logger=None):
+        self.db_path = db_path
+        self.ttl = ttl if ttl is not None else DB_CACHE_TTL
+        self.logger = logger
+        self.lock = threading.Lock()
+        dir_name = os.path.dirname(self.db_path)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        # one connection shared by all threads of this process, serialized by self.lock
+        self.db = sqlite3.connect(self.db_path, timeout=60, check_same_thread=False)
+        with self.lock:
+            for statement in self.SCHEMA:
+                self.db.execute(statement)
+            self.db.commit()
+
+    @classmethod
+    def format_time(cls, t):
+        if t is None:
+            return None
+        if isinstance(t, UtcDateTime):
+            t = t.datetime
+        return t.replace(tzinfo=None).strftime(cls.TIME_FORMAT)
+
+    @classmethod
+    def cache_key(cls, project, name, args, start, end):
+        return hashlib.sha256(cPickle.dumps((project, name, args, cls.format_time(start), cls.format_time(end)),
+                                            cPickle.HIGHEST_PROTOCOL)).hexdigest()
+
+    def get(self, project, name, args, start, end, compute, cacheable=None):
+        """
+        Return the cached result of compute() for project, name, args (a tuple of
+        strings and numbers) and the time window start to end of the result (or None),
+        computing and caching it if needed. A result for which cacheable(result) is
+        False (e.g. an error) is returned but not cached.
+        """
+        key = self.cache_key(project, name, args, start, end)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT result FROM db_results WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                                  (key, now)).fetchone()
+        if row is not None:
+            if self.logger:
+                self.logger.debug("DB result cache: hit for %s %s", name, args)
+            return cPickle.loads(zlib.decompress(str(row[0])))
+        result = compute()
+        if cacheable is None or cacheable(result):
+            self.put(project, key, start, end, result)
+        return result
+
+    def put(self, project, key, start, end, result):
+        start = self.format_time(start)
+        end = self.format_time(end)
+        with self.lock:
+            row = self.db.execute("SELECT loaded_through FROM db_loaded WHERE project = ?", (project,)).fetchone()
+            if start is not None and end is not None and row is not None and end <= row[0]:
+                expires_at = None
+            else:
+                expires_at = time.time() + self.ttl
+            self.db.execute("INSERT OR REPLACE INTO db_results VALUES (?, ?, ?, ?, ?, ?)",
+                            (key, project, start, end, expires_at,
+                             sqlite3.Binary(zlib.compress(cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)))))
+            self.db.execute("DELETE FROM db_results WHERE expires_at <= ?", (time.time(),))
+            self.db.commit()
+
+    def invalidate(self, project, start, end):
+        """
+        Forget the results of project whose window overlaps [start, end] (start None is
+        the beginning of time) and those without a window.
+        """
+        start = self.format_time(start)
+        end = self.format_time(end)
+        with self.lock:
+            cursor = self.db.execute("DELETE FROM db_results WHERE project = ? AND "
+                                     "(start IS NULL OR end IS NULL OR (start <= ? AND (? IS NULL OR end >= ?)))",
+                                     (project, end, start, start))
+            self.db.commit()
+        if self.logger:
+            self.logger.debug("DB result cache: invalidated %d results of %s from %s to %s",
+                              cursor.rowcount, project, start, end)
+
+    def set_loaded(self, project, loaded_through):
+        """
+        Record that the loader has loaded everything of project up to loaded_through.
+        Reloading an older span does not move it back.
+        """
+        loaded_through = self.format_time(loaded_through)
+        with self.lock:
+            row = self.db.execute("SELECT loaded_through FROM db_loaded WHERE project = ?", (project,)).fetchone()
+            if row is None or row[0] < loaded_through:
+                self.db.execute("INSERT OR REPLACE INTO db_loaded VALUES (?, ?)", (project, loaded_through))
+                self.db.commit()
+
+    def get_loaded(self, project):
+        with self.lock:
+            row = self.db.execute("SELECT loaded_through FROM db_loaded WHERE project = ?", (project,)).fetchone()
+        return datetime.strptime(row[0], self.TIME_FORMAT) if row else None
@@ -0,0 +1,154 @@
+# Copyright 2015, NachoCove, Inc
+import os
+import threading
+import time
+
+# An idle connection is checked with a round trip before it is reused once it has been idle this long
+DB_POOL_CHECK_INTERVAL = 60
+# ... and closed instead once it has been idle this long. Redshift and the ELBs in front of it drop idle sessions.
+DB_POOL_IDLE_TIMEOUT = 10 * 60
+# Idle connections kept per database
+DB_POOL_MAX_IDLE = 8
+
+# The process-wide pool used by redshift_handler.get_db_conn(). None means every call opens a new connection.
+_db_conn_pool = None
+
+
+def set_db_conn_pool(pool):
+    global _db_conn_pool
+    assert pool is None or isinstance(pool, DBConnectionPool)
+    if _db_conn_pool is not None and _db_conn_pool is not pool:
+        _db_conn_pool.close_all()
+    _db_conn_pool = pool
+
+
+def get_db_conn_pool():
+    return _db_conn_pool
+
+
+class DBConnectionPool(object):
+    """
+    A pool of idle database connections, by db_config, shared by the threads of a process.
+
+    Connecting to Redshift takes an SSL handshake, which is most of the time of a
+    small report. get() returns an idle connection of the db_config if there is
+    one, and put() takes it back once the caller is done with it, after rolling
+    back whatever the caller left open. A connection that has been idle a while is
+    checked before it is handed out, and dropped if it is broken or has been idle
+    too long. There is no limit on the connections in use, only on the idle ones.
+
+    The connections of a parent process are never used (or closed) in a forked child.
+    """
+    def __init__(self, max_idle=None, check_interval=None, idle_timeout=None, logger=None):
+        self.max_idle = max_idle if max_idle is not None else DB_POOL_MAX_IDLE
+        self.check_interval = check_interval if check_interval is not None else DB_POOL_CHECK_INTERVAL
+        self.idle_timeout = idle_timeout if idle_timeout is not None else DB_POOL_IDLE_TIMEOUT
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        # db_config key -> list of (connection, time it was put back), oldest first
+        self.idle = dict()
+        # id(connection) -> db_config key, for the connections handed out
+        self.in_use = dict()
+
+    @staticmethod
+    def db_key(db_config):
+        return tuple(sorted(db_config.items()))
+
+    def _check_pid(self):
+        # called with self.lock held
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.idle = dict()
+            self.in_use = dict()
+
+    def get(self, db_config, connect):
+        """
+        Return a connection to the database of db_config, calling connect() if
+        there is no usable idle one.
+        """
+        key = self.db_key(db_config)
+        while True:
+            with self.lock:
+                self._check_pid()
+                idle = self.idle.get(key)
+                if not idle:
+                    break
+                (conn, idle_since) = idle.pop()
+            idle_time = time.time() - idle_since
+            if idle_time < self.idle_timeout and not conn.closed and \
+                    (idle_time < self.check_interval or self.is_healthy(conn)):
+                with self.lock:
+                    self.in_use[id(conn)] = key
+                return conn
+            self._close(conn)
+        conn = connect()
+        with self.lock:
+            self.in_use[id(conn)] = key
+        return conn
+
+    def put(self, conn, discard=False):
+        """
+        Give back a connection returned by get(). It is closed instead if discard is
+        True, if it is broken or if there are enough idle connections already.
+        """
+        with self.lock:
+            self._check_pid()
+            key = self.in_use.pop(id(conn), None)
+        if key is None or discard or conn.closed or not self.reset(conn):
+            self._close(conn)
+            return
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append((conn, time.time()))
+                return
+        self._close(conn)
+
+    def reset(self, conn):
+        """
+        End the transaction the last user left open and restore the defaults. Return
+        False if the connection is not usable.
+        """
+        try:
+            conn.rollback()
+            conn.autocommit = False
+            return True
+        except Exception as e:
+            if self.logger:
+                self.logger.warn("DB connection pool: dropping connection: %s", e)
+            return False
+
+    def is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("select 1")
+                cursor.fetchone()
+            finally:
+                cursor.close()
+            conn.rollback()
+            return True
+        except Exception as e:
+            if self.logger:
+                self.logger.warn("DB connection pool: dropping stale connection: %s", e)
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """
+        Close the idle connections. The ones in use are closed when they are put back.
+        """
+        with self.lock:
+            self._check_pid()
+            idle = self.idle
+            self.idle = dict()
+            self.in_use = dict()
+        for connections in idle.values():
+            for (conn, idle_since) in connections:
+                self._close(conn)
@@ -1,9 +1,10 @@
 import traceback
 from datetime import timedelta, datetime
+from itertools import chain
 
 from django.core.urlresolvers import reverse
 
-from AWS.redshift_handler import create_db_conn
+from AWS.redshift_handler import get_db_conn, release_db_conn, iter_select, iter_rows, limit_sql
 from analytics.cluster import Clusterer
 from analytics.token import TokenList, WhiteSpaceTokenizer
 from misc.utc_datetime import UtcDateTime
@@ -26,42 +27,68 @@ def parse_dates(args):
     return start, end
 
 
-def classify_log_events(events):
-    # Cluster log messages
-    clusterer = Clusterer()
-    tokenizer = WhiteSpaceTokenizer()
-    for log in events:
+class LogEventClassifier(object):
+    """
+    Cluster log messages by their first line, one event at a time.
+    """
+    def __init__(self):
+        self.clusterer = Clusterer()
+        self.tokenizer = WhiteSpaceTokenizer()
+        self.counts = {}
+
+    def add(self, log, count=1):
+        """
+        Add a log event, or count events with the same first line of message.
+        """
         # We cluster using only the first line of the message
         message = log['message'].split('\n')[0]
-        token_list = TokenList(tokenizer.process(message))
-        clusterer.add(token_list)
-
-    # Generate the report dictionary
-    clustered_events = []
-    ccount = 0
-    for cluster in clusterer.clusters:
-        message = cluster.pattern
-        if len(message) > 70:
-            new_message = str(message)[:76] + ' ...'
-        else:
-            new_message = message
-        ccount += len(cluster)
-        clustered_events.append({"count": len(cluster), "message": new_message})
-    clustered_events_sorted = sorted(clustered_events, key=lambda x: x['count'], reverse=True)
-    return clustered_events_sorted
+        token_list = TokenList(self.tokenizer.process(message))
+        cluster = self.clusterer.add(token_list)
+        self.counts[cluster] = self.counts.get(cluster, 0) + count
+
+    def clustered_events(self):
+        # Generate the report dictionary
+        clustered_events = []
+        for cluster in self.clusterer.clusters:
+            message = cluster.pattern
+            if len(message) > 70:
+                new_message = str(message)[:76] + ' ...'
+            else:
+                new_message = message
+            clustered_events.append({"count": self.counts[cluster], "message": new_message})
+        return sorted(clustered_events, key=lambda x: x['count'], reverse=True)
 
 
-def select(logger, cursor, sql_st):
+def select(logger, cursor, sql_st, params=None):
     # need a connection with dbname=<username>_db
     try:
         # retrieving all tables in my search_path
-        cursor.execute(sql_st)
+        cursor.execute(sql_st, params)
     except Exception as err:
         logger.error(err)
         return None
     rows = cursor.fetchall()
     return rows
 
+
+def get_syncfail_sql(project):
+    """
+    Return the query for syncfail_report, with parameters start, end, like term and
+    gap in seconds. For each sync success of a device, the next one (or end, after
+    the last one) is found with LEAD(), and only the successes followed by a longer
+    gap than the threshold are returned, ordered by device and time.
+    """
+    return "select user_id, device_id, timestamped, next_timestamped from (" \
+           "select user_id, device_id, timestamped, " \
+           "coalesce(lead(timestamped) over (partition by device_id order by timestamped), " \
+           "%%(end)s::timestamp) as next_timestamped from (" \
+           "select max(user_id) as user_id, device_id, timestamped from %s_nm_log " \
+           "where timestamped >= %%(start)s and timestamped <= %%(end)s and message like %%(like_term)s " \
+           "group by device_id, timestamped) as successes) as gaps " \
+           "where next_timestamped > dateadd(second, %%(gap)s, timestamped) " \
+           "order by device_id, timestamped" % project
+
+
 def syncfail_report(logger, project, config, start, end, delta_value):
     host = "http://localhost:8081/"
     summary = {'start': start, 'end': end}
@@ -71,142 +98,235 @@ def syncfail_report(logger, project, config, start, end, delta_value):
     endForRS = end.datetime.strftime('%Y-%m-%d %H:%M:%S')
     device_list = []
     logger.info("Creating connection...")
-    conn = create_db_conn(logger, config["db_config"])
+    conn = get_db_conn(logger, config["db_config"])
     conn.autocommit = False
     cursor = conn.cursor()
     try:
-        logger.info("Selecting devices from logs...")
-        # TODO fix %s in SQL statements
-        sql_statement = "select distinct user_id, device_id from %s_nm_log " \
-                        "where timestamped >= '%s' and timestamped <= '%s' group by user_id, device_id" % (project, startForRS, endForRS)
-        logger.info(sql_statement)
-        rows = select(logger, cursor, sql_statement)
-        for row in rows:
-            device_list.append({"user_id": row[0], "device_id": row[1]})
+        logger.info("Selecting sync gaps from logs...")
+        sql_statement = get_syncfail_sql(project)
+        params = {'start': startForRS, 'end': endForRS, 'like_term': '%S=SyncW & E=Success%', 'gap': delta_value}
+        logger.info(sql_statement % params)
+        rows = select(logger, cursor, sql_statement, params)
         logger.info("%s successful, Read %s rows", cursor.statusmessage, cursor.rowcount)
-        for device in device_list:
-            like_term = '%S=SyncW & E=Success%'
-            sql_statement = "select distinct timestamped from %s_nm_log " \
-                        "where timestamped >= '%s' and timestamped <= '%s'" \
-                        "and message like '%s' " \
-                        "and device_id='%s' group by timestamped order by timestamped" \
-            % (project, startForRS, endForRS, like_term, device['device_id'])
-            logger.info(sql_statement)
-            rows = select(logger, cursor, sql_statement)
-            curTS=''
-            prevTS=''
-            i=0
-            gaps = []
-            # check each gap
-            for row in rows:
-                i+=1
-                curTS = row[0]
-                if prevTS == '':
-                    prevTS = curTS
-                delta=UtcDateTime(curTS)-UtcDateTime(prevTS)
-                if delta > delta_value:
-                    telemetry_link = get_client_telemetry_link(project, device['device_id'], UtcDateTime(prevTS), host=host, isT3=True)
-                    gap = {'startTS': UtcDateTime(prevTS), 'endTS': UtcDateTime(curTS), 'gap':delta, 'tele_link': telemetry_link}
-                    gaps.append(gap)
-                prevTS = curTS
-            # final check
-            delta = UtcDateTime(end)-UtcDateTime(prevTS)
-            if delta > delta_value:
-                telemetry_link = get_client_telemetry_link(project, device['device_id'], UtcDateTime(prevTS), host=host, isT3=True)
-                gap = {'startTS': UtcDateTime(prevTS), 'endTS': UtcDateTime(end), 'gap': delta, 'tele_link': telemetry_link}
-                gaps.append(gap)
-            device['gaps'] = gaps
-        gap_device_list = [x for x in device_list if x['gaps']]
-        summary['device_count'] = len(gap_device_list)
-        return summary, gap_device_list
+        device = None
+        for row in rows:
+            if device is None or device['device_id'] != row[1]:
+                device = {"user_id": row[0], "device_id": row[1], "gaps": []}
+                device_list.append(device)
+            startTS = UtcDateTime(row[2])
+            endTS = UtcDateTime(row[3])
+            telemetry_link = get_client_telemetry_link(project, device['device_id'], startTS, host=host, isT3=True)
+            device['gaps'].append({'startTS': startTS, 'endTS': endTS, 'gap': endTS - startTS,
+                                   'tele_link': telemetry_link})
+        summary['device_count'] = len(device_list)
+        return summary, device_list
     except Exception as err:
         logger.error(err)
         logger.error(traceback.format_exc())
-    cursor.close()
-    conn.close()
+    finally:
+        cursor.close()
+        release_db_conn(conn)
+
+# The event types whose events log_report returns. The others are only counted.
+log_report_event_types = ('ERROR', 'WARN')
+
+
+def get_log_report_sql(project, group_messages):
+    """
+    Return the query for log_report, with parameters start and end. It reads the log
+    once and returns one row per ERROR or WARN event (per distinct first line of the
+    message, its first occurrence, if group_messages) and one row per other event
+    type, each with the number of events of its group and of its event type.
+    """
+    group_key = "split_part(message, chr(10), 1)" if group_messages else "id"
+    return "select event_type, user_id, device_id, timestamped, message, group_count, type_count from (" \
+           "select event_type, user_id, device_id, timestamped, message, " \
+           "count(*) over (partition by event_type, group_key) as group_count, " \
+           "count(*) over (partition by event_type) as type_count, " \
+           "row_number() over (partition by event_type, group_key order by timestamped) as group_row from (" \
+           "select event_type, user_id, device_id, timestamped, message, " \
+           "case when event_type in (%s) then %s end as group_key from %s_nm_log " \
+           "where timestamped >= %%(start)s and timestamped <= %%(end)s) as events) as groups " \
+           "where group_row = 1 order by timestamped" % (', '.join(["'%s'" % x for x in log_report_event_types]),
+                                                         group_key, project)
+
+
+def add_event_counts(summary, type_counts):
+    total_count = 0
+    for (event_type, count) in type_counts.items():
+        summary[event_type] = count
+        if count > 0:
+            summary[event_type + '_rate'] = float(count) / summary['total_hours']
+        else:
+            summary[event_type + '_rate'] = 0
+        total_count += count
+    summary['event_count'] = total_count
+    if total_count > 0:
+        summary['event_rate'] = float(total_count) / summary['total_hours']
+    else:
+        summary['event_rate'] = 0
+
+
+def get_rollup_hours(start, end, rolled_up):
+    """
+    Return the whole hours [first, last) (datetimes) of [start, end] that are rolled up,
+    or None if there are none. An end on the second before an hour (as parse_dates() ends
+    a day) counts as the end of that hour. rolled_up is the hours [first, last) of the
+    rollup table, from get_rolled_up_hours().
+    """
+    start_dt = start.datetime.replace(tzinfo=None)
+    end_dt = end.datetime.replace(tzinfo=None)
+    if end_dt.minute == 59 and end_dt.second == 59 and not end_dt.microsecond:
+        end_dt += timedelta(seconds=1)
+    first = start_dt.replace(minute=0, second=0, microsecond=0)
+    if first < start_dt:
+        first += timedelta(hours=1)
+    last = end_dt.replace(minute=0, second=0, microsecond=0)
+    first = max(first, rolled_up[0])
+    last = min(last, rolled_up[1])
+    if last <= first:
+        return None
+    return first, last
+
+
+def get_rolled_up_hours(logger, project, conn):
+    """
+    Return the hours [first, last) of the log rollup, or None if it is empty or missing.
+    The last hour in the table may only be partly rolled up (the loader rolls up to the
+    end of what it loaded), so it is left out.
+    """
+    sql_statement = "select min(hour), max(hour) from %s_nm_log_hourly" % project
+    try:
+        rows = list(iter_select(logger, conn, sql_statement))
+    except Exception as err:
+        logger.warn("No log rollup: %s", err)
+        conn.rollback()
+        return None
+    if not rows or rows[0][0] is None:
+        return None
+    return rows[0][0], rows[0][1]
+
+
+def get_event_counts(logger, project, conn, start, end):
+    """
+    Return a dict of the number of log events of each event type in [start, end]. The
+    whole hours of the span that are rolled up are counted from the hourly rollup, the
+    rest from the log itself.
+    """
+    params = {'start': start.datetime.strftime('%Y-%m-%d %H:%M:%S'),
+              'end': end.datetime.strftime('%Y-%m-%d %H:%M:%S')}
+    log_sql = "select event_type, count(*) from %s_nm_log " \
+              "where timestamped >= %%(start)s and timestamped <= %%(end)s" % project
+    counts = {}
+    rolled_up = get_rolled_up_hours(logger, project, conn)
+    hours = get_rollup_hours(start, end, rolled_up) if rolled_up else None
+    if hours:
+        params['first'] = hours[0].strftime('%Y-%m-%d %H:%M:%S')
+        params['last'] = hours[1].strftime('%Y-%m-%d %H:%M:%S')
+        sql_statement = "select event_type, sum(event_count) from %s_nm_log_hourly " \
+                        "where hour >= %%(first)s and hour < %%(last)s group by event_type" % project
+        logger.info(sql_statement % params)
+        for row in iter_select(logger, conn, sql_statement, params):
+            counts[row[0]] = counts.get(row[0], 0) + int(row[1])
+        log_sql += " and (timestamped < %(first)s or timestamped >= %(last)s)"
+    sql_statement = log_sql + " group by event_type"
+    logger.info(sql_statement % params)
+    for row in iter_select(logger, conn, sql_statement, params):
+        counts[row[0]] = counts.get(row[0], 0) + int(row[1])
+    return counts
 
-def log_report(logger, project, config, start, end):
+
+def log_report(logger, project, config, start, end, limit=None, group_messages=False, aggregate_only=False):
+    """
+    Return the summary, the ERROR and WARN events (at most limit of each) and the
+    clustered ERROR and WARN events, from one scan of the log. The events are streamed
+    from the database, and all of them are clustered, not only the first limit.
+
+    If group_messages, the events with the same first line of message are grouped
+    by the database, and only the first of each group is returned, with its "count".
+    If aggregate_only, only the summary counts are computed (from the hourly rollup
+    for the hours it covers) and the event lists are empty.
+    """
     host = "http://localhost:8081/"
     summary = {'start': start, 'end': end}
     summary['period'] = str(end.datetime - start.datetime)
     summary['total_hours'] = (end.datetime - start.datetime).days * 24 + (end.datetime - start.datetime).seconds / 3600
+    summary['group_messages'] = group_messages
     startForRS = start.datetime.strftime('%Y-%m-%d %H:%M:%S')
     endForRS = end.datetime.strftime('%Y-%m-%d %H:%M:%S')
-    error_list = []
-    warning_list = []
+    event_lists = dict((x, []) for x in log_report_event_types)
+    classifiers = dict((x, LogEventClassifier()) for x in log_report_event_types)
+    type_counts = {}
     logger.info("Creating connection...")
-    conn = create_db_conn(logger, config["db_config"])
+    conn = get_db_conn(logger, config["db_config"])
     conn.autocommit = False
-    cursor = conn.cursor()
     try:
-        logger.info("Selecting error counts from logs...")
-        # TODO fix %s in SQL statements
-        sql_statement = "select event_type, user_id, device_id, timestamped, message from %s_nm_log " \
-                        "where event_type='ERROR' and " \
-                        "timestamped >= '%s' and timestamped <= '%s'" % (project, startForRS, endForRS)
-        logger.info(sql_statement)
-        rows = select(logger, cursor, sql_statement)
-        for row in rows:
-            telemetry_link = get_client_telemetry_link(project, row[2], row[3], host=host, isT3=True)
-            error_list.append(
-                    {"event_type": row[0], "user_id": row[1], "device_id": row[2], "timestamp": UtcDateTime(row[3]),
-                     "message": row[4], 'telemetry_link': telemetry_link})
-        logger.info("%s successful, Read %s rows", cursor.statusmessage, cursor.rowcount)
-        logger.info("Selecting warning counts from logs...")
-        sql_statement = "select event_type, user_id, device_id, timestamped, message from %s_nm_log " \
-                        "where event_type='WARN' and " \
-                        "timestamped >= '%s' and timestamped <= '%s'" % (project, startForRS, endForRS)
-        logger.info(sql_statement)
-        rows = select(logger, cursor, sql_statement)
-        for row in rows:
-            telemetry_link = get_client_telemetry_link(project, row[2], row[3], host=host, isT3=True)
-            warning_list.append(
-                    {"event_type": row[0], "user_id": row[1], "device_id": row[2], "timestamp": UtcDateTime(row[3]),
-                     "message": row[4], 'telemetry_link': telemetry_link})
-        logger.info("%s successful, Read %s rows", cursor.statusmessage, cursor.rowcount)
-        logger.info("Selecting total counts from logs...")
-        sql_statement = "select distinct count(*), event_type from %s_nm_log " \
-                        "where timestamped >= '%s' and timestamped <= '%s'" \
-                        "group by event_type order by count desc" % (project, startForRS, endForRS)
-        logger.info(sql_statement)
-        rows = select(logger, cursor, sql_statement)
-        total_count = 0
-        for row in rows:
-            summary[row[1]] = row[0]
-            if row[0] > 0:
-                summary[row[1] + '_rate'] = float(row[0]) / summary['total_hours']
-            else:
-                summary[row[1] + '_rate'] = 0
-            total_count += row[0]
-        summary['event_count'] = total_count
-        if total_count > 0:
-            summary['event_rate'] = float(total_count) / summary['total_hours']
-        else:
-            summary['event_rate'] = 0
-        logger.info("%s successful, Read %s rows", cursor.statusmessage, cursor.rowcount)
-        return summary, error_list, warning_list
+        if aggregate_only:
+            logger.info("Selecting counts from logs...")
+            add_event_counts(summary, get_event_counts(logger, project, conn, start, end))
+            return summary, [], [], [], []
+        logger.info("Selecting events and counts from logs...")
+        sql_statement = get_log_report_sql(project, group_messages)
+        params = {'start': startForRS, 'end': endForRS}
+        logger.info(sql_statement % params)
+        row_count = 0
+        for row in iter_select(logger, conn, sql_statement, params):
+            row_count += 1
+            (event_type, group_count, type_count) = (row[0], row[5], row[6])
+            type_counts[event_type] = type_count
+            if event_type not in event_lists:
+                continue
+            log = {"event_type": event_type, "user_id": row[1], "device_id": row[2], "message": row[4]}
+            classifiers[event_type].add(log, group_count)
+            event_list = event_lists[event_type]
+            if limit is None or len(event_list) < limit:
+                log['timestamp'] = UtcDateTime(row[3])
+                log['telemetry_link'] = get_client_telemetry_link(project, row[2], row[3], host=host, isT3=True)
+                if group_messages:
+                    log['count'] = group_count
+                event_list.append(log)
+        logger.info("Read %s rows", row_count)
+        add_event_counts(summary, type_counts)
+        return summary, event_lists['ERROR'], event_lists['WARN'], \
+            classifiers['ERROR'].clustered_events(), classifiers['WARN'].clustered_events()
     except Exception as err:
         logger.error(err)
         logger.error(traceback.format_exc())
-    cursor.close()
-    conn.close()
+    finally:
+        release_db_conn(conn)
+
+
+def is_select(sql_query):
+    words = sql_query.split(None, 1)
+    return bool(words) and words[0].lower() in ('select', 'with')
 
 
-def execute_sql(logger, project, config, sql_query, link_page):
+def execute_sql(logger, project, config, sql_query, link_page, limit=None):
+    """
+    Run a query from the query page and return the error, the column names and at
+    most limit rows. A select is read from a server-side cursor, with the limit
+    pushed down into the query unless it has its own ORDER BY or LIMIT. Any other
+    statement is run on a regular cursor.
+    """
     logger.info("Creating connection...")
-    conn = create_db_conn(logger, config["db_config"])
+    conn = get_db_conn(logger, config["db_config"])
     conn.autocommit = False
-    cursor = conn.cursor()
     # TODO fix %s in SQL statements
     sql_statement = sql_query
     logger.info("Running custom sql query: %s", sql_statement)
     rows = []
     col_names = ""
     error = ""
+    if is_select(sql_statement):
+        cursor = conn.cursor(name='execute_sql')
+        sql_statement = limit_sql(sql_statement, limit)
+    else:
+        cursor = conn.cursor()
     try:
         cursor.execute(sql_statement)
-        rowcount = cursor.rowcount
-        logger.info("Custom query returned %d rows", rowcount)
+        results = iter_rows(cursor, limit=limit)
+        # a server-side cursor has no description until the first fetch
+        first_row = next(results, None)
         col_names = [i[0] for i in cursor.description]
         linkify_timestamped = 'device_id' in col_names and 'timestamped' in col_names
         if linkify_timestamped:
@@ -217,7 +337,7 @@ def execute_sql(logger, project, config, sql_query, link_page):
             timestamped_col = -1
 
         rows = []
-        for row in cursor:
+        for row in chain([first_row] if first_row is not None else [], results):
             lrow = list(row)
 
             # replace all datetime fields with their UtcDateTime equivalent
@@ -237,12 +357,12 @@ def execute_sql(logger, project, config, sql_query, link_page):
 
             rows.append(lrow)
             if len(rows) % 1000 == 0:
-                logger.debug("Processed %3.1f%% of rows", (float(len(rows))/float(rowcount))*100.0)
+                logger.debug("Processed %d rows", len(rows))
     except Exception as err:
         error = err
         logger.error(err)
         logger.error(traceback.format_exc())
     cursor.close()
-    conn.close()
-    logger.debug("Processed 100%% of rows (%d)", len(rows))
+    release_db_conn(conn)
+    logger.info("Custom query returned %d rows", len(rows))
     return error, col_names, rows
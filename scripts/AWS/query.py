@@ -1,5 +1,6 @@
 import logging
 import time
+from misc.event_merge import merge_events
 from events import LogEvent, WbxmlEvent, CounterEvent, CaptureEvent, SupportEvent, UiEvent, DeviceInfoEvent
 from selectors import Selector, SelectorGreaterThanEqual, SelectorLessThan, SelectorBetween
 from tables import DeviceInfoTable
@@ -134,7 +135,7 @@ class Query(object):
         """
         # 'cls' is not used at all. it is only there for backward compatibility. Once
         # the transition to AWS is complete, we can get rid of it
-        events = list()
+        streams = list()
         count = 0
         for (event_cls, table_query) in query.table_query.items():
             if not table_query.for_us:
@@ -150,16 +151,14 @@ class Query(object):
             else:
                 results = Query._query(table, table_query, is_count=False, limit=query.limit)
                 table_events = event_cls.from_db_results(table.connection, results)
-                events.extend(table_events)
+                # results only come back in timestamp order when the table is queried on a timestamp index
+                streams.append(Query.sort_chronologically(table_events))
 
-        # We apply the limit to each table. The combined length could exceed the query limit. If so, trim again
+        # We apply the limit to each table. The combined length could exceed the query limit. If so, keep
+        # the earliest events of the merged tables
         if query.count:
             return max(count, query.limit)
-        if len(events) > query.limit:
-            events = events[:query.limit]
-
-        # Sort the chronologically.
-        return Query.sort_chronologically(events)
+        return merge_events(streams, limit=query.limit)
 
     @staticmethod
     def users(query, connection):
@@ -1,4 +1,9 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
+import json
+import Queue
+import re
+import sys
+import threading
 
 from AWS.s3_telemetry import create_s3_conn
 
@@ -8,9 +13,19 @@ import traceback
 import psycopg2
 from boto.exception import S3ResponseError, EC2ResponseError, BotoServerError
 
+from AWS.db_cache import get_db_result_cache
+from AWS.db_pool import get_db_conn_pool
+from AWS.s3t3_index import list_t3_keys
 from AWS.s3t3_telemetry import T3_EVENT_CLASS_FILE_PREFIXES, get_T3_date_prefixes
+from misc.threadpool import ThreadPool, ThreadPoolThread
 from misc.utc_datetime import UtcDateTime
 
+# Default number of event classes loaded (or deleted, or created) at once, each on its own connection
+redshift_concurrency = 4
+
+# Redshift runs one VACUUM at a time per cluster
+vacuum_lock = threading.Lock()
+
 
 def create_db_conn(logger, db_config):
     return psycopg2.connect(dbname=db_config['dbname'], host=db_config['host'],
@@ -18,6 +33,103 @@ def create_db_conn(logger, db_config):
                             sslmode='require')
 
 
+def get_db_conn(logger, db_config):
+    """
+    Return a connection to the database of db_config, from the process-wide pool if
+    one is set (see AWS.db_pool). Give it back with release_db_conn() rather than
+    closing it.
+    """
+    pool = get_db_conn_pool()
+    if pool is None:
+        return create_db_conn(logger, db_config)
+    return pool.get(db_config, lambda: create_db_conn(logger, db_config))
+
+
+def release_db_conn(conn, discard=False):
+    """
+    Give back a connection from get_db_conn(). discard closes it even if there is a pool.
+    """
+    pool = get_db_conn_pool()
+    if pool is None:
+        conn.close()
+    else:
+        pool.put(conn, discard=discard)
+
+
+class RedshiftClassThread(ThreadPoolThread):
+    def __init__(self, process, results):
+        ThreadPoolThread.__init__(self)
+        self.daemon = True
+        self.process_class = process
+        self.results = results
+        self.conn = None
+
+    def process(self, event_class):
+        try:
+            cursor = self.conn.cursor()
+            try:
+                self.results[event_class] = (self.process_class(self.conn, cursor, event_class), None)
+            finally:
+                cursor.close()
+        except Exception:
+            self.results[event_class] = (None, sys.exc_info())
+
+
+def for_each_event_class(logger, config, event_class, process, concurrency=None):
+    """
+    Call process(conn, cursor, event_class) for each class of event_class and
+    return a dict of the results by class. Up to <concurrency> classes are
+    processed at once, each on its own connection. process commits its own work.
+    """
+    if concurrency is None:
+        concurrency = redshift_concurrency
+    event_classes = T3_EVENT_CLASS_FILE_PREFIXES[event_class]
+    if not isinstance(event_classes, list):
+        event_classes = [event_class]
+    results = dict()
+    requests = Queue.Queue()
+    thread_pool = ThreadPool(max(1, min(concurrency, len(event_classes))), RedshiftClassThread, process, results)
+    logger.info("Creating %d connections...", len(thread_pool.threads))
+    try:
+        for thread in thread_pool.threads:
+            thread.conn = get_db_conn(logger, config["db_config"])
+            thread.conn.autocommit = False
+            # all threads pull from one queue so that a slow class does not hold up the others
+            thread.obj_queue = requests
+    except Exception:
+        for thread in thread_pool.threads:
+            if thread.conn is not None:
+                release_db_conn(thread.conn)
+        raise
+    for ev_class in event_classes:
+        requests.put(ev_class)
+    for thread in thread_pool.threads:
+        requests.put(None)
+    thread_pool.start()
+    thread_pool.wait()
+    for thread in thread_pool.threads:
+        release_db_conn(thread.conn)
+    stats = dict()
+    for ev_class in event_classes:
+        (result, exc_info) = results[ev_class]
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        stats[ev_class] = result
+    return stats
+
+
+def invalidate_db_cache(logger, project, config, start, end, lookback=None):
+    """
+    Forget the cached report results of project (see AWS.db_cache) for a span that was just
+    changed. The events of files loaded by upload date can be up to lookback older.
+    """
+    cache = get_db_result_cache(config, logger=logger)
+    if cache is not None:
+        if start is not None and lookback is not None:
+            start = start - lookback
+        cache.invalidate(project, start, end)
+
+
 def select(logger, cursor, sql_st):
     # need a connection with dbname=<username>_db
     try:
@@ -29,72 +141,169 @@ def select(logger, cursor, sql_st):
     return rows
 
 
-def delete_logs(logger, project, config, event_class, start, end, table_prefix):
+# Rows fetched per round trip by iter_select()
+fetch_batch_size = 1000
+
+
+def mask_sql(sql_st):
+    """
+    Return sql_st with its comments, string literals and quoted identifiers, and whatever
+    is inside parentheses (the parentheses too), replaced by spaces. What is left are the
+    top-level words of the statement, at their positions in sql_st.
+    """
+    masked = []
+    depth = 0
+    i = 0
+    n = len(sql_st)
+    while i < n:
+        c = sql_st[i]
+        if sql_st.startswith('--', i):
+            end = sql_st.find('\n', i)
+            end = n if end < 0 else end
+        elif sql_st.startswith('/*', i):
+            end = sql_st.find('*/', i + 2)
+            end = n if end < 0 else end + 2
+        elif c in ('\'', '"'):
+            end = i + 1
+            while end < n:
+                if c == '\'' and sql_st[end] == '\\':
+                    end += 2
+                elif sql_st.startswith(c + c, end):
+                    end += 2
+                elif sql_st[end] == c:
+                    end += 1
+                    break
+                else:
+                    end += 1
+            end = min(end, n)
+        else:
+            if c == '(':
+                depth += 1
+            elif c == ')':
+                depth = max(depth - 1, 0)
+            masked.append(c if depth == 0 and c not in '()' else ' ')
+            i += 1
+            continue
+        masked.append(' ' * (end - i))
+        i = end
+    return ''.join(masked)
+
+
+def has_order_or_limit(sql_st):
+    """
+    Whether a statement has a top-level ORDER BY or LIMIT.
+    """
+    return re.search(r'\b(order\s+by|limit)\b', mask_sql(sql_st).lower()) is not None
+
+
+def limit_sql(sql_st, limit):
+    """
+    Return a select statement that returns at most limit rows of sql_st (all of them if
+    limit is None). A statement with its own ORDER BY or LIMIT is returned as is, because
+    Redshift does not keep the order of a subquery. Read it with iter_rows(limit=limit).
+    """
+    if limit is None or has_order_or_limit(sql_st):
+        return sql_st
+    masked = mask_sql(sql_st).rstrip()
+    if masked.endswith(';'):
+        sql_st = sql_st[:len(masked) - 1] + sql_st[len(masked):]
+    # the newline ends a trailing -- comment
+    return "select * from (%s\n) as limited limit %d" % (sql_st.strip(), limit)
+
+
+def iter_rows(cursor, batch_size=None, limit=None):
+    """
+    Yield the rows of the last query of cursor (at most limit of them), fetching
+    batch_size rows at a time.
+    """
+    if batch_size is None:
+        batch_size = fetch_batch_size
+    count = 0
+    while limit is None or count < limit:
+        rows = cursor.fetchmany(batch_size if limit is None else min(batch_size, limit - count))
+        if not rows:
+            break
+        for row in rows:
+            yield row
+        count += len(rows)
+
+
+def iter_select(logger, conn, sql_st, params=None, limit=None, batch_size=None, name='iter_select'):
+    """
+    Yield the rows of a select statement (at most limit of them) from a named, server-side
+    cursor, batch_size rows at a time, so that only one batch is held in memory. The
+    connection must not be in autocommit mode, and the cursor is closed when the generator
+    is exhausted or closed.
+    """
+    cursor = conn.cursor(name=name)
+    try:
+        cursor.execute(limit_sql(sql_st, limit), params)
+        for row in iter_rows(cursor, batch_size, limit):
+            yield row
+    finally:
+        cursor.close()
+
+
+def delete_logs(logger, project, config, event_class, start, end, table_prefix, concurrency=None):
     if start:
         startForRS = start.datetime.strftime('%Y-%m-%d %H:%M:%S')
     else:
         startForRS = None
     endForRS = end.datetime.strftime('%Y-%m-%d %H:%M:%S')
-    delete_stats = {}
     if table_prefix:
         table_prefix_for_sql = table_prefix + '_' + project + '_'
     else:
         table_prefix_for_sql = project + '_'
-    try:
-        logger.info("Creating connection...")
-        conn = create_db_conn(logger, config["db_config"])
-        conn.autocommit = False
-        cursor = conn.cursor()
-        if startForRS:
-            logger.info("Deleting logs from %s to %s", startForRS, endForRS)
-        else:
-            logger.info("Deleting logs to %s", endForRS)
+    if startForRS:
+        logger.info("Deleting logs from %s to %s", startForRS, endForRS)
+    else:
+        logger.info("Deleting logs to %s", endForRS)
 
-        event_classes = T3_EVENT_CLASS_FILE_PREFIXES[event_class]
-        if not isinstance(event_classes, list):
-            event_classes = [event_class]
-        for event_class in event_classes:
-            event_class_stats = []
-            delete_stats[event_class] = event_class_stats
-            table_name = "%snm_%s" % (table_prefix_for_sql, T3_EVENT_CLASS_FILE_PREFIXES[event_class])
-            try:
-                rows = select(logger, cursor, "select count(*) from %s" % table_name)
-                for row in rows:
-                    preCount = row[0]
+    def delete_class_logs(conn, cursor, event_class):
+        event_class_stats = []
+        table_name = "%snm_%s" % (table_prefix_for_sql, T3_EVENT_CLASS_FILE_PREFIXES[event_class])
+        try:
+            rows = select(logger, cursor, "select count(*) from %s" % table_name)
+            for row in rows:
+                preCount = row[0]
 
-                sql_statement = "delete from %s" % table_name
-                if startForRS:
-                    sql_statement += " where timestamped >= '%s' and timestamped <= '%s'" % (startForRS, endForRS)
-                else:
-                    sql_statement += " where timestamped <= '%s'" % endForRS
+            sql_statement = "delete from %s" % table_name
+            if startForRS:
+                sql_statement += " where timestamped >= '%s' and timestamped <= '%s'" % (startForRS, endForRS)
+            else:
+                sql_statement += " where timestamped <= '%s'" % endForRS
 
 
-                logger.info(sql_statement)
-                cursor.execute(sql_statement)
-                conn.commit()
-                logger.info("DELETE STATUS MESSAGE:%s", cursor.statusmessage)
-                deletedCount = cursor.rowcount
+            logger.info(sql_statement)
+            cursor.execute(sql_statement)
+            conn.commit()
+            logger.info("DELETE STATUS MESSAGE:%s", cursor.statusmessage)
+            deletedCount = cursor.rowcount
+            with vacuum_lock:
                 old_isolation_level = conn.isolation_level
                 conn.set_isolation_level(0)
                 cursor.execute("vacuum %s" % table_name)
                 conn.set_isolation_level(old_isolation_level)
-                logger.info("VACUUM STATUS MESSAGE:%s", cursor.statusmessage)
-                conn.commit()
-                rows = select(logger, cursor, "select count(*) from %s" % table_name)
-                for row in rows:
-                    postCount = row[0]
-                event_class_stats.append({"pre_count": preCount, "post_count": postCount, "delete_count": deletedCount})
-                logger.info("Deleted %d (%d->%d) rows of %s", preCount - postCount, preCount, postCount, event_class)
-                conn.commit()
-            except Exception as err:
-                logger.error(err)
-                logger.error(traceback.format_exc())
-        conn.commit()
-        cursor.close()
-        conn.close()
+            logger.info("VACUUM STATUS MESSAGE:%s", cursor.statusmessage)
+            conn.commit()
+            rows = select(logger, cursor, "select count(*) from %s" % table_name)
+            for row in rows:
+                postCount = row[0]
+            event_class_stats.append({"pre_count": preCount, "post_count": postCount, "delete_count": deletedCount})
+            logger.info("Deleted %d (%d->%d) rows of %s", preCount - postCount, preCount, postCount, event_class)
+            conn.commit()
+        except Exception as err:
+            logger.error(err)
+            logger.error(traceback.format_exc())
+        return event_class_stats
+
+    delete_stats = {}
+    try:
+        delete_stats = for_each_event_class(logger, config, event_class, delete_class_logs, concurrency)
     except (BotoServerError, S3ResponseError, EC2ResponseError) as e:
         logger.error("Error :%s(%s):%s" % (e.error_code, e.status, e.message))
         logger.error(traceback.format_exc())
+    invalidate_db_cache(logger, project, config, start, end)
     return delete_stats
 
 
@@ -102,16 +311,29 @@ manifest_date_lookahead = timedelta(days=3)
 manifest_date_lookback = timedelta(days=3)
 
 
+# Manifests are written to the T3 bucket of each class, next to the json/ jsonpath files
+manifest_prefix = 'manifests/'
+# Keys modified in the last few minutes may not be listed yet. Leave them to the next incremental load.
+manifest_settle_time = timedelta(minutes=10)
+
+
 def get_manifest_url(logger, config, event_class, start, end):
     s3_config = config["s3_config"]
     aws_config = config["aws_config"]
     s3_conn = create_s3_conn(aws_config['aws_access_key_id'], aws_config['aws_secret_access_key'])
-    bucket_name = s3_config[event_class.lower()]["t3_bucket"]
+    bucket_name = s3_config[T3_EVENT_CLASS_FILE_PREFIXES[event_class]]["t3_bucket"]
     bucket = s3_conn.get_bucket(bucket_name)
+    return get_manifest_keys(bucket, start, end)
+
+
+def get_manifest_keys(bucket, start, end):
+    """
+    Return the names of the keys of bucket last modified in [start, end).
+    """
     s3_files = []
     date_prefixes = get_T3_date_prefixes(start - manifest_date_lookback, end + manifest_date_lookahead)
     for prefix in date_prefixes:
-        keys = bucket.list(prefix=prefix)
+        keys = list_t3_keys(bucket, prefix)
         for key in keys:
             last_modified = UtcDateTime(key.last_modified)
             if start <= last_modified < end:
@@ -119,100 +341,513 @@ def get_manifest_url(logger, config, event_class, start, end):
     return s3_files
 
 
+def write_manifest(bucket, manifest_name, key_names):
+    """
+    Write a COPY manifest of key_names (all in bucket) to the bucket and return its URL.
+    """
+    manifest = {"entries": [{"url": "s3://%s/%s" % (bucket.name, name), "mandatory": True} for name in key_names]}
+    key = bucket.new_key(manifest_prefix + manifest_name)
+    key.set_contents_from_string(json.dumps(manifest, indent=1), headers={'Content-Type': 'application/json'})
+    return "s3://%s/%s" % (bucket.name, key.name)
+
+
+def create_watermark_table(cursor, table_prefix_for_sql):
+    watermark_table = "%snm_load_watermark" % table_prefix_for_sql
+    cursor.execute("CREATE TABLE IF NOT EXISTS %s (\"table_name\" varchar(128) not null unique primary key, "
+                   "\"watermark\" timestamp not null)" % watermark_table)
+    return watermark_table
+
+
+def get_watermark(cursor, watermark_table, table_name):
+    cursor.execute("select watermark from %s where table_name = %%s" % watermark_table, (table_name,))
+    row = cursor.fetchone()
+    return UtcDateTime(row[0]) if row else None
+
+
+def set_watermark(cursor, watermark_table, table_name, watermark):
+    watermark_for_sql = watermark.datetime.strftime('%Y-%m-%d %H:%M:%S.%f')
+    cursor.execute("update %s set watermark = %%s where table_name = %%s" % watermark_table,
+                   (watermark_for_sql, table_name))
+    if cursor.rowcount == 0:
+        cursor.execute("insert into %s (table_name, watermark) values (%%s, %%s)" % watermark_table,
+                       (table_name, watermark_for_sql))
+
+
 # upload logs
-def upload_logs(logger, project, config, event_class, start, end, table_prefix=None):
+def upload_logs(logger, project, config, event_class, start, end, table_prefix=None, concurrency=None):
     aws_config = config["aws_config"]
     s3_config = config["s3_config"]
     if table_prefix:
         table_prefix_for_sql = table_prefix + '_' + project + '_'
     else:
         table_prefix_for_sql = project + '_'
+    logger.info("Uploading logs...")
+
+    def upload_class_logs(conn, cursor, event_class):
+        event_class_stats = []
+        event_class_name = T3_EVENT_CLASS_FILE_PREFIXES[event_class]
+        table_name = "%snm_%s" % (table_prefix_for_sql, event_class_name)
+        logger.info("Uploading logs to table %s from %s to %s", table_name, start, end)
+        date_prefixes = get_T3_date_prefixes(start, end)
+        for date_prefix in date_prefixes:
+            sql_statement = "COPY %s FROM 's3://%s/%s' \
+            CREDENTIALS 'aws_access_key_id=%s;aws_secret_access_key=%s' \
+            gzip maxerror 100000\
+            json 's3://%s/%s'" % (table_name, s3_config[event_class_name]["t3_bucket"], date_prefix,
+                                  aws_config["aws_access_key_id"], aws_config["aws_secret_access_key"],
+                                  s3_config[event_class_name]["t3_bucket"],
+                                  s3_config[event_class_name]["t3_jsonpath"])
+            try:
+                #logger.info(sql_statement)
+                cursor.execute(sql_statement)
+                logger.info("STATUS MESSAGE:%s",
+                            cursor.statusmessage)  # we dont get back a row count, no errors means we are good
+                conn.commit()
+                cursor.execute("select pg_last_copy_count();")
+                rows = cursor.fetchall()
+                rowsCopied = 0
+                for row in rows:
+                    rowsCopied = row[0]
+                    event_class_stats.append(
+                        {"date": UtcDateTime(date_prefix).datetime.strftime('%Y-%m-%d'), "count": row[0]})
+                logger.info("Copied %s rows of %s for %s", rowsCopied, event_class, date_prefix)
+            except Exception as err:
+                logger.error(err)
+                logger.error(traceback.format_exc())
+        conn.commit()
+        return event_class_stats
+
     upload_stats = {}
     try:
-        logger.info("Creating connection...")
-        conn = create_db_conn(logger, config["db_config"])
-        conn.autocommit = False
+        upload_stats = for_each_event_class(logger, config, event_class, upload_class_logs, concurrency)
+    except (BotoServerError, S3ResponseError, EC2ResponseError) as e:
+        logger.error("Error :%s(%s):%s" % (e.error_code, e.status, e.message))
+        logger.error(traceback.format_exc())
+    invalidate_db_cache(logger, project, config, start, end, lookback=manifest_date_lookback)
+    return upload_stats
+
+
+def get_settled_end(end):
+    """
+    Return end, or manifest_settle_time ago if that is earlier: the files modified since
+    may not all be listed yet.
+    """
+    settled = UtcDateTime(datetime.utcnow() - manifest_settle_time)
+    return settled if settled < end else end
+
+
+# upload the logs modified since the last incremental upload
+def upload_logs_incremental(logger, project, config, event_class, start, end, table_prefix=None, concurrency=None):
+    """
+    COPY the files last modified after the watermark of each table (start the first
+    time) and before end, through a manifest, and move the watermark to end. The
+    watermark is updated in the same transaction as the COPY, so a file is never
+    loaded twice. The stats have one entry per table, whose "date" is the window.
+    Return the stats, the oldest watermark a table was loaded from (None if nothing
+    was loaded; the events loaded can be up to manifest_date_lookback older), and the
+    end every table is now loaded to (get_settled_end(end)), or None if a table failed.
+    """
+    aws_config = config["aws_config"]
+    s3_config = config["s3_config"]
+    if table_prefix:
+        table_prefix_for_sql = table_prefix + '_' + project + '_'
+    else:
+        table_prefix_for_sql = project + '_'
+    end = get_settled_end(end)
+    logger.info("Uploading logs incrementally...")
+    # the watermarks the tables were loaded from
+    loaded_from = []
+    failed = []
+
+    def upload_class_logs(conn, cursor, event_class):
+        event_class_stats = []
+        event_class_name = T3_EVENT_CLASS_FILE_PREFIXES[event_class]
+        table_name = "%snm_%s" % (table_prefix_for_sql, event_class_name)
+        bucket_name = s3_config[event_class_name]["t3_bucket"]
+        try:
+            watermark = get_watermark(cursor, watermark_table, table_name) or start
+            if watermark >= end:
+                logger.info("%s is up to date (%s)", table_name, watermark)
+                return event_class_stats
+            window = "%s - %s" % (watermark.datetime.strftime('%Y-%m-%d %H:%M:%S'),
+                                  end.datetime.strftime('%Y-%m-%d %H:%M:%S'))
+            # boto connections are not thread-safe
+            s3_conn = create_s3_conn(aws_config['aws_access_key_id'], aws_config['aws_secret_access_key'])
+            bucket = s3_conn.get_bucket(bucket_name)
+            key_names = get_manifest_keys(bucket, watermark, end)
+            logger.info("Uploading %d files modified from %s to %s to table %s", len(key_names), watermark, end,
+                        table_name)
+            rowsCopied = 0
+            if key_names:
+                manifest_name = "%s-%s-%s.json" % (table_name, watermark.datetime.strftime('%Y%m%d%H%M%S'),
+                                                   end.datetime.strftime('%Y%m%d%H%M%S'))
+                manifest_url = write_manifest(bucket, manifest_name, key_names)
+                sql_statement = "COPY %s FROM '%s' \
+                CREDENTIALS 'aws_access_key_id=%s;aws_secret_access_key=%s' \
+                manifest gzip maxerror 100000\
+                json 's3://%s/%s'" % (table_name, manifest_url,
+                                      aws_config["aws_access_key_id"], aws_config["aws_secret_access_key"],
+                                      bucket_name, s3_config[event_class_name]["t3_jsonpath"])
+                cursor.execute(sql_statement)
+                logger.info("STATUS MESSAGE:%s", cursor.statusmessage)
+                cursor.execute("select pg_last_copy_count();")
+                rowsCopied = cursor.fetchone()[0]
+            set_watermark(cursor, watermark_table, table_name, end)
+            conn.commit()
+            loaded_from.append(watermark)
+            event_class_stats.append({"date": window, "count": rowsCopied})
+            logger.info("Copied %s rows of %s for %s", rowsCopied, event_class, window)
+        except Exception as err:
+            conn.rollback()
+            failed.append(event_class)
+            logger.error(err)
+            logger.error(traceback.format_exc())
+        return event_class_stats
+
+    upload_stats = {}
+    try:
+        conn = get_db_conn(logger, config["db_config"])
         cursor = conn.cursor()
-        logger.info("Uploading logs...")
-        event_classes = T3_EVENT_CLASS_FILE_PREFIXES[event_class]
-        if not isinstance(event_classes, list):
-            event_classes = [event_class]
-        for event_class in event_classes:
-            event_class_stats = []
-            upload_stats[event_class] = event_class_stats
-            event_class_name = T3_EVENT_CLASS_FILE_PREFIXES[event_class]
-            table_name = "%snm_%s" % (table_prefix_for_sql, event_class_name)
-            logger.info("Uploading logs to table %s from %s to %s", table_name, start, end)
-            date_prefixes = get_T3_date_prefixes(start, end)
-            for date_prefix in date_prefixes:
+        watermark_table = create_watermark_table(cursor, table_prefix_for_sql)
+        conn.commit()
+        cursor.close()
+        release_db_conn(conn)
+        upload_stats = for_each_event_class(logger, config, event_class, upload_class_logs, concurrency)
+    except (BotoServerError, S3ResponseError, EC2ResponseError) as e:
+        failed.append(event_class)
+        logger.error("Error :%s(%s):%s" % (e.error_code, e.status, e.message))
+        logger.error(traceback.format_exc())
+    if loaded_from:
+        # a table behind on its watermark (e.g. after missed runs) loaded from before start
+        invalidate_db_cache(logger, project, config, min(loaded_from), end, lookback=manifest_date_lookback)
+    return upload_stats, min(loaded_from) if loaded_from else None, end if not failed else None
+
+
+# Only VACUUM a table after a merge if the rows it replaced are at least this fraction of the table
+merge_vacuum_threshold = 0.05
+
+
+def create_staging_table(cursor, table_name):
+    """
+    Create an empty temporary table (dropped at the end of the session) with the columns
+    and keys of table_name, and return its name.
+    """
+    staging_table = "stage_%s" % table_name
+    cursor.execute("drop table if exists %s" % staging_table)
+    cursor.execute("create temp table %s (like %s)" % (staging_table, table_name))
+    return staging_table
+
+
+def merge_staged(logger, cursor, table_name, staging_table):
+    """
+    Replace the rows of table_name whose id is in staging_table by the staged rows,
+    and return the number of rows replaced. The delete is limited to the timestamp
+    range of the staged rows (when they all have one) so that Redshift only scans the
+    blocks in that range. The caller commits.
+    """
+    cursor.execute("select count(*), count(timestamped), min(timestamped), max(timestamped) from %s" %
+                   staging_table)
+    (staged_count, timestamped_count, min_timestamped, max_timestamped) = cursor.fetchone()
+    if not staged_count:
+        return 0
+    sql_statement = "delete from %s using %s where %s.id = %s.id" % (table_name, staging_table, table_name,
+                                                                      staging_table)
+    if timestamped_count == staged_count:
+        sql_statement += " and %s.timestamped >= '%s' and %s.timestamped <= '%s'" % (table_name, min_timestamped,
+                                                                                     table_name, max_timestamped)
+    logger.info(sql_statement)
+    cursor.execute(sql_statement)
+    replaced_count = cursor.rowcount
+    cursor.execute("insert into %s select * from %s" % (table_name, staging_table))
+    return replaced_count
+
+
+def vacuum_deleted_rows(logger, conn, cursor, table_name, deleted_count):
+    """
+    Reclaim the space of deleted rows with a VACUUM DELETE ONLY if they are at least
+    merge_vacuum_threshold of the rows of table_name (from svv_table_info, not a count
+    of the table). Otherwise leave them to a later merge. svv_table_info only lists the
+    tables the user can see that hold data; a table it does not list is not vacuumed.
+    Return whether it vacuumed.
+    """
+    if not deleted_count:
+        return False
+    cursor.execute("select tbl_rows from svv_table_info where \"table\" = %s", (table_name.lower(),))
+    row = cursor.fetchone()
+    conn.commit()
+    if not row or not row[0]:
+        logger.warn("Not vacuuming %s (%d deleted rows): not in svv_table_info", table_name, deleted_count)
+        return False
+    ratio = float(deleted_count) / row[0]
+    if ratio < merge_vacuum_threshold:
+        logger.info("Deferring vacuum of %s (%d deleted rows, %.2f%%)", table_name, deleted_count, ratio * 100)
+        return False
+    with vacuum_lock:
+        old_isolation_level = conn.isolation_level
+        conn.set_isolation_level(0)
+        try:
+            cursor.execute("vacuum delete only %s" % table_name)
+        finally:
+            conn.set_isolation_level(old_isolation_level)
+    logger.info("VACUUM STATUS MESSAGE:%s", cursor.statusmessage)
+    return True
+
+
+# upload logs, replacing the rows already loaded
+def merge_logs(logger, project, config, event_class, start, end, table_prefix=None, concurrency=None):
+    """
+    Like upload_logs, but a reload of a day does not need a delete_logs first. Each
+    table is COPYed into a staging table, the rows with the same id are deleted and
+    the staged rows inserted, all in one transaction. The stats are those of upload_logs.
+    """
+    aws_config = config["aws_config"]
+    s3_config = config["s3_config"]
+    if table_prefix:
+        table_prefix_for_sql = table_prefix + '_' + project + '_'
+    else:
+        table_prefix_for_sql = project + '_'
+    logger.info("Merging logs...")
+
+    def merge_class_logs(conn, cursor, event_class):
+        event_class_stats = []
+        event_class_name = T3_EVENT_CLASS_FILE_PREFIXES[event_class]
+        table_name = "%snm_%s" % (table_prefix_for_sql, event_class_name)
+        logger.info("Merging logs into table %s from %s to %s", table_name, start, end)
+        try:
+            staging_table = create_staging_table(cursor, table_name)
+            for date_prefix in get_T3_date_prefixes(start, end):
                 sql_statement = "COPY %s FROM 's3://%s/%s' \
                 CREDENTIALS 'aws_access_key_id=%s;aws_secret_access_key=%s' \
                 gzip maxerror 100000\
-                json 's3://%s/%s'" % (table_name, s3_config[event_class_name]["t3_bucket"], date_prefix,
+                json 's3://%s/%s'" % (staging_table, s3_config[event_class_name]["t3_bucket"], date_prefix,
                                       aws_config["aws_access_key_id"], aws_config["aws_secret_access_key"],
                                       s3_config[event_class_name]["t3_bucket"],
                                       s3_config[event_class_name]["t3_jsonpath"])
-                try:
-                    #logger.info(sql_statement)
-                    cursor.execute(sql_statement)
-                    logger.info("STATUS MESSAGE:%s",
-                                cursor.statusmessage)  # we dont get back a row count, no errors means we are good
-                    conn.commit()
-                    cursor.execute("select pg_last_copy_count();")
-                    rows = cursor.fetchall()
-                    rowsCopied = 0
-                    for row in rows:
-                        rowsCopied = row[0]
-                        event_class_stats.append(
-                            {"date": UtcDateTime(date_prefix).datetime.strftime('%Y-%m-%d'), "count": row[0]})
-                    logger.info("Copied %s rows of %s for %s", rowsCopied, event_class, date_prefix)
-                except Exception as err:
-                    logger.error(err)
-                    logger.error(traceback.format_exc())
-        conn.commit()
-        cursor.close()
-        conn.close()
+                cursor.execute(sql_statement)
+                logger.info("STATUS MESSAGE:%s", cursor.statusmessage)
+                cursor.execute("select pg_last_copy_count();")
+                rowsCopied = cursor.fetchone()[0]
+                event_class_stats.append({"date": UtcDateTime(date_prefix).datetime.strftime('%Y-%m-%d'),
+                                          "count": rowsCopied})
+                logger.info("Copied %s rows of %s for %s", rowsCopied, event_class, date_prefix)
+            replaced_count = merge_staged(logger, cursor, table_name, staging_table)
+            cursor.execute("drop table %s" % staging_table)
+            conn.commit()
+            logger.info("Replaced %d rows of %s", replaced_count, event_class)
+        except Exception as err:
+            conn.rollback()
+            # nothing was loaded
+            logger.error(err)
+            logger.error(traceback.format_exc())
+            return []
+        try:
+            vacuum_deleted_rows(logger, conn, cursor, table_name, replaced_count)
+        except Exception as err:
+            # the merge is committed, only the space of the replaced rows is not reclaimed yet
+            conn.rollback()
+            logger.error(err)
+            logger.error(traceback.format_exc())
+        return event_class_stats
+
+    upload_stats = {}
+    try:
+        upload_stats = for_each_event_class(logger, config, event_class, merge_class_logs, concurrency)
     except (BotoServerError, S3ResponseError, EC2ResponseError) as e:
         logger.error("Error :%s(%s):%s" % (e.error_code, e.status, e.message))
         logger.error(traceback.format_exc())
+    invalidate_db_cache(logger, project, config, start, end, lookback=manifest_date_lookback)
     return upload_stats
 
 
+def get_table_sql(config, event_class_name, table_prefix_for_sql):
+    with open(config["db_sql"][event_class_name], "r") as myfile:
+        table_sql = myfile.read()
+    return table_sql % table_prefix_for_sql
+
+
 # create tables
-def create_tables(logger, project, config, event_class, table_prefix=None):
-    upload_stats = {}
-    try:
-        logger.info("Creating connection...")
-        conn = create_db_conn(logger, config["db_config"])
-        conn.autocommit = False
-        cursor = conn.cursor()
-        logger.info("Creating tables...")
-        event_classes = T3_EVENT_CLASS_FILE_PREFIXES[event_class]
-        if not isinstance(event_classes, list):
-            event_classes = [event_class]
-        for event_class in event_classes:
-            event_class_stats = []
-            upload_stats[event_class] = event_class_stats
-            event_class_name = T3_EVENT_CLASS_FILE_PREFIXES[event_class]
-            table_sql_file = config["db_sql"][event_class_name]
-            with open(table_sql_file, "r") as myfile:
-                table_sql = myfile.read()
-            table_prefix_for_sql = "%s_%s_" % (table_prefix, project) if table_prefix else "%s_" % project
-            table_sql = table_sql % table_prefix_for_sql
-            logger.info(table_sql)
-            cursor.execute(table_sql)
-            logger.info("STATUS MESSAGE:%s", cursor.statusmessage)  # we dont get back a row count, no errors means we are good
+def create_tables(logger, project, config, event_class, table_prefix=None, concurrency=None):
+    logger.info("Creating tables...")
+
+    def create_class_table(conn, cursor, event_class):
+        event_class_name = T3_EVENT_CLASS_FILE_PREFIXES[event_class]
+        table_prefix_for_sql = "%s_%s_" % (table_prefix, project) if table_prefix else "%s_" % project
+        table_sql = get_table_sql(config, event_class_name, table_prefix_for_sql)
+        logger.info(table_sql)
+        cursor.execute(table_sql)
+        logger.info("STATUS MESSAGE:%s", cursor.statusmessage)  # we dont get back a row count, no errors means we are good
         conn.commit()
-        cursor.close()
-        conn.close()
+        return []
+
+    try:
+        for_each_event_class(logger, config, event_class, create_class_table, concurrency)
     except (BotoServerError, S3ResponseError, EC2ResponseError) as e:
         logger.error("Error :%s(%s):%s" % (e.error_code, e.status, e.message))
         logger.error(traceback.format_exc())
 
 
+# The sort key of the tables created from config/db/nm_*.sql. Tables created before it was added are migrated.
+nm_sortkey = ['timestamped', 'device_id']
+
+
+def get_sortkey(cursor, table_name):
+    """
+    Return the sort key columns of table_name, in order.
+    """
+    cursor.execute("select \"column\" from pg_table_def where tablename = %s and sortkey > 0 order by sortkey",
+                   (table_name.lower(),))
+    return [row[0] for row in cursor.fetchall()]
+
+
+# migrate tables
+def migrate_tables(logger, project, config, event_class, table_prefix=None, concurrency=None, keep_old=False):
+    """
+    Deep copy each table that does not have the sort key of its DDL file (nm_sortkey)
+    into a new table created from the DDL, then swap the two. A single INSERT ... SELECT
+    into the empty table sorts and encodes all the rows, so no VACUUM is needed. The old
+    table is kept as <table>_old if keep_old. Loads into a table wait while it is copied.
+    The stats have one entry per migrated table, with the number of rows copied.
+    """
+    if table_prefix:
+        table_prefix_for_sql = table_prefix + '_' + project + '_'
+    else:
+        table_prefix_for_sql = project + '_'
+    logger.info("Migrating tables...")
+
+    def migrate_class_table(conn, cursor, event_class):
+        event_class_stats = []
+        event_class_name = T3_EVENT_CLASS_FILE_PREFIXES[event_class]
+        table_name = "%snm_%s" % (table_prefix_for_sql, event_class_name)
+        try:
+            sortkey = get_sortkey(cursor, table_name)
+            if sortkey == nm_sortkey:
+                logger.info("%s is up to date", table_name)
+                conn.commit()
+                return event_class_stats
+            new_table_name = "%smigrate_nm_%s" % (table_prefix_for_sql, event_class_name)
+            old_table_name = "%s_old" % table_name
+            logger.info("Migrating %s (sort key %s)", table_name, sortkey)
+            cursor.execute("drop table if exists %s" % new_table_name)
+            cursor.execute(get_table_sql(config, event_class_name, table_prefix_for_sql + 'migrate_'))
+            cursor.execute("insert into %s select * from %s" % (new_table_name, table_name))
+            rowsCopied = cursor.rowcount
+            cursor.execute("drop table if exists %s" % old_table_name)
+            cursor.execute("alter table %s rename to %s" % (table_name, old_table_name))
+            cursor.execute("alter table %s rename to %s" % (new_table_name, table_name))
+            if not keep_old:
+                cursor.execute("drop table %s" % old_table_name)
+            conn.commit()
+            event_class_stats.append({"table": table_name, "count": rowsCopied})
+            logger.info("Copied %s rows of %s", rowsCopied, table_name)
+        except Exception as err:
+            conn.rollback()
+            logger.error(err)
+            logger.error(traceback.format_exc())
+        return event_class_stats
+
+    migrate_stats = {}
+    try:
+        migrate_stats = for_each_event_class(logger, config, event_class, migrate_class_table, concurrency)
+    except (BotoServerError, S3ResponseError, EC2ResponseError) as e:
+        logger.error("Error :%s(%s):%s" % (e.error_code, e.status, e.message))
+        logger.error(traceback.format_exc())
+    return migrate_stats
+
+
+# Rollups are recomputed from this much before the loaded span: the files of a day (or
+# modified since a watermark) hold events up to manifest_date_lookback older
+rollup_lookback = manifest_date_lookback
+
+# The build of each device, from its latest device info before end
+device_build_sql = "select device_id, build_version from (" \
+                   "select device_id, build_version, " \
+                   "row_number() over (partition by device_id order by timestamped desc) as n " \
+                   "from %(prefix)snm_device_info where timestamped < %%(end)s) as d where n = 1"
+
+# Hourly rollups: (db_sql name, source event class, statement). Each statement inserts the rollup
+# rows of the hours in [start, end). %(prefix)s is the table prefix.
+rollup_tables = [
+    ('log_hourly', 'LOG',
+     "insert into %(prefix)snm_log_hourly (hour, event_type, build_version, event_count, device_count) "
+     "select date_trunc('hour', e.timestamped), e.event_type, coalesce(b.build_version, ''), "
+     "count(*), count(distinct e.device_id) from %(prefix)snm_log e left join (" + device_build_sql + ") as b "
+     "on e.device_id = b.device_id where e.timestamped >= %%(start)s and e.timestamped < %%(end)s "
+     "group by 1, 2, 3"),
+    ('active_devices_hourly', 'LOG',
+     "insert into %(prefix)snm_active_devices_hourly (hour, build_version, device_count) "
+     "select date_trunc('hour', e.timestamped), coalesce(b.build_version, ''), count(distinct e.device_id) "
+     "from %(prefix)snm_log e left join (" + device_build_sql + ") as b "
+     "on e.device_id = b.device_id where e.timestamped >= %%(start)s and e.timestamped < %%(end)s "
+     "group by 1, 2"),
+    ('counter_hourly', 'COUNTER',
+     "insert into %(prefix)snm_counter_hourly (hour, counter_name, count_sum, event_count, device_count) "
+     "select date_trunc('hour', timestamped), coalesce(counter_name, ''), coalesce(sum(count), 0), count(*), "
+     "count(distinct device_id) from %(prefix)snm_counter "
+     "where timestamped >= %%(start)s and timestamped < %%(end)s group by 1, 2"),
+]
+
+
+def get_rollup_span(start, end):
+    """
+    Return the hours [start, end) whose rollups are recomputed after loading [start, end].
+    """
+    start = (start.datetime - rollup_lookback).replace(minute=0, second=0, microsecond=0, tzinfo=None)
+    end_hour = end.datetime.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+    if end_hour < end.datetime.replace(tzinfo=None):
+        end_hour += timedelta(hours=1)
+    return start, end_hour
+
+
+# update rollups
+def update_rollups(logger, project, config, event_class, start, end, table_prefix=None):
+    """
+    Recompute the hourly rollups of the event classes of event_class for the span
+    loaded. The rollup rows of each hour are deleted and inserted again from the
+    event table in one transaction, so that a rollup is never half updated. The
+    stats have one entry per rollup table, with the number of rows inserted.
+    """
+    if table_prefix:
+        table_prefix_for_sql = table_prefix + '_' + project + '_'
+    else:
+        table_prefix_for_sql = project + '_'
+    event_classes = T3_EVENT_CLASS_FILE_PREFIXES[event_class]
+    if not isinstance(event_classes, list):
+        event_classes = [event_class]
+    (rollup_start, rollup_end) = get_rollup_span(start, end)
+    params = {'start': rollup_start.strftime('%Y-%m-%d %H:%M:%S'), 'end': rollup_end.strftime('%Y-%m-%d %H:%M:%S')}
+    window = "%s - %s" % (params['start'], params['end'])
+    rollup_stats = {}
+    logger.info("Updating rollups from %s to %s...", rollup_start, rollup_end)
+    conn = get_db_conn(logger, config["db_config"])
+    conn.autocommit = False
+    cursor = conn.cursor()
+    try:
+        for (rollup_name, source_class, sql_statement) in rollup_tables:
+            if source_class not in event_classes:
+                continue
+            table_name = "%snm_%s" % (table_prefix_for_sql, rollup_name)
+            try:
+                cursor.execute(get_table_sql(config, rollup_name, table_prefix_for_sql))
+                cursor.execute("delete from %s where hour >= %%(start)s and hour < %%(end)s" % table_name, params)
+                cursor.execute(sql_statement % {'prefix': table_prefix_for_sql}, params)
+                rowsInserted = cursor.rowcount
+                conn.commit()
+                rollup_stats[rollup_name] = [{"date": window, "count": rowsInserted}]
+                logger.info("Inserted %s rows into %s for %s", rowsInserted, table_name, window)
+            except Exception as err:
+                conn.rollback()
+                logger.error(err)
+                logger.error(traceback.format_exc())
+    finally:
+        cursor.close()
+        release_db_conn(conn)
+    invalidate_db_cache(logger, project, config, rollup_start, rollup_end)
+    return rollup_stats
+
+
 def list_tables(logger, config):
     logger.info("Listing tables...")
-    conn = create_db_conn(logger, config["db_config"])
+    conn = get_db_conn(logger, config["db_config"])
     conn.autocommit = False
     cursor = conn.cursor()
     sql_statement = "SELECT table_schema,table_name FROM information_schema.tables ORDER BY table_schema,table_name;"
@@ -221,7 +856,7 @@ def list_tables(logger, config):
         tables = select(logger, cursor, sql_statement)
         conn.commit()
         cursor.close()
-        conn.close()
+        release_db_conn(conn)
         return tables
     except Exception as err:
         logger.error(err)
@@ -231,7 +866,7 @@ def list_tables(logger, config):
 def delete_tables(logger, project, config, table_prefix):
     try:
         logger.info("Creating connection...")
-        conn = create_db_conn(logger, config["db_config"])
+        conn = get_db_conn(logger, config["db_config"])
         conn.autocommit = False
         cursor = conn.cursor()
         logger.info("Deleting tables...")
@@ -249,7 +884,59 @@ def delete_tables(logger, project, config, table_prefix):
                 logger.error(traceback.format_exc())
         conn.commit()
         cursor.close()
-        conn.close()
+        release_db_conn(conn)
     except (BotoServerError, S3ResponseError, EC2ResponseError) as e:
         logger.error("Error :%s(%s):%s" % (e.error_code, e.status, e.message))
         logger.error(traceback.format_exc())
+
+
+def is_fully_loaded(event_classes, start, end, upload_stats):
+    """
+    Whether upload_logs or merge_logs loaded every date prefix of start to end into
+    every table. Both leave out the stats of what failed.
+    """
+    date_count = len(get_T3_date_prefixes(start, end))
+    return all([len(upload_stats.get(ev_class, [])) == date_count for ev_class in event_classes])
+
+
+def are_rollups_updated(event_classes, rollup_stats):
+    return all([rollup_name in rollup_stats for (rollup_name, source_class, sql_statement) in rollup_tables
+                if source_class in event_classes])
+
+
+# load_logs() modes
+load_modes = ('merge', 'copy', 'delete', 'incremental')
+
+
+def load_logs(logger, project, config, event_class, start, end, table_prefix=None, concurrency=None, mode='merge',
+              rollups=True):
+    """
+    Load the logs of [start, end] the way T3RedShiftLoader does: merge_logs, upload_logs
+    ("copy"), delete_logs then upload_logs ("delete") or upload_logs_incremental, then
+    update the rollups of the hours the load may have changed. Return the upload stats
+    and the end of what is now completely loaded, or None if anything failed.
+    """
+    assert mode in load_modes
+    event_classes = T3_EVENT_CLASS_FILE_PREFIXES[event_class]
+    if not isinstance(event_classes, list):
+        event_classes = [event_class]
+    if mode == 'incremental':
+        rollup_end = get_settled_end(end)
+        (upload_stats, rollup_start, loaded_end) = upload_logs_incremental(logger, project, config, event_class,
+                                                                           start, rollup_end, table_prefix,
+                                                                           concurrency)
+    else:
+        if mode == 'merge':
+            upload_stats = merge_logs(logger, project, config, event_class, start, end, table_prefix, concurrency)
+        else:
+            if mode == 'delete':
+                delete_logs(logger, project, config, event_class, start, end, table_prefix, concurrency)
+            upload_stats = upload_logs(logger, project, config, event_class, start, end, table_prefix, concurrency)
+        (rollup_start, rollup_end) = (start, end)
+        loaded_end = end if is_fully_loaded(event_classes, start, end, upload_stats) else None
+    # nothing to roll up if an incremental load found nothing new
+    if rollups and rollup_start is not None:
+        rollup_stats = update_rollups(logger, project, config, event_class, rollup_start, rollup_end, table_prefix)
+        if not are_rollups_updated(event_classes, rollup_stats):
+            loaded_end = None
+    return upload_stats, loaded_end
@@ -0,0 +1,276 @@
+# Copyright 2015, NachoCove, Inc
+from array import array
+from collections import Counter, MutableMapping
+from datetime import datetime, timedelta
+
+import pytz
+
+from misc.utc_datetime import UtcDateTime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+# array has no 64-bit integer type code that is 64-bit everywhere. Fall back to
+# doubles, which hold microseconds since 1970 exactly for the next couple of centuries.
+INT64_TYPECODE = 'l' if array('l').itemsize == 8 else 'd'
+MISSING_INT = -2 ** 53
+
+
+class T3EventBatch(object):
+    """
+    A column-oriented container for T3 events.
+
+    A list of event dicts repeats every field name and holds a UtcDateTime per
+    timestamp, which adds up to gigabytes for a day of LOG events. Here, timestamps
+    and thread ids are 64-bit integer arrays, the low-cardinality string fields
+    are interned (an array of codes into a list of distinct values), and the text
+    fields are one UTF-8 buffer with an array of offsets. Any other field, or a
+    value that does not fit its column, is kept in a small per-row dict.
+
+    Iterating over the batch (or indexing it) gives T3EventRow views that behave
+    like the event dicts. Code that only counts or groups should use column(),
+    counts() and unique() instead, which work on the arrays (with NumPy if it is
+    installed).
+
+    If fields is given, only those fields are kept ('timestamp' always is).
+    """
+    TIME_COLUMNS = ('timestamp', 'uploaded_at')
+    INT_COLUMNS = ('thread_id',)
+    STRING_COLUMNS = ('event_type', 'module', 'client', 'user_id', 'device_id')
+    TEXT_COLUMNS = ('id', 'message')
+
+    def __init__(self, fields=None):
+        self.fields = None if fields is None else frozenset(fields) | frozenset(['timestamp'])
+        self.length = 0
+        self.ints = dict()
+        for name in self.TIME_COLUMNS + self.INT_COLUMNS:
+            if self._keeps(name):
+                self.ints[name] = array(INT64_TYPECODE)
+        self.codes = dict()
+        self.values = dict()
+        self.value_codes = dict()
+        for name in self.STRING_COLUMNS:
+            if self._keeps(name):
+                self.codes[name] = array('i')
+                self.values[name] = []
+                self.value_codes[name] = dict()
+        self.texts = dict()
+        self.offsets = dict()
+        self.missing_texts = dict()
+        for name in self.TEXT_COLUMNS:
+            if self._keeps(name):
+                self.texts[name] = bytearray()
+                self.offsets[name] = array(INT64_TYPECODE, [0])
+                self.missing_texts[name] = set()
+        self.extras = dict()
+
+    def _keeps(self, name):
+        return self.fields is None or name in self.fields
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += self.length
+        if not 0 <= n < self.length:
+            raise IndexError('event index out of range')
+        return T3EventRow(self, n)
+
+    def __iter__(self):
+        for n in xrange(self.length):
+            yield T3EventRow(self, n)
+
+    def append(self, ev):
+        """
+        Add an event dict, as yielded by iter_client_events(). The dict is not kept.
+        """
+        n = self.length
+        extras = dict()
+        for (name, column) in self.ints.items():
+            value = ev.get(name)
+            if name in self.TIME_COLUMNS and isinstance(value, UtcDateTime):
+                column.append(value.epoch_us)
+            elif name in self.INT_COLUMNS and isinstance(value, (int, long)) and not isinstance(value, bool) \
+                    and -2 ** 53 < value < 2 ** 53:
+                column.append(value)
+            else:
+                column.append(MISSING_INT)
+                if name in ev:
+                    extras[name] = value
+        for (name, codes) in self.codes.items():
+            value = ev.get(name)
+            if isinstance(value, basestring):
+                codes.append(self._intern(name, value))
+            else:
+                codes.append(-1)
+                if name in ev:
+                    extras[name] = value
+        for (name, text) in self.texts.items():
+            value = ev.get(name)
+            if isinstance(value, unicode):
+                text.extend(value.encode('utf-8'))
+            else:
+                self.missing_texts[name].add(n)
+                if name in ev:
+                    extras[name] = value
+            self.offsets[name].append(len(text))
+        for (name, value) in ev.iteritems():
+            if name not in self.ints and name not in self.codes and name not in self.texts and self._keeps(name):
+                extras[name] = value
+        if extras:
+            self.extras[n] = extras
+        self.length += 1
+
+    def _intern(self, name, value):
+        code = self.value_codes[name].get(value)
+        if code is None:
+            code = len(self.values[name])
+            self.values[name].append(value)
+            self.value_codes[name][value] = code
+        return code
+
+    def extend(self, events):
+        for ev in events:
+            self.append(ev)
+
+    def get_value(self, n, name):
+        """
+        Return the value of field name of event n. Raise KeyError if the event does not have it.
+        """
+        extras = self.extras.get(n)
+        if extras is not None and name in extras:
+            return extras[name]
+        if name in self.ints:
+            value = self.ints[name][n]
+            if value != MISSING_INT:
+                if name in self.TIME_COLUMNS:
+                    return UtcDateTime(EPOCH + timedelta(microseconds=value))
+                return int(value)
+        elif name in self.codes:
+            code = self.codes[name][n]
+            if code >= 0:
+                return self.values[name][code]
+        elif name in self.texts:
+            if n not in self.missing_texts[name]:
+                offsets = self.offsets[name]
+                return self.texts[name][int(offsets[n]):int(offsets[n + 1])].decode('utf-8')
+        raise KeyError(name)
+
+    def set_value(self, n, name, value):
+        """
+        Set field name of event n. Only a string column is updated in place, any
+        other value is kept in the row's dict.
+        """
+        self.del_value(n, name, missing_ok=True)
+        if name in self.codes and isinstance(value, basestring):
+            self.codes[name][n] = self._intern(name, value)
+        else:
+            self.extras.setdefault(n, dict())[name] = value
+
+    def del_value(self, n, name, missing_ok=False):
+        extras = self.extras.get(n)
+        if extras is not None and name in extras:
+            del extras[name]
+            if not extras:
+                del self.extras[n]
+        elif not missing_ok:
+            self.get_value(n, name)  # KeyError if not there
+        if name in self.ints:
+            self.ints[name][n] = MISSING_INT
+        elif name in self.codes:
+            self.codes[name][n] = -1
+        elif name in self.texts:
+            self.missing_texts[name].add(n)
+
+    def row_fields(self, n):
+        fields = []
+        extras = self.extras.get(n, {})
+        for name in self.ints.keys() + self.codes.keys() + self.texts.keys():
+            if name not in extras:
+                try:
+                    self.get_value(n, name)
+                except KeyError:
+                    continue
+                fields.append(name)
+        fields.extend(extras.keys())
+        return fields
+
+    def column(self, name):
+        """
+        Return the values of a timestamp or integer column (as microseconds since 1970 for
+        timestamps) or the codes of a string column, as a NumPy array if NumPy is available.
+        Missing values are MISSING_INT or -1 respectively. The array shares the batch memory,
+        so it is only valid until the next append().
+        """
+        if name in self.ints:
+            column = self.ints[name]
+        elif name in self.codes:
+            column = self.codes[name]
+        else:
+            raise ValueError('%s is not an array column' % name)
+        if numpy is None:
+            return column
+        if not len(column):
+            return numpy.zeros(0, dtype=numpy.dtype(column.typecode))
+        return numpy.frombuffer(column, dtype=numpy.dtype(column.typecode))
+
+    def counts(self, name):
+        """
+        Return a dict of the number of events for each value of a string column.
+        """
+        if name not in self.codes:
+            raise ValueError('%s is not a string column' % name)
+        values = self.values[name]
+        if numpy is not None and values:
+            codes = self.column(name)
+            codes = codes[codes >= 0]
+            result = Counter(dict((values[code], int(count))
+                                  for (code, count) in enumerate(numpy.bincount(codes, minlength=len(values)))
+                                  if count))
+        else:
+            result = Counter(values[code] for code in self.codes[name] if code >= 0)
+        for extras in self.extras.values():
+            if name in extras:
+                result[extras[name]] += 1
+        return dict(result)
+
+    def unique(self, name):
+        """
+        Return the set of values of a string column.
+        """
+        return set(self.counts(name).keys())
+
+
+class T3EventRow(MutableMapping):
+    """
+    A dict-like view of one event of a T3EventBatch. Changes made through the view
+    are made to the batch.
+    """
+    __slots__ = ('batch', 'n')
+
+    def __init__(self, batch, n):
+        self.batch = batch
+        self.n = n
+
+    def __getitem__(self, name):
+        return self.batch.get_value(self.n, name)
+
+    def __setitem__(self, name, value):
+        self.batch.set_value(self.n, name, value)
+
+    def __delitem__(self, name):
+        self.batch.del_value(self.n, name)
+
+    def __iter__(self):
+        return iter(self.batch.row_fields(self.n))
+
+    def __len__(self):
+        return len(self.batch.row_fields(self.n))
+
+    def __repr__(self):
+        return repr(dict(self.items()))
@@ -0,0 +1,138 @@
+# Copyright 2015, NachoCove, Inc
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# The process-wide cache used by the T3 readers. None means every file is fetched from S3.
+_t3_file_cache = None
+
+
+def set_t3_file_cache(cache):
+    global _t3_file_cache
+    assert cache is None or isinstance(cache, T3FileCache)
+    _t3_file_cache = cache
+
+
+def get_t3_file_cache():
+    return _t3_file_cache
+
+
+class T3FileCache(object):
+    """
+    A local cache of T3 files.
+
+    T3 files are never modified after upload, so an entry is keyed by bucket, key
+    name and ETag and never needs to be revalidated. The compressed files are kept
+    on disk (shared by all processes using the same cache_dir) and the least
+    recently used ones are evicted once the directory grows past max_size bytes.
+    Optionally, up to memory_size bytes of compressed files are also kept in memory.
+    """
+    def __init__(self, cache_dir, max_size=2*1024*1024*1024, memory_size=0, logger=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.memory_size = memory_size
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.disk_used = None
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @staticmethod
+    def cache_key(bucket_name, key_name, etag):
+        return hashlib.sha256('%s/%s/%s' % (bucket_name, key_name, etag.strip('"'))).hexdigest()
+
+    def path(self, cache_key):
+        return os.path.join(self.cache_dir, cache_key[0:2], cache_key + '.gz')
+
+    def get_compressed(self, bucket_name, key_name, etag, fetch):
+        """
+        Return the compressed T3 file. fetch() is called to get it from S3 if it is
+        not cached. The readers stream the decompression (see AWS.s3t3_fetch).
+        """
+        if not etag:
+            return fetch()
+        cache_key = self.cache_key(bucket_name, key_name, etag)
+        with self.lock:
+            data = self.memory.pop(cache_key, None)
+            if data is not None:
+                self.memory[cache_key] = data
+                return data
+        path = self.path(cache_key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, None)  # mtime is the LRU clock
+        except (IOError, OSError):
+            data = fetch()
+            self._write(path, data)
+        self._remember(cache_key, data)
+        return data
+
+    def _remember(self, cache_key, data):
+        if not self.memory_size or len(data) > self.memory_size:
+            return
+        with self.lock:
+            if cache_key in self.memory:
+                return
+            self.memory[cache_key] = data
+            self.memory_used += len(data)
+            while self.memory_used > self.memory_size:
+                (old_key, old_data) = self.memory.popitem(last=False)
+                self.memory_used -= len(old_data)
+
+    def _write(self, path, data):
+        dir_name = os.path.dirname(path)
+        try:
+            if not os.path.exists(dir_name):
+                os.makedirs(dir_name)
+            # write to a temporary file and rename, so other processes never see a partial file
+            (fd, tmp_path) = tempfile.mkstemp(dir=dir_name, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            if self.logger:
+                self.logger.warn("Could not cache %s: %s", path, e)
+            return
+        with self.lock:
+            if self.disk_used is None:
+                self.disk_used = self._scan()[1]
+            else:
+                self.disk_used += len(data)
+            if self.disk_used > self.max_size:
+                self._evict()
+
+    def _scan(self):
+        files = []
+        total = 0
+        for dir_path, dir_names, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                file_path = os.path.join(dir_path, file_name)
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, file_path))
+                total += st.st_size
+        return files, total
+
+    def _evict(self):
+        # other processes may share the directory, so start from what is actually there
+        files, total = self._scan()
+        # evict down to 90% so that we don't rescan on every write
+        target = self.max_size * 9 / 10
+        for (mtime, size, file_path) in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.unlink(file_path)
+                total -= size
+            except OSError:
+                pass
+        self.disk_used = total
+        if self.logger:
+            self.logger.debug("T3 file cache %s trimmed to %d bytes", self.cache_dir, total)
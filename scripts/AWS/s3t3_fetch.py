@@ -0,0 +1,238 @@
+# Copyright 2015, NachoCove, Inc
+import Queue
+import sys
+import zlib
+
+from boto.s3.connection import S3Connection
+
+from AWS.s3_telemetry import create_s3_conn
+from AWS.s3t3_cache import get_t3_file_cache
+from misc.threadpool import ThreadPool, ThreadPoolThread
+
+# Default number of concurrent S3 GETs. 1 (or less) means fetch sequentially in the caller's thread.
+T3_FETCH_CONCURRENCY = 8
+
+# Size of the reads from S3 and of each piece of decompressed output when streaming a T3 file.
+T3_READ_CHUNK_SIZE = 64 * 1024
+
+
+def clone_s3_conn(conn):
+    """
+    boto connections are not thread-safe. Create a new connection with the same
+    credentials and endpoint for use in another thread.
+    """
+    assert isinstance(conn, S3Connection)
+    return create_s3_conn(conn.aws_access_key_id, conn.aws_secret_access_key,
+                          security_token=conn.provider.security_token,
+                          host=conn.host, port=conn.port)
+
+
+def get_t3_file_data(key):
+    """
+    Return the compressed T3 file.
+    """
+    cache = get_t3_file_cache()
+    if cache is not None:
+        return cache.get_compressed(key.bucket.name, key.name, key.etag, key.get_contents_as_string)
+    return key.get_contents_as_string()
+
+
+def iter_t3_file_lines(key):
+    """
+    Yield the lines of a T3 file. Without a file cache, the file is decompressed as
+    it is read from S3, so it is never held in memory as a whole.
+    """
+    if get_t3_file_cache() is not None:
+        return iter_gzip_lines(iter_chunks(get_t3_file_data(key)))
+    return iter_gzip_lines(iter_key_chunks(key))
+
+
+def iter_chunks(data):
+    for start in xrange(0, len(data), T3_READ_CHUNK_SIZE):
+        yield data[start:start + T3_READ_CHUNK_SIZE]
+
+
+def iter_key_chunks(key):
+    try:
+        while True:
+            chunk = key.read(T3_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        key.close()
+
+
+def iter_gzip_lines(chunks):
+    """
+    Decompress a gzip stream given as an iterable of chunks and yield its lines
+    without the line breaks. At most T3_READ_CHUNK_SIZE bytes are decompressed at a time.
+    """
+    decompressor = zlib.decompressobj(16+zlib.MAX_WBITS)
+    partial = ''
+    for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk, T3_READ_CHUNK_SIZE)
+            chunk = decompressor.unconsumed_tail
+            if not data:
+                continue
+            lines = data.split('\n')
+            lines[0] = partial + lines[0]
+            partial = lines.pop()
+            for line in lines:
+                yield line
+    lines = (partial + decompressor.flush()).split('\n')
+    for line in lines:
+        if line:
+            yield line
+
+
+class S3FetchThread(ThreadPoolThread):
+    def __init__(self, conn, bucket_name, results):
+        ThreadPoolThread.__init__(self)
+        self.daemon = True
+        self.conn = conn
+        self.bucket_name = bucket_name
+        self.bucket = None
+        self.results = results
+
+    def start(self):
+        self.conn = clone_s3_conn(self.conn)
+        self.bucket = self.conn.get_bucket(self.bucket_name, validate=False)
+        ThreadPoolThread.start(self)
+
+    def process(self, obj):
+        (n, key_name, etag) = obj
+        try:
+            key = self.bucket.new_key(key_name)
+            key.etag = etag
+            data = get_t3_file_data(key)
+            self.results.put((n, data, None))
+        except Exception:
+            self.results.put((n, None, sys.exc_info()))
+
+
+def fetch_t3_files(conn, bucket_name, jobs, concurrency=None, logger=None):
+    """
+    Download T3 files with up to <concurrency> GETs in flight.
+
+    jobs is an iterable of tuples whose first element is a boto Key of bucket_name.
+    It is consumed lazily, so listing the bucket overlaps with downloading.
+    Yields (job, lines) in the same order as jobs, where lines iterates over the lines
+    of the file. The files are held compressed and only decompressed as lines is
+    consumed, which must be done before the next file is asked for.
+    """
+    if concurrency is None:
+        concurrency = T3_FETCH_CONCURRENCY
+    if concurrency <= 1:
+        for job in jobs:
+            yield job, iter_t3_file_lines(job[0])
+        return
+
+    requests = Queue.Queue()
+    results = Queue.Queue()
+    thread_pool = ThreadPool(concurrency, S3FetchThread, conn, bucket_name, results)
+    for thread in thread_pool.threads:
+        # all threads pull from one queue so that the oldest outstanding request is always worked on first
+        thread.obj_queue = requests
+    thread_pool.start()
+
+    # Never have more than <window> files downloaded but not yet consumed
+    window = 2 * concurrency
+    jobs = iter(jobs)
+    pending = dict()
+    fetched = dict()
+    next_request = 0
+    next_result = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and next_request - next_result < window:
+                try:
+                    job = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[next_request] = job
+                requests.put((next_request, job[0].name, job[0].etag))
+                next_request += 1
+            if next_result == next_request:
+                break
+            while next_result not in fetched:
+                (n, data, exc_info) = results.get()
+                fetched[n] = (data, exc_info)
+            (data, exc_info) = fetched.pop(next_result)
+            if exc_info is not None:
+                if logger:
+                    logger.error("Could not fetch s3://%s/%s: %s", bucket_name, pending[next_result][0].name, exc_info[1])
+                raise exc_info[0], exc_info[1], exc_info[2]
+            yield pending.pop(next_result), iter_gzip_lines(iter_chunks(data))
+            next_result += 1
+    finally:
+        # drop whatever is still queued (early exit or error) and stop the threads
+        while True:
+            try:
+                requests.get_nowait()
+            except Queue.Empty:
+                break
+        for thread in thread_pool.threads:
+            requests.put(None)
+
+
+class S3PrefixThread(ThreadPoolThread):
+    def __init__(self, conn, bucket_name, depth, prefixes, errors):
+        ThreadPoolThread.__init__(self)
+        self.daemon = True
+        self.conn = conn
+        self.bucket_name = bucket_name
+        self.bucket = None
+        self.depth = depth
+        self.prefixes = prefixes
+        self.errors = errors
+
+    def start(self):
+        self.conn = clone_s3_conn(self.conn)
+        self.bucket = self.conn.get_bucket(self.bucket_name, validate=False)
+        ThreadPoolThread.start(self)
+
+    def process(self, obj):
+        (prefix, level) = obj
+        try:
+            for entry in self.bucket.list(prefix=prefix, delimiter='/'):
+                if level + 1 < self.depth:
+                    self.obj_queue.put((entry.name, level + 1))
+                else:
+                    self.prefixes.append(entry.name)
+        except Exception:
+            self.errors.append(sys.exc_info())
+        finally:
+            self.obj_queue.task_done()
+
+
+def crawl_prefixes(conn, bucket_name, prefix, depth, concurrency=None, logger=None):
+    """
+    Return the names <depth> levels of '/' below prefix (e.g. date/hash/user/device/
+    for a date prefix and a depth of 3), sorted. Each level is listed with a
+    delimiter, with up to <concurrency> LISTs in flight.
+    """
+    if concurrency is None:
+        concurrency = T3_FETCH_CONCURRENCY
+    concurrency = max(concurrency, 1)
+    requests = Queue.Queue()
+    prefixes = []
+    errors = []
+    thread_pool = ThreadPool(concurrency, S3PrefixThread, conn, bucket_name, depth, prefixes, errors)
+    for thread in thread_pool.threads:
+        thread.obj_queue = requests
+    thread_pool.start()
+    requests.put((prefix, 0))
+    requests.join()
+    for thread in thread_pool.threads:
+        requests.put(None)
+    if errors:
+        exc_info = errors[0]
+        if logger:
+            logger.error("Could not list s3://%s/%s: %s", bucket_name, prefix, exc_info[1])
+        raise exc_info[0], exc_info[1], exc_info[2]
+    return sorted(prefixes)
+
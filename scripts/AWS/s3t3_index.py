@@ -0,0 +1,206 @@
+# Copyright 2015, NachoCove, Inc
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+# A date prefix is considered complete once this long has passed since the end of the day.
+# Files can land in a date prefix a few days late (see manifest_date_lookback in redshift_handler).
+T3_INDEX_SEAL_DELAY = timedelta(days=3)
+# How often a prefix that is not complete nor ordered is listed again. New keys can land anywhere
+# under it, so each refresh is a full listing. Keep it under manifest_settle_time in redshift_handler.
+T3_INDEX_MAX_AGE = timedelta(minutes=5)
+
+# The process-wide key index used by the T3 readers. None means every listing goes to S3.
+_t3_key_index = None
+
+
+def set_t3_key_index(index):
+    global _t3_key_index
+    assert index is None or isinstance(index, T3KeyIndex)
+    _t3_key_index = index
+
+
+def get_t3_key_index():
+    return _t3_key_index
+
+
+def list_t3_keys(bucket, prefix, ordered=False, marker=''):
+    """
+    List the keys of a bucket under prefix and after marker, from the key index if one is set.
+
+    ordered means new keys under prefix always sort after the existing ones (e.g.
+    the files of one device and class, or the pinger logs of a day), so a refresh
+    only needs to list what comes after the last key seen.
+    """
+    index = get_t3_key_index()
+    if index is None:
+        return bucket.list(prefix=prefix, marker=marker)
+    return index.list(bucket, prefix, ordered=ordered, marker=marker)
+
+
+class T3KeyIndex(object):
+    """
+    A local SQLite index of the keys of the T3 buckets.
+
+    Each listing prefix remembers the last key seen and when it was last listed.
+    Once a listing has been done after its date prefix is sealed (T3_INDEX_SEAL_DELAY
+    after the end of the day), the prefix and everything under it are served from
+    the index without going to S3. Until then an ordered prefix is refreshed by listing
+    only the keys after the last one seen, and any other prefix at most every max_age.
+    """
+    CLIENT_KEY_REGEX = re.compile(r'^(?P<date>\d{8})/\w+/(?P<user_id>[^/]+)/(?P<device_id>[^/]+)/NachoMail/'
+                                  r'(?P<event_class>\w+)-(?P<created_at>\d+)\.gz$')
+    PINGER_KEY_REGEX = re.compile(r'^(?P<date>\d{8})/(?P<event_class>plog)-(?P<created_at>\d+)\.gz$')
+
+    TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS t3_keys ("
+        "bucket TEXT NOT NULL, name TEXT NOT NULL, date TEXT, user_id TEXT, device_id TEXT, event_class TEXT, "
+        "created_at TEXT, last_modified TEXT, etag TEXT, size INTEGER, PRIMARY KEY (bucket, name))",
+        "CREATE TABLE IF NOT EXISTS t3_listings ("
+        "bucket TEXT NOT NULL, prefix TEXT NOT NULL, date TEXT, marker TEXT, listed_at TEXT, "
+        "PRIMARY KEY (bucket, prefix))",
+        "CREATE INDEX IF NOT EXISTS t3_keys_device ON t3_keys (bucket, device_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS t3_keys_user ON t3_keys (bucket, user_id, created_at)",
+    )
+
+    def __init__(self, db_path, seal_delay=None, max_age=None, logger=None):
+        self.db_path = db_path
+        self.seal_delay = seal_delay if seal_delay is not None else T3_INDEX_SEAL_DELAY
+        self.max_age = max_age if max_age is not None else T3_INDEX_MAX_AGE
+        self.logger = logger
+        self.lock = threading.Lock()
+        dir_name = os.path.dirname(self.db_path)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        # one connection shared by all threads of this process, serialized by self.lock
+        self.db = sqlite3.connect(self.db_path, timeout=60, check_same_thread=False)
+        with self.lock:
+            for statement in self.SCHEMA:
+                self.db.execute(statement)
+            self.db.commit()
+
+    @classmethod
+    def parse_key_name(cls, name):
+        """
+        Return (date, user_id, device_id, event_class, created_at) for a T3 key name.
+        Fields that do not apply are None.
+        """
+        m = cls.CLIENT_KEY_REGEX.match(name)
+        if m is not None:
+            return m.group('date'), m.group('user_id'), m.group('device_id'), m.group('event_class'), m.group('created_at')
+        m = cls.PINGER_KEY_REGEX.match(name)
+        if m is not None:
+            return m.group('date'), None, None, m.group('event_class'), m.group('created_at')
+        return name[0:8], None, None, None, None
+
+    def is_sealed(self, date, listed_at):
+        try:
+            day_end = datetime.strptime(date, '%Y%m%d') + timedelta(days=1)
+        except ValueError:
+            # not a date prefix. never complete
+            return False
+        return listed_at is not None and datetime.strptime(listed_at, self.TIME_FORMAT) >= day_end + self.seal_delay
+
+    def list(self, bucket, prefix, ordered=False, marker=''):
+        """
+        Return the keys under prefix and after marker, sorted by name, refreshing the index from S3 if needed.
+        The keys are boto Keys with name, last_modified, etag and size set.
+        """
+        self.update(bucket, prefix, ordered=ordered)
+        return self.keys(bucket, prefix, marker)
+
+    def update(self, bucket, prefix, ordered=False, max_age=None):
+        """
+        Bring the keys under prefix up to date, unless the prefix is complete or it
+        was listed less than max_age ago. max_age defaults to self.max_age for a prefix
+        that is not ordered, and to none (always refresh) for an ordered one.
+        """
+        if max_age is None and not ordered:
+            max_age = self.max_age
+        date = prefix[0:8]
+        with self.lock:
+            listings = self.db.execute("SELECT prefix, marker, listed_at FROM t3_listings WHERE bucket = ? AND date = ?",
+                                       (bucket.name, date)).fetchall()
+        listing = None
+        for (listed_prefix, last_key, listed_at) in listings:
+            if prefix.startswith(listed_prefix) and self.is_sealed(date, listed_at):
+                return
+            if listed_prefix == prefix:
+                listing = (last_key, listed_at)
+        if listing and max_age is not None and \
+                datetime.strptime(listing[1], self.TIME_FORMAT) > datetime.utcnow() - max_age:
+            return
+        self.refresh(bucket, prefix, date, listing[0] if listing and ordered else None)
+
+    def refresh(self, bucket, prefix, date, marker=None):
+        listed_at = datetime.utcnow().strftime(self.TIME_FORMAT)
+        marker_given = bool(marker)
+        rows = []
+        for key in bucket.list(prefix=prefix, marker=marker or ''):
+            rows.append((bucket.name, key.name) + self.parse_key_name(key.name) +
+                        (key.last_modified, key.etag, key.size))
+        if rows:
+            marker = rows[-1][1]
+        if self.logger:
+            self.logger.debug("T3 key index: listed %d keys under s3://%s/%s", len(rows), bucket.name, prefix)
+        with self.lock:
+            if not marker_given:
+                # a full listing. forget keys that have been deleted since
+                self.db.execute("DELETE FROM t3_keys WHERE bucket = ? AND name >= ? AND substr(name, 1, ?) = ?",
+                                (bucket.name, prefix, len(prefix), prefix))
+            self.db.executemany("INSERT OR REPLACE INTO t3_keys VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.execute("INSERT OR REPLACE INTO t3_listings VALUES (?, ?, ?, ?, ?)",
+                            (bucket.name, prefix, date, marker, listed_at))
+            self.db.commit()
+
+    def keys(self, bucket, prefix, marker=''):
+        with self.lock:
+            rows = self.db.execute("SELECT name, last_modified, etag, size FROM t3_keys "
+                                   "WHERE bucket = ? AND name >= ? AND name > ? AND substr(name, 1, ?) = ? ORDER BY name",
+                                   (bucket.name, prefix, marker, len(prefix), prefix)).fetchall()
+        return self._make_keys(bucket, rows)
+
+    def latest_keys(self, bucket, event_class, userid, deviceid, after, before, page_size=10):
+        """
+        Yield the keys of the files of a client created in [after, before) (UtcDateTimes),
+        newest first, among the keys already in the index. userid or deviceid may be empty.
+        The keys are read page_size at a time, so a caller that stops early reads little.
+        """
+        sql = "SELECT name, last_modified, etag, size, created_at FROM t3_keys " \
+              "WHERE bucket = ? AND event_class = ? AND created_at >= ? AND created_at < ?"
+        params = [bucket.name, event_class, after.datetime.strftime('%Y%m%d%H%M%S%f')[:17],
+                  before.datetime.strftime('%Y%m%d%H%M%S%f')[:17]]
+        if userid:
+            sql += " AND user_id = ?"
+            params.append(userid)
+        if deviceid:
+            sql += " AND device_id = ?"
+            params.append(deviceid)
+        page_sql = sql + " AND (created_at < ? OR (created_at = ? AND name < ?))"
+        order_sql = " ORDER BY created_at DESC, name DESC LIMIT ?"
+        with self.lock:
+            rows = self.db.execute(sql + order_sql, params + [page_size]).fetchall()
+        while rows:
+            for key in self._make_keys(bucket, [row[:4] for row in rows]):
+                yield key
+            if len(rows) < page_size:
+                break
+            (last_name, last_created_at) = (rows[-1][0], rows[-1][4])
+            with self.lock:
+                rows = self.db.execute(page_sql + order_sql,
+                                       params + [last_created_at, last_created_at, last_name, page_size]).fetchall()
+
+    @staticmethod
+    def _make_keys(bucket, rows):
+        keys = []
+        for (name, last_modified, etag, size) in rows:
+            key = bucket.new_key(name)
+            key.last_modified = last_modified
+            key.etag = etag
+            key.size = size
+            keys.append(key)
+        return keys
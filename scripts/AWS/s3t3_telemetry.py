@@ -1,11 +1,18 @@
 # Copyright 2014, NachoCove, Inc
 import json
 import re
-import zlib
 from boto.s3.connection import S3Connection
 from misc.utc_datetime import UtcDateTime
-from datetime import datetime
+from datetime import datetime, timedelta
 import hashlib
+from AWS.s3t3_batch import T3EventBatch
+from AWS.s3t3_fetch import fetch_t3_files, iter_t3_file_lines
+from AWS.s3t3_index import T3KeyIndex, get_t3_key_index, list_t3_keys
+
+# How far back get_latest_device_info_event() looks before after
+DEVICE_INFO_LOOKBACK = timedelta(days=7)
+# How often the key index lists a DEVICEINFO date prefix that may still get new files
+DEVICE_INFO_INDEX_MAX_AGE = timedelta(minutes=5)
 
 T3_EVENT_CLASS_FILE_PREFIXES = {
          'ALL': ['PROTOCOL','LOG', 'COUNTER', 'STATISTICS2','UI', 'SUPPORT', 'DEVICEINFO','PINGER', 'SAMPLES', 'TIMESERIES'],
@@ -24,6 +31,12 @@ T3_EVENT_CLASS_FILE_PREFIXES = {
 }
 
 def get_pinger_events(conn, bucket_name, userid, deviceid, after, before, search, logger=None):
+    events = list(iter_pinger_events(conn, bucket_name, userid, deviceid, after, before, search, logger=logger))
+    if logger:
+        logger.debug("Found %d PINGER events.", len(events))
+    return events
+
+def iter_pinger_events(conn, bucket_name, userid, deviceid, after, before, search, logger=None):
     logger.info("Getting events of class PINGER for userid %s deviceid %s from %s to %s with search '%s'" %
                 (userid, deviceid, after, before, search))
     assert isinstance(conn, S3Connection)
@@ -31,73 +44,121 @@ def get_pinger_events(conn, bucket_name, userid, deviceid, after, before, search
     #sample key
     #c6ae00d0-e259-4bfc-903d-5b6bc62cd651-dev-pinger
     #20150529/plog-20150529063152823.gz
-    events = []
     prev_file_uploaded_at_ts = None
+    event_filter = T3EventFilter(after, before, search, client=userid, device=deviceid, loads=_loads_pinger_line)
     for date_prefix in get_T3_date_prefixes(after, before):
         get_prefix = date_prefix
         logger.debug("get_prefix is %s" % get_prefix)
         file_regex = re.compile(r'.*/%s-(?P<uploaded_at>[0-9]+).gz' % T3_EVENT_CLASS_FILE_PREFIXES['PINGER'])
+        # The files are named by upload time, and a file uploaded before after can never be
+        # included (see is_pinger_file_in_date_range()), so start the listing at after.
+        marker = ''
+        if date_prefix == after.datetime.strftime('%Y%m%d'):
+            marker = '%s/%s-%s' % (date_prefix, T3_EVENT_CLASS_FILE_PREFIXES['PINGER'], after.datetime.strftime('%Y%m%d%H%M%S'))
 
-        search_regex=re.compile(search)
-        for key in bucket.list(prefix=get_prefix):
+        for key in list_t3_keys(bucket, get_prefix, ordered=True, marker=marker):
             m = file_regex.match(key.key)
             if m is not None:
                 uploaded_at = m.group('uploaded_at')
                 uploaded_at_ts = datetime.strptime(uploaded_at, '%Y%m%d%H%M%S%f')
                 uploaded_at_ts = UtcDateTime(uploaded_at_ts)
+                if prev_file_uploaded_at_ts and prev_file_uploaded_at_ts.datetime >= before.datetime:
+                    # the first file uploaded after before has been processed. nothing later can match
+                    return
                 if is_pinger_file_in_date_range(logger, uploaded_at_ts, before, after, prev_file_uploaded_at_ts):
-                    file_content = zlib.decompress(key.get_contents_as_string(), 16+zlib.MAX_WBITS)
-                    for line in file_content.splitlines():
-                        try:
-                            ev = json.loads(line)
-                        except ValueError:
-                            ev = json.loads(line.replace('\\', '\\\\')) # try again, this time escaping whacky backslashes
-
-                        timestamp = UtcDateTime(ev['timestamp'])
-                        if not (timestamp.datetime >= after.datetime and timestamp.datetime < before.datetime):
-                            continue
-                        if search != '':
-                            sm = search_regex.search(line)
+                    for line, ev, timestamp in event_filter.filter(iter_t3_file_lines(key)):
+                        if 'device' in ev:
+                            ev['device_id'] = ev['device']
+                            del ev['device']
                         else:
-                            sm = None
-                        if search == '' or sm is not None:
-                            if userid and (('client' in ev and ev['client'] != userid) or ('client' not in ev)):
-                                continue
-                            if deviceid and (('device' in ev and ev['device'] != deviceid) or ('device' not in ev)):
-                                continue
-                            if 'device' in ev:
-                                ev['device_id'] = ev['device']
-                                del ev['device']
-                            else:
-                                ev['device_id'] = ""
-                            if 'client' in ev:
-                                ev['user_id'] = ev['client']
-                                del ev['client']
-                            else:
-                                ev['user_id'] = ""
-                            ev['timestamp'] = timestamp
-                            ev['uploaded_at'] = uploaded_at_ts
-                            events.append(ev)
+                            ev['device_id'] = ""
+                        if 'client' in ev:
+                            ev['user_id'] = ev['client']
+                            del ev['client']
+                        else:
+                            ev['user_id'] = ""
+                        ev['timestamp'] = timestamp
+                        ev['uploaded_at'] = uploaded_at_ts
+                        yield ev
                     prev_file_uploaded_at_ts = uploaded_at_ts
+
+def _loads_pinger_line(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return json.loads(line.replace('\\', '\\\\')) # try again, this time escaping whacky backslashes
+
+def get_client_events(conn, bucket_name, userid, deviceid, after, before, event_class, search, threadid=0, logger=None, event_type=None, concurrency=None):
+    events = list(iter_client_events(conn, bucket_name, userid, deviceid, after, before, event_class, search,
+                                     threadid=threadid, logger=logger, event_type=event_type, concurrency=concurrency))
     if logger:
-        logger.debug("Found %d PINGER events.", len(events))
+        logger.debug("Found %d %s events.", len(events), event_class)
     return events
 
-def get_client_events(conn, bucket_name, userid, deviceid, after, before, event_class, search, threadid=0, logger=None, event_type=None):
+def iter_client_events(conn, bucket_name, userid, deviceid, after, before, event_class, search, threadid=0, logger=None, event_type=None, concurrency=None):
+    """
+    Same as get_client_events() but yields the events one at a time. Only the files
+    currently being fetched are held in memory.
+    """
+    event_filter = T3EventFilter(after, before, search, event_type=event_type, threadid=threadid)
+    for (key, uploaded_at_ts, m), lines in _fetch_client_files(conn, bucket_name, userid, deviceid, after, before,
+                                                               event_class, search, threadid, logger, event_type,
+                                                               concurrency):
+        for ev in extract_events(lines, event_filter, deviceid, userid, event_class, uploaded_at_ts, m):
+            yield ev
+
+def get_client_event_batch(conn, bucket_name, userid, deviceid, after, before, event_class, search, threadid=0, logger=None, event_type=None, concurrency=None, fields=None):
+    """
+    Same as get_client_events() but return the events in a T3EventBatch, keeping only fields if given.
+    """
+    batch = T3EventBatch(fields=fields)
+    batch.extend(iter_client_events(conn, bucket_name, userid, deviceid, after, before, event_class, search,
+                                    threadid=threadid, logger=logger, event_type=event_type, concurrency=concurrency))
+    if logger:
+        logger.debug("Found %d %s events.", len(batch), event_class)
+    return batch
+
+def count_client_events(conn, bucket_name, userid, deviceid, after, before, event_class, search, threadid=0, logger=None, event_type=None, concurrency=None):
+    """
+    Count the events get_client_events() would return without building them.
+    """
+    count = 0
+    event_filter = T3EventFilter(after, before, search, event_type=event_type, threadid=threadid)
+    for (key, uploaded_at_ts, m), lines in _fetch_client_files(conn, bucket_name, userid, deviceid, after, before,
+                                                               event_class, search, threadid, logger, event_type,
+                                                               concurrency):
+        for line, ev, timestamp in event_filter.filter(lines):
+            count += 1
+    if logger:
+        logger.debug("Counted %d %s events.", count, event_class)
+    return count
+
+def _fetch_client_files(conn, bucket_name, userid, deviceid, after, before, event_class, search, threadid, logger, event_type, concurrency):
     logger.info("Getting events of class %s for userid %s deviceid %s from %s to %s with search='%s' for threadid=%d for event_type %s" %
                 (event_class, userid, deviceid, after, before, search, threadid, event_type))
     assert isinstance(conn, S3Connection)
     bucket = conn.get_bucket(bucket_name)
+    client_files = get_client_files(bucket, userid, deviceid, after, before, event_class, logger=logger)
+    return fetch_t3_files(conn, bucket_name, client_files, concurrency=concurrency, logger=logger)
+
+def get_client_files(bucket, userid, deviceid, after, before, event_class, logger=None):
+    """
+    Yield (key, uploaded_at_ts, match) for every client file that may hold events between after and before.
+    """
     if userid:
         client_prefix = '/' + hashlib.sha256(userid).hexdigest()[0:8] + '/' + userid
         if deviceid:
             client_prefix += '/' + deviceid + '/NachoMail/' + T3_EVENT_CLASS_FILE_PREFIXES[event_class]
     else:
         client_prefix = ''
-    events = []
     prev_key = None
     prev_key_uploaded_at_ts = None
+    prev_key_m = None
+    prev_key_yielded = None
     first_in_date_range_file_processed = False
+    # The files of one device and class are listed in created_at order. Start the listing
+    # at the hour of after and stop at the first file created at or after before.
+    ordered = bool(userid and deviceid)
     for date_prefix in get_T3_date_prefixes(after, before):
         get_prefix = date_prefix + client_prefix
         #logger.debug("get_prefix is %s" % get_prefix)
@@ -112,76 +173,130 @@ def get_client_events(conn, bucket_name, userid, deviceid, after, before, event_
                 file_regex = re.compile(r'.*/(?P<device_id>Ncho\w+)/NachoMail/%s-(?P<created_at>[0-9]+).gz' % T3_EVENT_CLASS_FILE_PREFIXES[event_class])
             else:
                 file_regex = re.compile(r'.*%s-(?P<created_at>[0-9]+).gz' % T3_EVENT_CLASS_FILE_PREFIXES[event_class])
-        for key in bucket.list(prefix=get_prefix):
+        marker = ''
+        if ordered and date_prefix == after.datetime.strftime('%Y%m%d'):
+            marker = '%s-%s' % (get_prefix, after.datetime.strftime('%Y%m%d%H'))
+        past_before = False
+        for key in list_t3_keys(bucket, get_prefix, ordered=ordered, marker=marker):
             m = file_regex.match(key.key)
             if m is not None:
                 created_at = m.group('created_at')
                 created_at_ts = datetime.strptime(created_at, '%Y%m%d%H%M%S%f')
                 created_at_ts = UtcDateTime(created_at_ts)
+                if ordered and created_at_ts.datetime >= before.datetime:
+                    past_before = True
+                    break
                 uploaded_at = key.last_modified
                 uploaded_at_ts = UtcDateTime(uploaded_at)
                 if is_client_file_in_date_range(logger, created_at_ts, before, after):
                     first_in_date_range_file_processed = True
-                    extract_events(events, key, event_type, threadid, after, before, deviceid,
-                                           userid, event_class, search, uploaded_at_ts, m)
+                    yield key, uploaded_at_ts, m
                 else:
                     # keep storing the prev key till the first in date range file is processed
                     if not first_in_date_range_file_processed:
                         #logger.debug("File uploaded at %s is being kept as prev", uploaded_at_ts)
                         prev_key = key
                         prev_key_uploaded_at_ts = uploaded_at_ts
+                        prev_key_m = m
+        if marker and not prev_key:
+            # nothing between the hour of after and after. the previous file is earlier in the day
+            for key in list_t3_keys(bucket, get_prefix, ordered=ordered):
+                if key.name > marker:
+                    break
+                m = file_regex.match(key.key)
+                if m is not None:
+                    prev_key = key
+                    prev_key_uploaded_at_ts = UtcDateTime(key.last_modified)
+                    prev_key_m = m
 
         # process first file last - events are sorted later
-        if prev_key:
-            m = file_regex.match(prev_key.key)
+        if prev_key and prev_key.name != prev_key_yielded:
             #logger.debug("File uploaded at %s should be processed", prev_key_uploaded_at_ts)
-            ev = extract_events(events, prev_key, event_type, threadid, after, before, deviceid,
-                                   userid, event_class, search, prev_key_uploaded_at_ts, m)
-    if logger:
-        logger.debug("Found %d %s events.", len(events), event_class)
-    return events
+            prev_key_yielded = prev_key.name
+            yield prev_key, prev_key_uploaded_at_ts, prev_key_m
+        if past_before:
+            break
+
+class T3EventFilter(object):
+    """
+    The line filters of a T3 query, compiled once for all the files of the query.
 
-def extract_events(events, key, event_type, threadid, after, before, deviceid,
-                   userid, event_class, search, uploaded_at_ts, m):
-    file_content = zlib.decompress(key.get_contents_as_string(), 16+zlib.MAX_WBITS)
-    for line in file_content.splitlines():
-        ev = json.loads(line)
-        if event_type and 'event_type' in ev and ev['event_type'] != event_type:
-            continue
+    Every filter that can be decided on the raw line is checked before the line is
+    decoded, so lines that cannot match never go through json.loads(). The raw checks
+    only reject lines that the checks on the decoded event would reject too.
+    """
+    def __init__(self, after, before, search='', event_type=None, threadid=0, client=None, device=None,
+                 loads=json.loads):
+        self.after = after.epoch_us
+        self.before = before.epoch_us
+        self.loads = loads
+        self.prechecks = []
+        self.checks = []
+        if search:
+            self.prechecks.append(re.compile(search).search)
+        if event_type:
+            # events without an event_type are not filtered out
+            event_type_value = '"%s"' % event_type
+            self.prechecks.append(lambda line: '"event_type"' not in line or event_type_value in line)
+            self.checks.append(lambda ev: 'event_type' not in ev or ev['event_type'] == event_type)
         if threadid > 0:
-            if 'thread_id' not in ev or ev['thread_id'] != threadid:
-                continue
-        timestamp = UtcDateTime(ev['timestamp'])
-        if not (timestamp.datetime >= after.datetime and timestamp.datetime < before.datetime):
-            continue
-        if search != '':
-            search_regex=re.compile(search)
-            sm = search_regex.search(line)
-        else:
-            sm = None
-        if search == '' or sm is not None:
-            ev['timestamp'] = timestamp
-            if 'module' not in ev:
-                ev['module'] = 'client'
-            if deviceid == '':
-                ev['device_id'] = m.group('device_id')
-            else:
-                ev['device_id'] = deviceid
-            if userid == '':
-                ev['user_id'] = m.group('user_id')
+            threadid_value = str(threadid)
+            self.prechecks.append(lambda line: '"thread_id"' in line and threadid_value in line)
+            self.checks.append(lambda ev: ev.get('thread_id') == threadid)
+        if client:
+            self.prechecks.append(lambda line: client in line)
+            self.checks.append(lambda ev: ev.get('client') == client)
+        if device:
+            self.prechecks.append(lambda line: device in line)
+            self.checks.append(lambda ev: ev.get('device') == device)
+
+    def filter(self, lines):
+        """
+        Yield (line, ev, timestamp) for every line that passes the filters.
+        """
+        prechecks = self.prechecks
+        checks = self.checks
+        loads = self.loads
+        after = self.after
+        before = self.before
+        for line in lines:
+            for precheck in prechecks:
+                if not precheck(line):
+                    break
             else:
-                ev['user_id'] = userid
-            ev['uploaded_at'] = uploaded_at_ts
-            if 'ui_integer' not in ev and 'ui_long' in ev:
-                ev['ui_integer'] = ev['ui_long']
-            if 'event_type' not in ev:
-                ev['event_type'] = event_class
-            # TODO move this out appropriately
-            if 'counter_start' in ev:
-                ev['counter_start'] = UtcDateTime(ev['counter_start'])
-            if 'counter_end' in ev:
-                ev['counter_end'] = UtcDateTime(ev['counter_end'])
-            events.append(ev)
+                ev = loads(line)
+                for check in checks:
+                    if not check(ev):
+                        break
+                else:
+                    timestamp = UtcDateTime(ev['timestamp'])
+                    if after <= timestamp.epoch_us < before:
+                        yield line, ev, timestamp
+
+def extract_events(lines, event_filter, deviceid, userid, event_class, uploaded_at_ts, m):
+    for line, ev, timestamp in event_filter.filter(lines):
+        ev['timestamp'] = timestamp
+        if 'module' not in ev:
+            ev['module'] = 'client'
+        if deviceid == '':
+            ev['device_id'] = m.group('device_id')
+        else:
+            ev['device_id'] = deviceid
+        if userid == '':
+            ev['user_id'] = m.group('user_id')
+        else:
+            ev['user_id'] = userid
+        ev['uploaded_at'] = uploaded_at_ts
+        if 'ui_integer' not in ev and 'ui_long' in ev:
+            ev['ui_integer'] = ev['ui_long']
+        if 'event_type' not in ev:
+            ev['event_type'] = event_class
+        # TODO move this out appropriately
+        if 'counter_start' in ev:
+            ev['counter_start'] = UtcDateTime(ev['counter_start'])
+        if 'counter_end' in ev:
+            ev['counter_end'] = UtcDateTime(ev['counter_end'])
+        yield ev
 
 def is_pinger_file_in_date_range(logger, uploaded_at_ts, before, after, prev_file_uploaded_at_ts):
     if uploaded_at_ts.datetime >= after.datetime and uploaded_at_ts.datetime < before.datetime:
@@ -214,6 +329,9 @@ def get_T3_date_prefixes(after, before):
     return prefixes
 
 def get_latest_device_info_event(conn, bucket_name, userid, deviceid, after, before, logger=None):
+    index = get_t3_key_index()
+    if index is not None:
+        return _get_latest_indexed_device_info_event(index, conn, bucket_name, userid, deviceid, after, before, logger)
     device_info_list = get_client_events(conn, bucket_name, userid, deviceid, after, before, 'DEVICEINFO', '', logger=logger)
     if len(device_info_list) > 0:
         return device_info_list[-1]
@@ -230,14 +348,49 @@ def get_latest_device_info_event(conn, bucket_name, userid, deviceid, after, bef
         return None
 
 
-def get_trouble_ticket_events(conn, bucket_name, logger):
+def _get_latest_indexed_device_info_event(index, conn, bucket_name, userid, deviceid, after, before, logger):
+    """
+    Same as get_latest_device_info_event() but find the newest device info files
+    created before before in the key index instead of searching day by day.
+    """
+    assert isinstance(conn, S3Connection)
+    bucket = conn.get_bucket(bucket_name)
+    earliest = after - DEVICE_INFO_LOOKBACK
+    for date_prefix in get_T3_date_prefixes(earliest, before):
+        index.update(bucket, date_prefix, max_age=DEVICE_INFO_INDEX_MAX_AGE)
+    event_filter = T3EventFilter(earliest, before)
+    for key in index.latest_keys(bucket, T3_EVENT_CLASS_FILE_PREFIXES['DEVICEINFO'], userid, deviceid,
+                                 earliest, before):
+        m = T3KeyIndex.CLIENT_KEY_REGEX.match(key.name)
+        events = list(extract_events(iter_t3_file_lines(key), event_filter, deviceid, userid, 'DEVICEINFO',
+                                     UtcDateTime(key.last_modified), m))
+        if events:
+            return max(events, key=lambda x: x['timestamp'].epoch_us)
+    if logger:
+        logger.debug("No device info for userid %s deviceid %s before %s", userid, deviceid, before)
+    return None
+
+def get_trouble_ticket_events(conn, bucket_name, logger, processed=None):
+    events = list(iter_trouble_ticket_events(conn, bucket_name, logger, processed=processed))
+    logger.info("Found %d trouble tickets", len(events))
+    return events
+
+def iter_trouble_ticket_events(conn, bucket_name, logger, processed=None):
+    """
+    Yield the events of the trouble tickets in the bucket. If processed (a dict of
+    key name to ETag) is given, only objects not in it are downloaded, and once all
+    the events are yielded it is set to the objects currently in the bucket.
+    """
     logger.info("Checking for new trouble tickets in %s", bucket_name)
     assert isinstance(conn, S3Connection)
     bucket = conn.get_bucket(bucket_name)
-    events = []
+    in_bucket = dict()
     for key in bucket.list():
-        file_content = zlib.decompress(key.get_contents_as_string(), 16+zlib.MAX_WBITS)
-        for line in file_content.splitlines():
+        if processed is not None:
+            in_bucket[key.name] = key.etag
+            if processed.get(key.name) == key.etag:
+                continue
+        for line in iter_t3_file_lines(key):
             ev = json.loads(line)
             ev['event_type'] = 'SUPPORT'
             ev['timestamp'] = UtcDateTime(ev['timestamp'])
@@ -246,9 +399,12 @@ def get_trouble_ticket_events(conn, bucket_name, logger):
                 ev['device_id'] = ev['client']
                 ev['user_id'] = ev['user']
                 ev['key_name'] = key.name
-            events.append(ev)
-    logger.info("Found %d trouble tickets", len(events))
-    return events
+            yield ev
+    if processed is not None:
+        logger.info("%d of %d trouble tickets were new", len(set(in_bucket.items()) - set(processed.items())),
+                    len(in_bucket))
+        processed.clear()
+        processed.update(in_bucket)
 
 def delete_trouble_ticket(conn, bucket_name, key_name, logger):
     logger.info("Deleting trouble ticket %s", key_name)
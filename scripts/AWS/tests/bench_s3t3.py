@@ -0,0 +1,192 @@
+"""
+Time the T3 read path against a synthetic bucket layout held in an in-process fake S3.
+
+Run from the scripts directory:
+    python -m AWS.tests.bench_s3t3 [-d <devices>] [-f <files per device>] [-e <events per file>]
+                                   [-c <concurrency>,...] [--latency <ms>] [--index] [--cache] [--no-manifest]
+
+Each S3 GET waits --latency ms and each page of a listing --list-latency ms, so
+the concurrency settings behave roughly as they would against S3. The layout is
+one day of LOG files (hash/user/device/NachoMail/log-<created>.gz) and of pinger
+logs (YYYYMMDD/plog-<uploaded>.gz). --index and --cache time the same reads with
+a T3 key index and a T3 file cache in a temporary directory, cold then warm.
+The synthetic day is in the past, so the key index treats it as complete.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from StringIO import StringIO
+
+from AWS import s3t3_fetch
+from AWS.s3t3_cache import T3FileCache, set_t3_file_cache
+from AWS.s3t3_index import T3KeyIndex, set_t3_key_index
+from AWS.s3t3_telemetry import get_client_events, get_pinger_events
+from AWS.tests.fake_s3 import FakeBucket, FakeS3Connection
+from misc.utc_datetime import UtcDateTime
+
+DAY = datetime(2015, 5, 29)
+T3_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def gzip_string(s):
+    out = StringIO()
+    with gzip.GzipFile(fileobj=out, mode='w') as f:
+        f.write(s)
+    return out.getvalue()
+
+
+def iso(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def make_log_bucket(devices, files, events, **kwargs):
+    """
+    One day of LOG files: <files> files per device, evenly spread over the day, each
+    holding the <events> events since the previous file.
+    """
+    contents = dict()
+    last_modified = dict()
+    interval = timedelta(days=1) / files
+    for d in range(devices):
+        userid = 'us-east-1:%08d-0000-0000-0000-000000000000' % d
+        deviceid = 'Ncho%08X' % d
+        prefix = '%s/%s/%s/%s/NachoMail/' % (DAY.strftime('%Y%m%d'), hashlib.sha256(userid).hexdigest()[0:8],
+                                             userid, deviceid)
+        for f in range(files):
+            created_at = DAY + interval * (f + 1) - timedelta(seconds=1)
+            lines = []
+            for e in range(events):
+                timestamp = created_at - interval + interval * e / events
+                lines.append(json.dumps({'id': '%d-%d-%d' % (d, f, e), 'event_type': 'ERROR' if e % 10 == 0 else 'INFO',
+                                         'thread_id': e % 4 + 1, 'timestamp': iso(timestamp),
+                                         'message': 'message %d of file %d' % (e, f)}))
+            name = prefix + 'log-%s.gz' % created_at.strftime(T3_TIME_FORMAT)[:17]
+            contents[name] = gzip_string('\n'.join(lines))
+            last_modified[name] = iso(created_at + timedelta(seconds=30))
+    return FakeBucket(contents, name='log-bucket', last_modified=last_modified, **kwargs)
+
+
+def make_pinger_bucket(files, events, devices, **kwargs):
+    """
+    One day of pinger logs, uploaded every 24 hours / <files>.
+    """
+    contents = dict()
+    interval = timedelta(days=1) / files
+    for f in range(files):
+        uploaded_at = DAY + interval * (f + 1)
+        lines = []
+        for e in range(events):
+            timestamp = uploaded_at - interval + interval * e / events
+            lines.append(json.dumps({'client': 'us-east-1:%08d-0000-0000-0000-000000000000' % (e % devices),
+                                     'device': 'Ncho%08X' % (e % devices), 'timestamp': iso(timestamp),
+                                     'level': 'info', 'message': 'pinger message %d' % e}))
+        name = '%s/plog-%s.gz' % (DAY.strftime('%Y%m%d'), uploaded_at.strftime(T3_TIME_FORMAT)[:17])
+        contents[name] = gzip_string('\n'.join(lines))
+    return FakeBucket(contents, name='pinger-bucket', **kwargs)
+
+
+def timed(func):
+    start = time.time()
+    result = func()
+    return time.time() - start, result
+
+
+def report(name, setting, elapsed, count, buckets):
+    print '%-28s %-16s %8.3f s %8d events %6d GETs %5d LISTs' % (name, setting, elapsed, count,
+                                                                sum([x.get_count for x in buckets]),
+                                                                sum([x.list_count for x in buckets]))
+    for bucket in buckets:
+        bucket.get_count = 0
+        bucket.list_count = 0
+        bucket.listed = []
+
+
+def bench_reads(options, concurrency_settings, conn, log_bucket, pinger_bucket, logger, setting):
+    after = UtcDateTime(iso(DAY + timedelta(hours=6)))
+    before = UtcDateTime(iso(DAY + timedelta(hours=6) + timedelta(hours=options.window)))
+    userid = 'us-east-1:%08d-0000-0000-0000-000000000000' % 0
+    deviceid = 'Ncho%08X' % 0
+    for concurrency in concurrency_settings:
+        (elapsed, events) = timed(lambda: get_client_events(conn, log_bucket.name, '', '', after, before, 'LOG', '',
+                                                            logger=logger, concurrency=concurrency))
+        report('get_client_events (all)', '%s c=%d' % (setting, concurrency), elapsed, len(events), [log_bucket])
+    (elapsed, events) = timed(lambda: get_client_events(conn, log_bucket.name, userid, deviceid, after, before, 'LOG',
+                                                        '', logger=logger))
+    report('get_client_events (device)', setting, elapsed, len(events), [log_bucket])
+    (elapsed, events) = timed(lambda: get_pinger_events(conn, pinger_bucket.name, '', '', after, before, '',
+                                                        logger=logger))
+    report('get_pinger_events', setting, elapsed, len(events), [pinger_bucket])
+
+
+def bench_manifest(conn, log_bucket, logger):
+    # redshift_handler needs psycopg2, so only import it when this benchmark runs
+    from AWS import redshift_handler
+    config = {'s3_config': {'log': {'t3_bucket': log_bucket.name}},
+              'aws_config': {'aws_access_key_id': None, 'aws_secret_access_key': None}}
+    create_s3_conn = redshift_handler.create_s3_conn
+    redshift_handler.create_s3_conn = lambda *args, **kwargs: conn
+    try:
+        start = UtcDateTime(iso(DAY))
+        end = UtcDateTime(iso(DAY + timedelta(hours=12)))
+        (elapsed, names) = timed(lambda: redshift_handler.get_manifest_url(logger, config, 'LOG', start, end))
+        report('get_manifest_url', '', elapsed, len(names), [log_bucket])
+    finally:
+        redshift_handler.create_s3_conn = create_s3_conn
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the T3 readers against a fake S3')
+    parser.add_argument('-d', dest='devices', type=int, default=20, help='number of devices')
+    parser.add_argument('-f', dest='files', type=int, default=48, help='LOG files per device per day')
+    parser.add_argument('-e', dest='events', type=int, default=100, help='events per file')
+    parser.add_argument('-p', dest='pinger_files', type=int, default=288, help='pinger files per day')
+    parser.add_argument('-w', dest='window', type=int, default=6, help='query window in hours')
+    parser.add_argument('-c', dest='concurrency', default='1,4,8,16', help='comma-separated concurrency settings')
+    parser.add_argument('--latency', type=float, default=20.0, help='ms per GET')
+    parser.add_argument('--list-latency', type=float, default=50.0, help='ms per page of a listing')
+    parser.add_argument('--index', action='store_true', help='also time with a T3 key index')
+    parser.add_argument('--cache', action='store_true', help='also time with a T3 file cache')
+    parser.add_argument('--no-manifest', action='store_true', help='skip get_manifest_url (needs psycopg2)')
+    options = parser.parse_args()
+    options.concurrency = [int(x) for x in options.concurrency.split(',')]
+
+    logging.basicConfig(level=logging.WARN)
+    logger = logging.getLogger('bench')
+    latency = dict(latency=options.latency / 1000.0, list_latency=options.list_latency / 1000.0)
+    log_bucket = make_log_bucket(options.devices, options.files, options.events, **latency)
+    pinger_bucket = make_pinger_bucket(options.pinger_files, options.events, options.devices, **latency)
+    conn = FakeS3Connection(log_bucket, pinger_bucket)
+    print '%d LOG files, %d pinger files, %d events per file' % (len(log_bucket.contents),
+                                                                len(pinger_bucket.contents), options.events)
+
+    # the fake connection is shared by all the threads
+    clone_s3_conn = s3t3_fetch.clone_s3_conn
+    s3t3_fetch.clone_s3_conn = lambda c: c
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        bench_reads(options, options.concurrency, conn, log_bucket, pinger_bucket, logger, '')
+        if not options.no_manifest:
+            bench_manifest(conn, log_bucket, logger)
+        if options.index:
+            set_t3_key_index(T3KeyIndex(tmp_dir + '/index.sqlite'))
+        if options.cache:
+            set_t3_file_cache(T3FileCache(tmp_dir + '/cache'))
+        if options.index or options.cache:
+            # only the first read of a file or listing is cold
+            bench_reads(options, options.concurrency[-1:], conn, log_bucket, pinger_bucket, logger, 'cold')
+            bench_reads(options, options.concurrency, conn, log_bucket, pinger_bucket, logger, 'warm')
+    finally:
+        set_t3_key_index(None)
+        set_t3_file_cache(None)
+        s3t3_fetch.clone_s3_conn = clone_s3_conn
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
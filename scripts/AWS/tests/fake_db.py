@@ -0,0 +1,122 @@
+"""
+An in-process stand-in for the parts of psycopg2 connections and cursors used by
+redshift_handler, db_reports and db_pool.
+"""
+
+
+class FakeCursor(object):
+    """
+    Records the statements it runs and their parameters. Each select takes the next
+    list of rows of results, which the fetch methods then read, or raises it if it is
+    an exception (say, for a missing table). Any other statement sets rowcount to the
+    given one.
+    """
+    def __init__(self, results=None, rowcount=0):
+        self.results = list(results) if results is not None else []
+        self.rowcount = rowcount
+        self.statusmessage = ''
+        self.description = None
+        self.connection = None
+        self.statements = []
+        self.params = []
+        self.rows = []
+        self.fetches = []
+        self.closed = False
+
+    @staticmethod
+    def is_select(sql):
+        return sql.strip().lower().startswith(('select', 'with'))
+
+    def execute(self, sql, params=()):
+        if self.connection is not None and self.connection.broken:
+            raise Exception('server closed the connection unexpectedly')
+        self.statements.append(sql)
+        self.params.append(params)
+        if self.is_select(sql):
+            result = self.results.pop(0) if self.results else []
+            if isinstance(result, Exception):
+                raise result
+            self.rows = list(result)
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        (rows, self.rows) = (self.rows, [])
+        return rows
+
+    def fetchmany(self, size):
+        (rows, self.rows) = (self.rows[:size], self.rows[size:])
+        self.fetches.append(len(rows))
+        return rows
+
+    def close(self):
+        self.closed = True
+
+
+class FakeWatermarkCursor(FakeCursor):
+    """
+    A cursor on a watermark table (table name -> watermark), as redshift_handler reads
+    and writes it. Any other statement is handled by FakeCursor.
+    """
+    def __init__(self, *args, **kwargs):
+        FakeCursor.__init__(self, *args, **kwargs)
+        self.watermarks = dict()
+
+    def execute(self, sql, params=()):
+        if sql.startswith('select watermark'):
+            self.rows = [(self.watermarks[params[0]],)] if params[0] in self.watermarks else []
+        elif sql.startswith('update') and 'watermark' in sql:
+            self.rowcount = 1 if params[1] in self.watermarks else 0
+            if self.rowcount:
+                self.watermarks[params[1]] = params[0]
+        elif sql.startswith('insert') and 'watermark' in sql:
+            self.watermarks[params[0]] = params[1]
+            self.rowcount = 1
+        else:
+            FakeCursor.execute(self, sql, params)
+
+
+class FakeConnection(object):
+    """
+    A connection whose cursor() is the given cursor every time, or a new FakeCursor.
+    A broken connection fails every statement and rollback.
+    """
+    def __init__(self, cursor=None):
+        self.fake_cursor = cursor
+        self.closed = False
+        self.broken = False
+        self.autocommit = False
+        self.isolation_level = 1
+        self.isolation_levels = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.cursors = []
+        self.cursor_names = []
+
+    def cursor(self, name=None):
+        cursor = self.fake_cursor if self.fake_cursor is not None else FakeCursor()
+        cursor.connection = self
+        if cursor not in self.cursors:
+            self.cursors.append(cursor)
+        self.cursor_names.append(name)
+        return cursor
+
+    @property
+    def statements(self):
+        return [sql for cursor in self.cursors for sql in cursor.statements]
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        if self.broken:
+            raise Exception('server closed the connection unexpectedly')
+        self.rollbacks += 1
+
+    def set_isolation_level(self, level):
+        self.isolation_levels.append(level)
+        self.isolation_level = level
+
+    def close(self):
+        self.closed = True
@@ -0,0 +1,95 @@
+"""
+An in-process stand-in for the parts of boto S3 used by the T3 readers.
+"""
+import hashlib
+import random
+import time
+from StringIO import StringIO
+
+from boto.exception import S3ResponseError
+from boto.s3.connection import S3Connection
+
+
+class FakeKey(object):
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.key = name
+        self.last_modified = bucket.last_modified.get(name, bucket.default_last_modified)
+        self.etag = '"%s"' % hashlib.md5(name).hexdigest()
+        self.size = len(bucket.contents.get(name, ''))
+
+    def get_contents_as_string(self):
+        self.bucket.get_count += 1
+        self.bucket.wait(self.bucket.latency)
+        if self.name not in self.bucket.contents:
+            raise S3ResponseError(404, 'Not Found')
+        return self.bucket.contents[self.name]
+
+    def set_contents_from_string(self, data, headers=None):
+        self.bucket.contents[self.name] = data
+        self.size = len(data)
+
+    def read(self, size):
+        if not hasattr(self, 'stream'):
+            self.stream = StringIO(self.get_contents_as_string())
+        return self.stream.read(size)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBucket(object):
+    """
+    A bucket whose objects are the name to content dict contents. Each GET waits
+    latency seconds, and each page of 1000 keys of a listing list_latency seconds,
+    plus up to jitter seconds.
+    """
+    PAGE_SIZE = 1000
+
+    def __init__(self, contents, name='bucket', latency=0.0, list_latency=0.0, jitter=0.0, last_modified=None):
+        self.name = name
+        self.contents = contents
+        self.latency = latency
+        self.list_latency = list_latency
+        self.jitter = jitter
+        self.last_modified = last_modified if last_modified is not None else dict()
+        self.default_last_modified = '2015-05-29T12:00:00.000Z'
+        self.get_count = 0
+        self.list_count = 0
+        self.listed = []
+
+    def wait(self, latency):
+        if latency or self.jitter:
+            time.sleep(latency + random.random() * self.jitter)
+
+    def new_key(self, name):
+        return FakeKey(self, name)
+
+    def list(self, prefix='', marker='', delimiter=''):
+        self.list_count += 1
+        common_prefixes = set()
+        n = 0
+        for name in sorted(self.contents):
+            if name.startswith(prefix) and name > marker:
+                if delimiter and delimiter in name[len(prefix):]:
+                    name = name[:name.index(delimiter, len(prefix)) + 1]
+                    if name in common_prefixes:
+                        continue
+                    common_prefixes.add(name)
+                if n % self.PAGE_SIZE == 0:
+                    self.wait(self.list_latency)
+                n += 1
+                self.listed.append(name)
+                yield FakeKey(self, name)
+
+
+class FakeS3Connection(S3Connection):
+    def __init__(self, *buckets):
+        # S3Connection.__init__() is not called. nothing here talks to AWS
+        self.buckets = dict((bucket.name, bucket) for bucket in buckets)
+
+    def get_bucket(self, bucket_name, validate=True):
+        if bucket_name not in self.buckets:
+            raise S3ResponseError(404, 'Not Found')
+        return self.buckets[bucket_name]
@@ -0,0 +1,104 @@
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from AWS.db_cache import DBResultCache, get_db_result_cache, normalize_sql
+
+
+class Computation(object):
+    def __init__(self, result):
+        self.result = result
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        return self.result
+
+
+class TestDBResultCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = DBResultCache(self.cache_dir + '/db_cache.sqlite')
+        self.start = datetime(2015, 5, 29, 0, 0, 0)
+        self.end = datetime(2015, 5, 29, 6, 0, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_hit(self):
+        compute = Computation(({'count': 1}, [1, 2]))
+        for n in range(2):
+            result = self.cache.get('dev', 'log_report', (1000,), self.start, self.end, compute)
+            self.assertEqual(result, ({'count': 1}, [1, 2]))
+        self.assertEqual(compute.count, 1)
+        # different arguments or project are different results
+        self.cache.get('dev', 'log_report', (10,), self.start, self.end, compute)
+        self.cache.get('prod', 'log_report', (1000,), self.start, self.end, compute)
+        self.assertEqual(compute.count, 3)
+
+    def test_ttl(self):
+        cache = DBResultCache(self.cache_dir + '/db_cache.sqlite', ttl=0)
+        compute = Computation('x')
+        cache.get('dev', 'log_report', (), self.start, self.end, compute)
+        cache.get('dev', 'log_report', (), self.start, self.end, compute)
+        self.assertEqual(compute.count, 2)
+
+        # a window that has been loaded completely does not expire
+        cache.set_loaded('dev', self.end)
+        self.assertEqual(cache.get_loaded('dev'), self.end)
+        cache.get('dev', 'log_report', (), self.start, self.end, compute)
+        cache.get('dev', 'log_report', (), self.start, self.end, compute)
+        self.assertEqual(compute.count, 3)
+        # ... but a window past it, or no window, does
+        cache.get('dev', 'log_report', (), self.start, datetime(2015, 5, 29, 7), compute)
+        cache.get('dev', 'log_report', (), self.start, datetime(2015, 5, 29, 7), compute)
+        cache.get('dev', 'execute_sql', (), None, None, compute)
+        cache.get('dev', 'execute_sql', (), None, None, compute)
+        self.assertEqual(compute.count, 7)
+
+    def test_set_loaded(self):
+        self.assertEqual(self.cache.get_loaded('dev'), None)
+        self.cache.set_loaded('dev', self.end)
+        self.cache.set_loaded('dev', self.start)
+        self.assertEqual(self.cache.get_loaded('dev'), self.end)
+
+    def test_not_cacheable(self):
+        compute = Computation(None)
+        for n in range(2):
+            self.cache.get('dev', 'log_report', (), self.start, self.end, compute,
+                           cacheable=lambda result: result is not None)
+        self.assertEqual(compute.count, 2)
+
+    def test_invalidate(self):
+        compute = Computation('x')
+        self.cache.get('dev', 'log_report', (), self.start, self.end, compute)
+        self.cache.get('dev', 'execute_sql', (), None, None, compute)
+        self.assertEqual(compute.count, 2)
+
+        # another project, or a later span, leaves the window alone
+        self.cache.invalidate('prod', self.start, self.end)
+        self.cache.invalidate('dev', datetime(2015, 5, 29, 7), datetime(2015, 5, 29, 8))
+        self.cache.get('dev', 'log_report', (), self.start, self.end, compute)
+        self.assertEqual(compute.count, 2)
+        # ... but not the result without a window
+        self.cache.get('dev', 'execute_sql', (), None, None, compute)
+        self.assertEqual(compute.count, 3)
+
+        self.cache.invalidate('dev', datetime(2015, 5, 29, 5), datetime(2015, 5, 29, 8))
+        self.cache.get('dev', 'log_report', (), self.start, self.end, compute)
+        self.assertEqual(compute.count, 4)
+
+    def test_get_db_result_cache(self):
+        self.assertEqual(get_db_result_cache({'general_config': {'project': 'dev'}}), None)
+        config = {'general_config': {'project': 'dev', 'db_cache_file': self.cache_dir + '/shared.sqlite'}}
+        cache = get_db_result_cache(config)
+        self.assertTrue(cache is get_db_result_cache(config))
+
+    def test_normalize_sql(self):
+        self.assertEqual(normalize_sql('select *\n  from dev_nm_log ;\n'), 'select * from dev_nm_log')
+        self.assertEqual(normalize_sql('select 1'), normalize_sql(' select  1;'))
+
+
+if __name__ == '__main__':
+    unittest.main()
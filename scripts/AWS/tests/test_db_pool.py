@@ -0,0 +1,93 @@
+import os
+import unittest
+
+from AWS.db_pool import DBConnectionPool, get_db_conn_pool, set_db_conn_pool
+from AWS.tests.fake_db import FakeConnection
+
+
+class TestDBConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.db_config = {'host': 'localhost', 'port': 5439, 'dbname': 'dev', 'user': 'user', 'pwd': 'pwd'}
+        self.connections = []
+        self.pool = DBConnectionPool()
+
+    def connect(self):
+        conn = FakeConnection()
+        self.connections.append(conn)
+        return conn
+
+    def test_reuse(self):
+        conn = self.pool.get(self.db_config, self.connect)
+        conn.autocommit = True
+        self.pool.put(conn)
+        self.assertFalse(conn.closed)
+        self.assertEqual(conn.rollbacks, 1)
+        self.assertFalse(conn.autocommit)
+        self.assertTrue(self.pool.get(dict(self.db_config), self.connect) is conn)
+        # in use, so a second caller gets a new connection
+        self.assertFalse(self.pool.get(self.db_config, self.connect) is conn)
+        # as does another database
+        self.assertFalse(self.pool.get(dict(self.db_config, dbname='prod'), self.connect) is conn)
+        self.assertEqual(len(self.connections), 3)
+
+    def test_max_idle(self):
+        pool = DBConnectionPool(max_idle=1)
+        conns = [pool.get(self.db_config, self.connect) for n in range(3)]
+        for conn in conns:
+            pool.put(conn)
+        self.assertEqual([conn.closed for conn in conns], [False, True, True])
+
+    def test_discard(self):
+        conn = self.pool.get(self.db_config, self.connect)
+        self.pool.put(conn, discard=True)
+        self.assertTrue(conn.closed)
+        conn = self.pool.get(self.db_config, self.connect)
+        conn.broken = True
+        self.pool.put(conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(len(self.connections), 2)
+
+    def test_health_check(self):
+        pool = DBConnectionPool(check_interval=0)
+        conn = pool.get(self.db_config, self.connect)
+        pool.put(conn)
+        self.assertTrue(pool.get(self.db_config, self.connect) is conn)
+        self.assertEqual(conn.statements, ['select 1'])
+        pool.put(conn)
+        conn.broken = True
+        other = pool.get(self.db_config, self.connect)
+        self.assertFalse(other is conn)
+        self.assertTrue(conn.closed)
+
+    def test_idle_timeout(self):
+        pool = DBConnectionPool(idle_timeout=0)
+        conn = pool.get(self.db_config, self.connect)
+        pool.put(conn)
+        self.assertFalse(pool.get(self.db_config, self.connect) is conn)
+        self.assertTrue(conn.closed)
+
+    def test_fork(self):
+        conn = self.pool.get(self.db_config, self.connect)
+        self.pool.put(conn)
+        self.pool.pid = os.getpid() + 1
+        self.assertFalse(self.pool.get(self.db_config, self.connect) is conn)
+        # the parent's connection is left alone
+        self.assertFalse(conn.closed)
+
+    def test_set_db_conn_pool(self):
+        conn = self.pool.get(self.db_config, self.connect)
+        in_use = self.pool.get(self.db_config, self.connect)
+        self.pool.put(conn)
+        set_db_conn_pool(self.pool)
+        try:
+            self.assertTrue(get_db_conn_pool() is self.pool)
+        finally:
+            set_db_conn_pool(None)
+        self.assertTrue(conn.closed)
+        self.assertFalse(in_use.closed)
+        self.pool.put(in_use)
+        self.assertTrue(in_use.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+from datetime import datetime
+import logging
+import unittest
+
+from AWS import redshift_handler
+from AWS.db_reports import get_rollup_hours, get_event_counts, get_log_report_sql, log_report, syncfail_report
+from AWS.tests.fake_db import FakeConnection, FakeCursor
+from misc.utc_datetime import UtcDateTime
+
+
+class TestEventCounts(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        self.start = UtcDateTime('2015-05-29T00:00:00.000Z')
+        self.end = UtcDateTime('2015-05-29T23:59:59.000Z')
+        self.create_db_conn = redshift_handler.create_db_conn
+
+    def tearDown(self):
+        redshift_handler.create_db_conn = self.create_db_conn
+
+    def test_rollup_hours(self):
+        rolled_up = (datetime(2015, 5, 1), datetime(2015, 6, 1))
+        self.assertEqual(get_rollup_hours(self.start, self.end, rolled_up),
+                         (datetime(2015, 5, 29), datetime(2015, 5, 30)))
+        # only the whole hours of the span
+        self.assertEqual(get_rollup_hours(UtcDateTime('2015-05-29T10:30:00.000Z'),
+                                          UtcDateTime('2015-05-29T12:15:00.000Z'), rolled_up),
+                         (datetime(2015, 5, 29, 11), datetime(2015, 5, 29, 12)))
+        self.assertIsNone(get_rollup_hours(UtcDateTime('2015-05-29T10:10:00.000Z'),
+                                           UtcDateTime('2015-05-29T10:50:00.000Z'), rolled_up))
+        # only the hours that are rolled up
+        self.assertEqual(get_rollup_hours(self.start, self.end, (datetime(2015, 5, 1), datetime(2015, 5, 29, 12))),
+                         (datetime(2015, 5, 29), datetime(2015, 5, 29, 12)))
+        self.assertIsNone(get_rollup_hours(self.start, self.end, (datetime(2015, 5, 1), datetime(2015, 5, 28))))
+
+    def test_event_counts(self):
+        cursor = FakeCursor([[(datetime(2015, 5, 1), datetime(2015, 5, 29, 12))],
+                             [('INFO', 100), ('ERROR', 5)],
+                             [('INFO', 7), ('WARN', 2)]])
+        counts = get_event_counts(self.logger, 'dev', FakeConnection(cursor), self.start, self.end)
+        self.assertEqual(counts, {'INFO': 107, 'ERROR': 5, 'WARN': 2})
+        self.assertEqual(cursor.statements[0], 'select min(hour), max(hour) from dev_nm_log_hourly')
+        self.assertTrue(cursor.statements[1].startswith('select event_type, sum(event_count) from dev_nm_log_hourly '))
+        self.assertTrue(cursor.statements[2].startswith('select event_type, count(*) from dev_nm_log '))
+        self.assertTrue('and (timestamped < %(first)s or timestamped >= %(last)s)' in cursor.statements[2])
+        self.assertEqual(cursor.params[2], {'start': '2015-05-29 00:00:00', 'end': '2015-05-29 23:59:59',
+                                            'first': '2015-05-29 00:00:00', 'last': '2015-05-29 12:00:00'})
+
+    def test_event_counts_not_rolled_up(self):
+        cursor = FakeCursor([[(datetime(2015, 5, 1), datetime(2015, 5, 28))], [('INFO', 7)]])
+        counts = get_event_counts(self.logger, 'dev', FakeConnection(cursor), self.start, self.end)
+        self.assertEqual(counts, {'INFO': 7})
+        self.assertEqual(len(cursor.statements), 2)
+        self.assertFalse('first' in cursor.statements[1])
+        # an empty rollup
+        cursor = FakeCursor([[(None, None)], [('INFO', 7)]])
+        counts = get_event_counts(self.logger, 'dev', FakeConnection(cursor), self.start, self.end)
+        self.assertEqual(counts, {'INFO': 7})
+        self.assertEqual(len(cursor.statements), 2)
+
+    def test_event_counts_no_rollup(self):
+        cursor = FakeCursor([Exception('relation "dev_nm_log_hourly" does not exist'), [('INFO', 7)]])
+        conn = FakeConnection(cursor)
+        counts = get_event_counts(self.logger, 'dev', conn, self.start, self.end)
+        self.assertEqual(counts, {'INFO': 7})
+        self.assertEqual(conn.rollbacks, 1)
+        self.assertTrue(cursor.statements[1].startswith('select event_type, count(*) from dev_nm_log '))
+
+    def test_log_report_aggregate_only(self):
+        cursor = FakeCursor([Exception('relation "dev_nm_log_hourly" does not exist'), [('INFO', 48), ('WARN', 2)]])
+        redshift_handler.create_db_conn = lambda logger, db_config: FakeConnection(cursor)
+        result = log_report(self.logger, 'dev', {'db_config': None}, self.start, self.end, aggregate_only=True)
+        self.assertIsNotNone(result)
+        (summary, error_list, warning_list, clustered_error_list, clustered_warning_list) = result
+        self.assertEqual((summary['INFO'], summary['WARN'], summary['event_count']), (48, 2, 50))
+        self.assertEqual((error_list, warning_list, clustered_error_list, clustered_warning_list), ([], [], [], []))
+
+
+class TestLogReport(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        self.start = UtcDateTime('2015-05-29T00:00:00.000Z')
+        self.end = UtcDateTime('2015-05-29T23:59:59.000Z')
+        self.create_db_conn = redshift_handler.create_db_conn
+        # (event_type, user_id, device_id, timestamped, message, group_count, type_count)
+        self.rows = [('INFO', None, None, None, None, 40, 40),
+                     ('ERROR', 'us-west-2:1', 'Ncho1', datetime(2015, 5, 29, 1), 'Connection refused\nat Connect()', 3, 4),
+                     ('WARN', 'us-west-2:1', 'Ncho1', datetime(2015, 5, 29, 2), 'Slow sync', 1, 1),
+                     ('ERROR', 'us-west-2:2', 'Ncho2', datetime(2015, 5, 29, 3), 'Out of memory in the database', 1, 4)]
+
+    def tearDown(self):
+        redshift_handler.create_db_conn = self.create_db_conn
+
+    def test_log_report_sql(self):
+        sql = get_log_report_sql('dev', False)
+        self.assertTrue("case when event_type in ('ERROR', 'WARN') then id end as group_key from dev_nm_log " in sql)
+        self.assertTrue(sql.endswith("where group_row = 1 order by timestamped"))
+        sql = get_log_report_sql('dev', True)
+        self.assertTrue("case when event_type in ('ERROR', 'WARN') then split_part(message, chr(10), 1) end "
+                        "as group_key from dev_nm_log " in sql)
+        self.assertFalse('%' in sql % {'start': '2015-05-29 00:00:00', 'end': '2015-05-29 23:59:59'})
+
+    def test_log_report(self):
+        cursor = FakeCursor([self.rows])
+        redshift_handler.create_db_conn = lambda logger, db_config: FakeConnection(cursor)
+        (summary, error_list, warning_list, clustered_error_list, clustered_warning_list) = \
+            log_report(self.logger, 'dev', {'db_config': None}, self.start, self.end, limit=1, group_messages=True)
+        self.assertEqual(cursor.params[0], {'start': '2015-05-29 00:00:00', 'end': '2015-05-29 23:59:59'})
+        # the counts of the event types, not of the rows
+        self.assertEqual((summary['INFO'], summary['ERROR'], summary['WARN'], summary['event_count']),
+                         (40, 4, 1, 45))
+        # at most limit events, each with the count of its group
+        self.assertEqual([(x['device_id'], x['message'], x['count']) for x in error_list],
+                         [('Ncho1', 'Connection refused\nat Connect()', 3)])
+        self.assertEqual(error_list[0]['timestamp'], UtcDateTime(datetime(2015, 5, 29, 1)))
+        self.assertEqual([x['message'] for x in warning_list], ['Slow sync'])
+        # but all of them are clustered, with their group counts
+        self.assertEqual(sum(x['count'] for x in clustered_error_list), 4)
+        self.assertEqual(clustered_error_list[0]['count'], 3)
+        self.assertEqual([(x['count'], str(x['message'])) for x in clustered_warning_list], [(1, 'Slow sync')])
+
+    def test_log_report_ungrouped(self):
+        cursor = FakeCursor([self.rows])
+        redshift_handler.create_db_conn = lambda logger, db_config: FakeConnection(cursor)
+        (summary, error_list, warning_list, clustered_error_list, clustered_warning_list) = \
+            log_report(self.logger, 'dev', {'db_config': None}, self.start, self.end)
+        self.assertEqual([x['device_id'] for x in error_list], ['Ncho1', 'Ncho2'])
+        self.assertFalse('count' in error_list[0])
+
+
+class TestSyncfailReport(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        self.create_db_conn = redshift_handler.create_db_conn
+
+    def tearDown(self):
+        redshift_handler.create_db_conn = self.create_db_conn
+
+    def test_syncfail_report(self):
+        # (user_id, device_id, timestamped, next_timestamped), by device and time. The last
+        # success of a device is followed by the end of the report
+        rows = [('us-west-2:1', 'Ncho1', datetime(2015, 5, 29, 1), datetime(2015, 5, 29, 1, 30)),
+                ('us-west-2:1', 'Ncho1', datetime(2015, 5, 29, 5), datetime(2015, 5, 29, 6)),
+                ('us-west-2:2', 'Ncho2', datetime(2015, 5, 29, 22), datetime(2015, 5, 29, 23, 59, 59))]
+        cursor = FakeCursor([rows])
+        redshift_handler.create_db_conn = lambda logger, db_config: FakeConnection(cursor)
+        (summary, device_list) = syncfail_report(self.logger, 'dev', {'db_config': None},
+                                                 UtcDateTime('2015-05-29T00:00:00.000Z'),
+                                                 UtcDateTime('2015-05-29T23:59:59.000Z'), 1200)
+        self.assertEqual(cursor.params[0], {'start': '2015-05-29 00:00:00', 'end': '2015-05-29 23:59:59',
+                                            'like_term': '%S=SyncW & E=Success%', 'gap': 1200})
+        self.assertEqual(summary['device_count'], 2)
+        self.assertEqual([(x['user_id'], x['device_id'], len(x['gaps'])) for x in device_list],
+                         [('us-west-2:1', 'Ncho1', 2), ('us-west-2:2', 'Ncho2', 1)])
+        self.assertEqual([x['gap'] for x in device_list[0]['gaps']], [1800.0, 3600.0])
+        trailing = device_list[1]['gaps'][0]
+        self.assertEqual((trailing['startTS'], trailing['endTS'], trailing['gap']),
+                         (UtcDateTime('2015-05-29T22:00:00.000Z'), UtcDateTime('2015-05-29T23:59:59.000Z'), 7199.0))
+        self.assertTrue(cursor.closed)
+
+    def test_syncfail_report_error(self):
+        cursor = FakeCursor([Exception('relation "dev_nm_log" does not exist')])
+        redshift_handler.create_db_conn = lambda logger, db_config: FakeConnection(cursor)
+        self.assertIsNone(syncfail_report(self.logger, 'dev', {'db_config': None},
+                                          UtcDateTime('2015-05-29T00:00:00.000Z'),
+                                          UtcDateTime('2015-05-29T23:59:59.000Z'), 1200))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,391 @@
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import threading
+import time
+import unittest
+
+from AWS import redshift_handler
+from AWS.db_pool import DBConnectionPool, set_db_conn_pool
+from AWS.redshift_handler import get_manifest_keys, write_manifest, get_watermark, set_watermark, \
+    for_each_event_class, merge_staged, vacuum_deleted_rows, migrate_tables, iter_select, limit_sql, \
+    get_rollup_span, update_rollups, load_logs, rollup_tables
+from AWS.s3t3_telemetry import T3_EVENT_CLASS_FILE_PREFIXES
+from AWS.tests.fake_db import FakeConnection, FakeCursor, FakeWatermarkCursor
+from AWS.tests.fake_s3 import FakeBucket, FakeS3Connection
+from misc.utc_datetime import UtcDateTime
+
+
+class TestForEachEventClass(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        self.connections = []
+        self.create_db_conn = redshift_handler.create_db_conn
+        redshift_handler.create_db_conn = self.connect
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def tearDown(self):
+        redshift_handler.create_db_conn = self.create_db_conn
+
+    def connect(self, logger, db_config):
+        conn = FakeConnection()
+        self.connections.append(conn)
+        return conn
+
+    def process(self, conn, cursor, event_class):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+        if event_class == 'UI' and self.fail:
+            raise ValueError('failed')
+        return [{'date': '2015-05-29', 'count': len(event_class)}]
+
+    def test_all(self):
+        self.fail = False
+        stats = for_each_event_class(self.logger, {'db_config': None}, 'ALL', self.process, concurrency=3)
+        self.assertEqual(sorted(stats.keys()), sorted(T3_EVENT_CLASS_FILE_PREFIXES['ALL']))
+        self.assertEqual(stats['LOG'], [{'date': '2015-05-29', 'count': 3}])
+        self.assertEqual(len(self.connections), 3)
+        self.assertTrue(1 < self.max_running <= 3)
+        self.assertTrue(all([x.closed for x in self.connections]))
+
+    def test_one_class(self):
+        self.fail = False
+        stats = for_each_event_class(self.logger, {'db_config': None}, 'LOG', self.process, concurrency=3)
+        self.assertEqual(stats.keys(), ['LOG'])
+        self.assertEqual(len(self.connections), 1)
+
+    def test_error(self):
+        self.fail = True
+        self.assertRaises(ValueError, for_each_event_class, self.logger, {'db_config': None}, 'ALL', self.process)
+        self.assertTrue(all([x.closed for x in self.connections]))
+
+    def test_pool(self):
+        self.fail = False
+        set_db_conn_pool(DBConnectionPool())
+        try:
+            for n in range(2):
+                for_each_event_class(self.logger, {'db_config': {'dbname': 'dev'}}, 'ALL', self.process, concurrency=3)
+            # the second call reuses the connections of the first
+            self.assertEqual(len(self.connections), 3)
+            self.assertFalse(any([x.closed for x in self.connections]))
+        finally:
+            set_db_conn_pool(None)
+        self.assertTrue(all([x.closed for x in self.connections]))
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        names = ['20150528/plog-20150528235900000.gz', '20150529/plog-20150529010000000.gz',
+                 '20150529/plog-20150529020000000.gz', '20150530/plog-20150530000000000.gz']
+        last_modified = {names[0]: '2015-05-29T00:00:30.000Z',
+                         names[1]: '2015-05-29T01:00:30.000Z',
+                         names[2]: '2015-05-29T02:00:30.000Z',
+                         names[3]: '2015-05-30T00:00:30.000Z'}
+        self.names = names
+        self.bucket = FakeBucket(dict([(x, '') for x in names]), last_modified=last_modified)
+
+    def test_keys(self):
+        keys = get_manifest_keys(self.bucket, UtcDateTime('2015-05-29T00:00:00.000Z'),
+                                 UtcDateTime('2015-05-29T02:00:30.000Z'))
+        # by last modified time, not by date prefix
+        self.assertEqual(keys, self.names[0:2])
+
+    def test_write(self):
+        url = write_manifest(self.bucket, 'nm_plog-1-2.json', self.names[0:2])
+        self.assertEqual(url, 's3://bucket/manifests/nm_plog-1-2.json')
+        manifest = json.loads(self.bucket.contents['manifests/nm_plog-1-2.json'])
+        self.assertEqual([x['url'] for x in manifest['entries']], ['s3://bucket/' + x for x in self.names[0:2]])
+
+
+class TestWatermark(unittest.TestCase):
+    def test_watermark(self):
+        cursor = FakeWatermarkCursor()
+        self.assertEqual(get_watermark(cursor, 'nm_load_watermark', 'nm_log'), None)
+        set_watermark(cursor, 'nm_load_watermark', 'nm_log', UtcDateTime('2015-05-29T01:00:00.000Z'))
+        set_watermark(cursor, 'nm_load_watermark', 'nm_log', UtcDateTime('2015-05-29T02:00:00.500Z'))
+        self.assertEqual(cursor.watermarks, {'nm_log': '2015-05-29 02:00:00.500000'})
+        self.assertEqual(get_watermark(cursor, 'nm_load_watermark', 'nm_log'),
+                         UtcDateTime('2015-05-29T02:00:00.500Z'))
+
+
+class TestUploadIncremental(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        self.config = {'db_config': None, 'aws_config': {'aws_access_key_id': '', 'aws_secret_access_key': ''},
+                       's3_config': {'log': {'t3_bucket': 'log-bucket', 't3_jsonpath': 'nm_log_jsonpath.json'}}}
+        self.cursor = FakeWatermarkCursor()
+        self.invalidated = []
+        self.saved = (redshift_handler.create_db_conn, redshift_handler.create_s3_conn,
+                      redshift_handler.invalidate_db_cache)
+        redshift_handler.create_db_conn = lambda logger, db_config: FakeConnection(self.cursor)
+        s3_conn = FakeS3Connection(FakeBucket({}, name='log-bucket'))
+        redshift_handler.create_s3_conn = lambda *args: s3_conn
+        redshift_handler.invalidate_db_cache = \
+            lambda logger, project, config, start, end, lookback=None: self.invalidated.append((start, end))
+
+    def tearDown(self):
+        (redshift_handler.create_db_conn, redshift_handler.create_s3_conn,
+         redshift_handler.invalidate_db_cache) = self.saved
+
+    def test_invalidate_from_watermark(self):
+        set_watermark(self.cursor, 'dev_nm_load_watermark', 'dev_nm_log', UtcDateTime('2015-05-20T00:00:00.000Z'))
+        start = UtcDateTime('2015-05-29T00:00:00.000Z')
+        end = UtcDateTime('2015-05-29T12:00:00.000Z')
+        (stats, loaded_start, loaded_end) = redshift_handler.upload_logs_incremental(
+            self.logger, 'dev', self.config, 'LOG', start, end)
+        self.assertEqual((loaded_start, loaded_end), (UtcDateTime('2015-05-20T00:00:00.000Z'), end))
+        # the table was loaded from its watermark, not from start
+        self.assertEqual(self.invalidated, [(UtcDateTime('2015-05-20T00:00:00.000Z'), end)])
+        self.assertEqual(get_watermark(self.cursor, 'dev_nm_load_watermark', 'dev_nm_log'), end)
+
+        # nothing to load, nothing to invalidate
+        (stats, loaded_start, loaded_end) = redshift_handler.upload_logs_incremental(
+            self.logger, 'dev', self.config, 'LOG', start, end)
+        self.assertEqual((loaded_start, loaded_end), (None, end))
+        self.assertEqual(len(self.invalidated), 1)
+
+    def test_settle_time(self):
+        start = UtcDateTime(datetime.utcnow() - timedelta(hours=1))
+        end = UtcDateTime(datetime.utcnow() + timedelta(hours=1))
+        (stats, loaded_start, loaded_end) = redshift_handler.upload_logs_incremental(
+            self.logger, 'dev', self.config, 'LOG', start, end)
+        self.assertTrue(loaded_end < UtcDateTime(datetime.utcnow()))
+        self.assertEqual(get_watermark(self.cursor, 'dev_nm_load_watermark', 'dev_nm_log'), loaded_end)
+
+    def test_failed(self):
+        def create_s3_conn(*args):
+            raise Exception('no route to host')
+
+        redshift_handler.create_s3_conn = create_s3_conn
+        (stats, loaded_start, loaded_end) = redshift_handler.upload_logs_incremental(
+            self.logger, 'dev', self.config, 'LOG', UtcDateTime('2015-05-29T00:00:00.000Z'),
+            UtcDateTime('2015-05-29T12:00:00.000Z'))
+        self.assertEqual(stats['LOG'], [])
+        self.assertEqual((loaded_start, loaded_end), (None, None))
+
+    def load_incremental(self, start, end):
+        rollups = []
+
+        def update_rollups(logger, project, config, event_class, start, end, table_prefix=None):
+            rollups.append((start, end))
+            return dict((rollup_name, []) for (rollup_name, source_class, sql_statement) in rollup_tables)
+
+        saved = redshift_handler.update_rollups
+        redshift_handler.update_rollups = update_rollups
+        try:
+            (stats, loaded_end) = load_logs(self.logger, 'dev', self.config, 'LOG', start, end, mode='incremental')
+        finally:
+            redshift_handler.update_rollups = saved
+        return loaded_end, rollups
+
+    def test_load_incremental(self):
+        set_watermark(self.cursor, 'dev_nm_load_watermark', 'dev_nm_log', UtcDateTime('2015-05-20T00:00:00.000Z'))
+        start = UtcDateTime('2015-05-29T00:00:00.000Z')
+        end = UtcDateTime('2015-05-29T12:00:00.000Z')
+        (loaded_end, rollups) = self.load_incremental(start, end)
+        self.assertEqual(loaded_end, end)
+        # the rollups are updated from the watermark the table was loaded from, not from start ...
+        self.assertEqual(rollups, [(UtcDateTime('2015-05-20T00:00:00.000Z'), end)])
+        # ... back to the oldest events the files modified since can hold
+        self.assertEqual(get_rollup_span(rollups[0][0], end)[0], datetime(2015, 5, 17))
+
+        # nothing new, nothing to roll up
+        (loaded_end, rollups) = self.load_incremental(start, end)
+        self.assertEqual((loaded_end, rollups), (end, []))
+
+    def test_load_incremental_settle_time(self):
+        start = UtcDateTime(datetime.utcnow() - timedelta(hours=1))
+        end = UtcDateTime(datetime.utcnow() + timedelta(hours=1))
+        (loaded_end, rollups) = self.load_incremental(start, end)
+        self.assertTrue(loaded_end < UtcDateTime(datetime.utcnow()))
+        self.assertEqual(rollups, [(start, loaded_end)])
+
+
+class TestMerge(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+
+    def test_merge(self):
+        cursor = FakeCursor([[(10, 10, '2015-05-29 00:00:01', '2015-05-29 23:59:59')]], rowcount=3)
+        self.assertEqual(merge_staged(self.logger, cursor, 'nm_log', 'stage_nm_log'), 3)
+        self.assertEqual(len(cursor.statements), 3)
+        self.assertTrue(cursor.statements[1].startswith('delete from nm_log using stage_nm_log '
+                                                        'where nm_log.id = stage_nm_log.id'))
+        self.assertTrue("nm_log.timestamped >= '2015-05-29 00:00:01'" in cursor.statements[1])
+        self.assertEqual(cursor.statements[2], 'insert into nm_log select * from stage_nm_log')
+
+    def test_merge_without_timestamps(self):
+        cursor = FakeCursor([[(10, 9, '2015-05-29 00:00:01', '2015-05-29 23:59:59')]])
+        merge_staged(self.logger, cursor, 'nm_log', 'stage_nm_log')
+        self.assertFalse('timestamped' in cursor.statements[1])
+
+    def test_merge_nothing_staged(self):
+        cursor = FakeCursor([[(0, 0, None, None)]])
+        self.assertEqual(merge_staged(self.logger, cursor, 'nm_log', 'stage_nm_log'), 0)
+        self.assertEqual(len(cursor.statements), 1)
+
+    def test_vacuum(self):
+        conn = FakeConnection()
+        cursor = FakeCursor([[(1000,)]])
+        self.assertFalse(vacuum_deleted_rows(self.logger, conn, cursor, 'nm_log', 10))
+        self.assertFalse(vacuum_deleted_rows(self.logger, conn, cursor, 'nm_log', 0))
+        cursor = FakeCursor([[(1000,)]])
+        self.assertTrue(vacuum_deleted_rows(self.logger, conn, cursor, 'nm_log', 100))
+        self.assertEqual(cursor.statements[-1], 'vacuum delete only nm_log')
+        self.assertEqual(conn.isolation_levels, [0, 1])
+
+    def test_vacuum_unknown_table(self):
+        conn = FakeConnection()
+        cursor = FakeCursor([[]])
+        self.assertFalse(vacuum_deleted_rows(self.logger, conn, cursor, 'Dev_nm_log', 100))
+        # svv_table_info has the lowercase name
+        self.assertEqual(cursor.params, [('dev_nm_log',)])
+        self.assertEqual(conn.isolation_levels, [])
+
+    def test_vacuum_error(self):
+        config = {'db_config': None, 'aws_config': {'aws_access_key_id': '', 'aws_secret_access_key': ''},
+                  's3_config': {'log': {'t3_bucket': 'log-bucket', 't3_jsonpath': 'nm_log_jsonpath.json'}}}
+        cursor = FakeCursor([[(10,)], [(10, 10, '2015-05-29 00:00:01', '2015-05-29 23:59:59')]], rowcount=3)
+
+        def vacuum_deleted_rows(logger, conn, cursor, table_name, deleted_count):
+            raise Exception('permission denied')
+
+        create_db_conn = redshift_handler.create_db_conn
+        vacuum = redshift_handler.vacuum_deleted_rows
+        redshift_handler.create_db_conn = lambda logger, db_config: FakeConnection(cursor)
+        redshift_handler.vacuum_deleted_rows = vacuum_deleted_rows
+        try:
+            stats = redshift_handler.merge_logs(self.logger, 'dev', config, 'LOG',
+                                                UtcDateTime('2015-05-29T00:00:00.000Z'),
+                                                UtcDateTime('2015-05-29T12:00:00.000Z'))
+        finally:
+            redshift_handler.create_db_conn = create_db_conn
+            redshift_handler.vacuum_deleted_rows = vacuum
+        # the merge was committed, so its stats are kept
+        self.assertEqual(stats['LOG'], [{'date': '2015-05-29', 'count': 10}])
+
+
+class TestMigrate(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        db_dir = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'config', 'db')
+        self.config = {'db_config': None, 'db_sql': {'log': os.path.join(db_dir, 'nm_log.sql')}}
+        self.create_db_conn = redshift_handler.create_db_conn
+
+    def tearDown(self):
+        redshift_handler.create_db_conn = self.create_db_conn
+
+    def migrate(self, cursor, **kwargs):
+        redshift_handler.create_db_conn = lambda logger, db_config: FakeConnection(cursor)
+        return migrate_tables(self.logger, 'dev', self.config, 'LOG', **kwargs)
+
+    def test_migrate(self):
+        cursor = FakeCursor([[]], rowcount=42)
+        self.assertEqual(self.migrate(cursor), {'LOG': [{'table': 'dev_nm_log', 'count': 42}]})
+        statements = cursor.statements[1:]
+        self.assertEqual(statements[0], 'drop table if exists dev_migrate_nm_log')
+        self.assertTrue(statements[1].startswith('CREATE TABLE IF NOT EXISTS dev_migrate_nm_log ('))
+        self.assertTrue('compound sortkey (timestamped, device_id)' in statements[1])
+        self.assertEqual(statements[2:], ['insert into dev_migrate_nm_log select * from dev_nm_log',
+                                          'drop table if exists dev_nm_log_old',
+                                          'alter table dev_nm_log rename to dev_nm_log_old',
+                                          'alter table dev_migrate_nm_log rename to dev_nm_log',
+                                          'drop table dev_nm_log_old'])
+
+    def test_keep_old(self):
+        cursor = FakeCursor([[('timestamped',)]])
+        self.migrate(cursor, keep_old=True)
+        self.assertEqual(cursor.statements[-1], 'alter table dev_migrate_nm_log rename to dev_nm_log')
+
+    def test_up_to_date(self):
+        cursor = FakeCursor([[('timestamped',), ('device_id',)]])
+        self.assertEqual(self.migrate(cursor), {'LOG': []})
+        self.assertEqual(len(cursor.statements), 1)
+
+
+class TestIterSelect(unittest.TestCase):
+    def test_limit_sql(self):
+        self.assertEqual(limit_sql('select * from nm_log;', None), 'select * from nm_log;')
+        self.assertEqual(limit_sql(' select * from nm_log; ', 10),
+                         'select * from (select * from nm_log\n) as limited limit 10')
+        # a trailing comment does not comment out the limit
+        self.assertEqual(limit_sql('select * from nm_log; -- all of it', 10),
+                         'select * from (select * from nm_log -- all of it\n) as limited limit 10')
+        # the order of a subquery is not kept, so a statement with its own is not wrapped
+        for sql_st in ('select * from nm_log order by timestamped desc',
+                       'select * from nm_log\nORDER  BY 1;',
+                       'select * from nm_log limit 5',
+                       'with t as (select * from nm_log) select * from t order by 1'):
+            self.assertEqual(limit_sql(sql_st, 10), sql_st)
+        # only top-level ORDER BY and LIMIT count
+        for sql_st in ("select row_number() over (order by timestamped) from nm_log",
+                       "select * from nm_log where message like '%order by%'",
+                       "select 1 as \"limit\" -- order by",
+                       "select * from (select * from nm_log limit 5) as t /* limit */"):
+            self.assertNotEqual(limit_sql(sql_st, 10), sql_st)
+
+    def test_iter_rows_limit(self):
+        cursor = FakeCursor([[(n,) for n in range(25)]])
+        cursor.execute('select n from t')
+        self.assertEqual(list(redshift_handler.iter_rows(cursor, batch_size=10, limit=12)), [(n,) for n in range(12)])
+        self.assertEqual(cursor.fetches, [10, 2])
+
+    def test_iter_select(self):
+        cursor = FakeCursor([[(n,) for n in range(25)]])
+        conn = FakeConnection(cursor)
+        rows = iter_select(logging.getLogger('test'), conn, 'select n from t', limit=100, batch_size=10)
+        self.assertEqual(next(rows), (0,))
+        # only the first batch is fetched
+        self.assertEqual(cursor.fetches, [10])
+        self.assertEqual(list(rows), [(n,) for n in range(1, 25)])
+        self.assertEqual(cursor.fetches, [10, 10, 5, 0])
+        self.assertTrue(cursor.closed)
+        self.assertEqual(conn.cursor_names, ['iter_select'])
+        self.assertTrue(cursor.statements[0].endswith('limit 100'))
+
+
+class TestRollups(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        db_dir = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'config', 'db')
+        self.config = {'db_config': None,
+                       'db_sql': dict((x, os.path.join(db_dir, 'nm_%s.sql' % x))
+                                      for x in ('log_hourly', 'active_devices_hourly', 'counter_hourly'))}
+        self.create_db_conn = redshift_handler.create_db_conn
+
+    def tearDown(self):
+        redshift_handler.create_db_conn = self.create_db_conn
+
+    def test_rollup_span(self):
+        (start, end) = get_rollup_span(UtcDateTime('2015-05-29T00:00:00.000Z'), UtcDateTime('2015-05-29T23:59:59.000Z'))
+        self.assertEqual(start, datetime(2015, 5, 26))
+        self.assertEqual(end, datetime(2015, 5, 30))
+        (start, end) = get_rollup_span(UtcDateTime('2015-05-29T10:30:00.000Z'), UtcDateTime('2015-05-29T12:00:00.000Z'))
+        self.assertEqual(start, datetime(2015, 5, 26, 10))
+        self.assertEqual(end, datetime(2015, 5, 29, 12))
+
+    def test_update_rollups(self):
+        cursor = FakeCursor([], rowcount=24)
+        redshift_handler.create_db_conn = lambda logger, db_config: FakeConnection(cursor)
+        stats = update_rollups(self.logger, 'dev', self.config, 'LOG', UtcDateTime('2015-05-29T00:00:00.000Z'),
+                               UtcDateTime('2015-05-29T23:59:59.000Z'))
+        window = '2015-05-26 00:00:00 - 2015-05-30 00:00:00'
+        self.assertEqual(stats, {'log_hourly': [{'date': window, 'count': 24}],
+                                 'active_devices_hourly': [{'date': window, 'count': 24}]})
+        self.assertEqual(len(cursor.statements), 6)
+        self.assertTrue(cursor.statements[0].startswith('CREATE TABLE IF NOT EXISTS dev_nm_log_hourly ('))
+        self.assertEqual(cursor.statements[1], 'delete from dev_nm_log_hourly where hour >= %(start)s and hour < %(end)s')
+        self.assertTrue(cursor.statements[2].startswith('insert into dev_nm_log_hourly '))
+        self.assertTrue('from dev_nm_log e left join (' in cursor.statements[2])
+        self.assertTrue('from dev_nm_device_info where timestamped < %(end)s' in cursor.statements[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
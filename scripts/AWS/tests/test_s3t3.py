@@ -0,0 +1,514 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+from StringIO import StringIO
+
+from boto.exception import S3ResponseError
+
+from AWS import s3t3_fetch
+from AWS.s3t3_batch import T3EventBatch
+from AWS.s3t3_cache import T3FileCache
+from AWS.s3t3_fetch import fetch_t3_files, crawl_prefixes, iter_chunks, iter_gzip_lines, iter_t3_file_lines
+from AWS.s3t3_index import T3KeyIndex, set_t3_key_index
+from AWS.s3t3_telemetry import get_client_events, iter_client_events, count_client_events, get_client_files, \
+    get_client_event_batch, get_pinger_events, T3EventFilter, get_latest_device_info_event, get_trouble_ticket_events
+from AWS.tests.fake_s3 import FakeBucket, FakeS3Connection
+from misc.utc_datetime import UtcDateTime
+
+
+def gzip_string(s):
+    out = StringIO()
+    with gzip.GzipFile(fileobj=out, mode='w') as f:
+        f.write(s)
+    return out.getvalue()
+
+
+class TestFetchT3Files(unittest.TestCase):
+    def setUp(self):
+        self.names = ['20150529/key-%03d.gz' % n for n in range(50)]
+        self.bucket = FakeBucket(dict([(x, gzip_string('content of %s' % x)) for x in self.names]), jitter=0.01)
+        self.conn = FakeS3Connection(self.bucket)
+        self.clone_s3_conn = s3t3_fetch.clone_s3_conn
+        s3t3_fetch.clone_s3_conn = lambda conn: conn
+
+    def tearDown(self):
+        s3t3_fetch.clone_s3_conn = self.clone_s3_conn
+
+    def jobs(self):
+        return ((self.bucket.new_key(x), n) for (n, x) in enumerate(self.names))
+
+    def fetch(self, concurrency):
+        return [(job, '\n'.join(lines)) for (job, lines) in fetch_t3_files(self.conn, 'bucket', self.jobs(),
+                                                                          concurrency=concurrency)]
+
+    def test_sequential(self):
+        results = self.fetch(1)
+        self.assertEqual([job[1] for (job, content) in results], range(len(self.names)))
+        self.assertEqual([content for (job, content) in results], ['content of %s' % x for x in self.names])
+
+    def test_concurrent_keeps_order(self):
+        results = self.fetch(4)
+        self.assertEqual([job[1] for (job, content) in results], range(len(self.names)))
+        self.assertEqual([content for (job, content) in results], ['content of %s' % x for x in self.names])
+
+    def test_error(self):
+        del self.bucket.contents[self.names[10]]
+        results = fetch_t3_files(self.conn, 'bucket', self.jobs(), concurrency=4)
+        for n in range(10):
+            next(results)
+        self.assertRaises(S3ResponseError, next, results)
+
+
+class TestCrawlPrefixes(unittest.TestCase):
+    def setUp(self):
+        contents = dict()
+        for user in range(5):
+            userid = 'us-west-2:user-%d' % user
+            for device in range(user):
+                for n in range(3):
+                    name = '20150529/%s/%s/Ncho%d/NachoMail/log-%d.gz' % (hashlib.sha256(userid).hexdigest()[0:8], userid,
+                                                                          device, n)
+                    contents[name] = ''
+        contents['20150530/00000000/us-west-2:user-9/Ncho0/NachoMail/log-0.gz'] = ''
+        self.bucket = FakeBucket(contents)
+        self.conn = FakeS3Connection(self.bucket)
+        self.clone_s3_conn = s3t3_fetch.clone_s3_conn
+        s3t3_fetch.clone_s3_conn = lambda conn: conn
+
+    def tearDown(self):
+        s3t3_fetch.clone_s3_conn = self.clone_s3_conn
+
+    def test_crawl(self):
+        expected = []
+        for l1_prefix in self.bucket.list(prefix='20150529/', delimiter='/'):
+            for l2_prefix in self.bucket.list(prefix=l1_prefix.name, delimiter='/'):
+                for l3_prefix in self.bucket.list(prefix=l2_prefix.name, delimiter='/'):
+                    expected.append(l3_prefix.name)
+        self.assertEqual(len(expected), 10)
+        self.assertTrue(expected[0].endswith('/Ncho0/'))
+        self.assertEqual(crawl_prefixes(self.conn, 'bucket', '20150529/', 3, concurrency=1), expected)
+        self.assertEqual(crawl_prefixes(self.conn, 'bucket', '20150529/', 3, concurrency=4), expected)
+        self.assertEqual(crawl_prefixes(self.conn, 'bucket', '20150529/', 1, concurrency=4), sorted(set(
+            [x[:18] for x in expected])))
+
+    def test_error(self):
+        def fail(prefix='', marker='', delimiter=''):
+            raise IOError('list failed')
+        self.bucket.list = fail
+        self.assertRaises(IOError, crawl_prefixes, self.conn, 'bucket', '20150529/', 3)
+
+
+class TestGzipLines(unittest.TestCase):
+    def setUp(self):
+        self.chunk_size = s3t3_fetch.T3_READ_CHUNK_SIZE
+        s3t3_fetch.T3_READ_CHUNK_SIZE = 100
+
+    def tearDown(self):
+        s3t3_fetch.T3_READ_CHUNK_SIZE = self.chunk_size
+
+    def test_lines(self):
+        lines = ['line %d %s' % (n, 'x' * random.randint(0, 300)) for n in range(200)]
+        for content in ('\n'.join(lines), '\n'.join(lines) + '\n'):
+            data = gzip_string(content)
+            self.assertEqual(list(iter_gzip_lines(iter_chunks(data))), lines)
+            self.assertEqual(list(iter_gzip_lines([data])), lines)
+            self.assertEqual(list(iter_gzip_lines(data[n:n + 1] for n in range(len(data)))), lines)
+
+    def test_stream_from_key(self):
+        bucket = FakeBucket({'key': gzip_string('a\nb\nc')})
+        key = bucket.new_key('key')
+        self.assertEqual(list(iter_t3_file_lines(key)), ['a', 'b', 'c'])
+        self.assertTrue(key.closed)
+
+
+class TestT3FileCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.fetched = []
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def fetch(self, content):
+        def _fetch():
+            self.fetched.append(content)
+            return content
+        return _fetch
+
+    def test_disk(self):
+        cache = T3FileCache(self.cache_dir)
+        self.assertEqual(cache.get_compressed('bucket', 'key1', '"1"', self.fetch('abc')), 'abc')
+        self.assertEqual(cache.get_compressed('bucket', 'key1', '"1"', self.fetch('abc')), 'abc')
+        self.assertEqual(self.fetched, ['abc'])
+        # a new object with the same key name
+        self.assertEqual(cache.get_compressed('bucket', 'key1', '"2"', self.fetch('def')), 'def')
+        self.assertEqual(self.fetched, ['abc', 'def'])
+        # another process sharing the directory
+        cache = T3FileCache(self.cache_dir)
+        self.assertEqual(cache.get_compressed('bucket', 'key1', '"1"', self.fetch('abc')), 'abc')
+        self.assertEqual(self.fetched, ['abc', 'def'])
+
+    def test_memory(self):
+        cache = T3FileCache(self.cache_dir, memory_size=len('abcdef') + 3)
+        cache.get_compressed('bucket', 'key1', '"1"', self.fetch('abcdef'))
+        self.assertEqual(cache.memory.keys(), [T3FileCache.cache_key('bucket', 'key1', '"1"')])
+        cache.get_compressed('bucket', 'key2', '"2"', self.fetch('ghijkl'))
+        self.assertEqual(cache.memory.keys(), [T3FileCache.cache_key('bucket', 'key2', '"2"')])
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        self.assertEqual(cache.get_compressed('bucket', 'key2', '"2"', self.fetch('ghijkl')), 'ghijkl')
+        self.assertEqual(self.fetched, ['abcdef', 'ghijkl'])
+
+    def test_eviction(self):
+        content = ''.join([chr(random.randint(0, 255)) for n in range(1000)])
+        size = len(content)
+        cache = T3FileCache(self.cache_dir, max_size=size * 5)
+        for n in range(10):
+            cache.get_compressed('bucket', 'key%d' % n, '"%d"' % n, self.fetch(content))
+            time.sleep(0.01)
+        self.assertLessEqual(cache.disk_used, size * 5)
+        self.assertTrue(os.path.exists(cache.path(T3FileCache.cache_key('bucket', 'key9', '"9"'))))
+        self.assertFalse(os.path.exists(cache.path(T3FileCache.cache_key('bucket', 'key0', '"0"'))))
+
+
+class TestT3KeyIndex(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        # treat 20150529 as today until a test says otherwise
+        self.index = T3KeyIndex(os.path.join(self.cache_dir, 'index.sqlite'), seal_delay=timedelta(days=365*100))
+        self.bucket = FakeBucket(dict([('20150529/plog-20150529000%d00000.gz' % n, 'x' * n) for n in range(5)]))
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_parse_key_name(self):
+        self.assertEqual(T3KeyIndex.parse_key_name('20150529/abcdef01/us-west-2:1234/Ncho3168E8A8/NachoMail/'
+                                                   'log-20150529000100000.gz'),
+                         ('20150529', 'us-west-2:1234', 'Ncho3168E8A8', 'log', '20150529000100000'))
+        self.assertEqual(T3KeyIndex.parse_key_name('20150529/plog-20150529063152823.gz'),
+                         ('20150529', None, None, 'plog', '20150529063152823'))
+
+    def test_incremental(self):
+        keys = self.index.list(self.bucket, '20150529', ordered=True)
+        self.assertEqual([x.name for x in keys], sorted(self.bucket.contents))
+        self.assertEqual([x.size for x in keys], range(5))
+        self.bucket.contents['20150529/plog-20150529000500000.gz'] = ''
+        self.bucket.contents['20150528/plog-20150528000500000.gz'] = ''
+        self.bucket.listed = []
+        keys = self.index.list(self.bucket, '20150529', ordered=True)
+        self.assertEqual([x.name for x in keys], sorted(self.bucket.contents)[1:])
+        self.assertEqual(self.bucket.listed, ['20150529/plog-20150529000500000.gz'])
+        keys = self.index.list(self.bucket, '20150529', ordered=True, marker='20150529/plog-201505290003')
+        self.assertEqual(len(keys), 3)
+
+    def test_unsealed(self):
+        self.index.list(self.bucket, '20150529')
+        self.bucket.contents['20150529/plog-20150529000500000.gz'] = ''
+        # listed less than max_age ago
+        self.assertEqual(len(self.index.list(self.bucket, '20150529')), 5)
+        self.assertEqual(self.bucket.list_count, 1)
+        self.index.max_age = timedelta(0)
+        self.assertEqual(len(self.index.list(self.bucket, '20150529')), 6)
+        self.assertEqual(self.bucket.list_count, 2)
+
+    def test_sealed(self):
+        self.index.max_age = timedelta(0)
+        self.index.list(self.bucket, '20150529')
+        self.index.list(self.bucket, '20150529')
+        self.assertEqual(self.bucket.list_count, 2)
+        # the last listing was done after the day was complete
+        self.index.seal_delay = timedelta(0)
+        del self.bucket.contents['20150529/plog-20150529000400000.gz']
+        self.assertEqual(len(self.index.list(self.bucket, '20150529')), 5)
+        self.assertEqual(len(self.index.list(self.bucket, '20150529/plog-201505290003')), 1)
+        self.assertEqual(self.bucket.list_count, 2)
+
+    def test_latest_keys(self):
+        # a file created at the same time as another, under another prefix
+        self.bucket.contents['20150528/plog-20150529000200000.gz'] = ''
+        self.index.list(self.bucket, '20150528')
+        self.index.list(self.bucket, '20150529')
+        after = UtcDateTime('2015-05-29T00:01:00.000Z')
+        before = UtcDateTime('2015-05-29T00:04:00.000Z')
+        for page_size in (1, 2, 10):
+            keys = self.index.latest_keys(self.bucket, 'plog', '', '', after, before, page_size=page_size)
+            self.assertEqual([x.name for x in keys], ['20150529/plog-20150529000300000.gz',
+                                                      '20150529/plog-20150529000200000.gz',
+                                                      '20150528/plog-20150529000200000.gz',
+                                                      '20150529/plog-20150529000100000.gz'])
+
+
+class TestT3EventFilter(unittest.TestCase):
+    def setUp(self):
+        self.after = UtcDateTime('2015-05-29T00:00:00.000Z')
+        self.before = UtcDateTime('2015-05-29T00:01:00.000Z')
+        self.lines = [json.dumps({'event_type': ['WARN', 'INFO', 'ERROR'][n % 3],
+                                  'thread_id': n % 4,
+                                  'timestamp': '2015-05-29T00:00:%02d.000Z' % (n * 2),
+                                  'message': 'message %d' % n}) for n in range(30)]
+        self.loaded = []
+
+    def loads(self, line):
+        self.loaded.append(line)
+        return json.loads(line)
+
+    def messages(self, **kwargs):
+        event_filter = T3EventFilter(self.after, self.before, loads=self.loads, **kwargs)
+        return [ev['message'] for (line, ev, timestamp) in event_filter.filter(self.lines)]
+
+    def test_time_window(self):
+        self.after = UtcDateTime('2015-05-29T00:00:30.000Z')
+        self.assertEqual(self.messages(), ['message %d' % n for n in range(15, 30)])
+
+    def test_prechecks(self):
+        self.assertEqual(self.messages(event_type='ERROR', threadid=1), ['message 5', 'message 17', 'message 29'])
+        self.assertTrue(len(self.loaded) <= 10)
+        self.loaded = []
+        self.assertEqual(self.messages(search='message 1[12]'), ['message 11', 'message 12'])
+        self.assertEqual(len(self.loaded), 2)
+
+    def test_missing_event_type(self):
+        self.lines = [json.dumps({'timestamp': '2015-05-29T00:00:00.000Z', 'message': 'no type'})]
+        self.assertEqual(self.messages(event_type='ERROR'), ['no type'])
+
+
+class TestClientEvents(unittest.TestCase):
+    USER_ID = 'us-west-2:a1b2c3-d4e5-f6a7-b8c9-d0e1f2a3b4c5'
+    DEVICE_ID = 'Ncho3168E8A8'
+
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        contents = dict()
+        for minute in range(10):
+            created_at = '2015052900%02d00000' % minute
+            events = [{'id': '%d-%d' % (minute, n),
+                       'event_type': 'WARN' if n % 3 else 'ERROR',
+                       'thread_id': n % 2 + 1,
+                       'timestamp': '2015-05-29T00:0%d:%02d.000Z' % (minute, n * 10),
+                       'message': 'message %d' % n} for n in range(6)]
+            name = '20150529/%s/%s/%s/NachoMail/log-%s.gz' % (hashlib.sha256(self.USER_ID).hexdigest()[0:8],
+                                                              self.USER_ID, self.DEVICE_ID, created_at)
+            contents[name] = gzip_string('\n'.join([json.dumps(x) for x in events]))
+        self.bucket = FakeBucket(contents, jitter=0.01)
+        self.conn = FakeS3Connection(self.bucket)
+        self.clone_s3_conn = s3t3_fetch.clone_s3_conn
+        s3t3_fetch.clone_s3_conn = lambda conn: conn
+
+    def tearDown(self):
+        s3t3_fetch.clone_s3_conn = self.clone_s3_conn
+        set_t3_key_index(None)
+
+    def get_events(self, after, before, **kwargs):
+        return get_client_events(self.conn, 'bucket', '', '', UtcDateTime(after), UtcDateTime(before),
+                                 'LOG', '', logger=self.logger, **kwargs)
+
+    def test_window(self):
+        events = self.get_events('2015-05-29T00:02:00.000Z', '2015-05-29T00:05:00.000Z')
+        self.assertEqual(len(events), 18)
+        self.assertEqual(events[0]['id'], '2-0')
+        self.assertEqual(events[-1]['id'], '4-5')
+        self.assertEqual(events[0]['user_id'], self.USER_ID)
+        self.assertEqual(events[0]['device_id'], self.DEVICE_ID)
+        self.assertEqual(events[0]['module'], 'client')
+
+    def test_previous_file(self):
+        # the file created before the window is processed last
+        events = self.get_events('2015-05-29T00:02:30.000Z', '2015-05-29T00:03:30.000Z')
+        self.assertEqual([x['id'] for x in events], ['3-0', '3-1', '3-2', '2-3', '2-4', '2-5'])
+
+    def test_concurrency(self):
+        after = '2015-05-29T00:01:30.000Z'
+        before = '2015-05-29T00:08:00.000Z'
+        self.assertEqual([x['id'] for x in self.get_events(after, before, concurrency=1)],
+                         [x['id'] for x in self.get_events(after, before, concurrency=4)])
+
+    def test_key_index(self):
+        after = '2015-05-29T00:01:30.000Z'
+        before = '2015-05-29T00:08:00.000Z'
+        expected = [x['id'] for x in self.get_events(after, before)]
+        cache_dir = tempfile.mkdtemp()
+        try:
+            set_t3_key_index(T3KeyIndex(os.path.join(cache_dir, 'index.sqlite')))
+            self.assertEqual([x['id'] for x in self.get_events(after, before)], expected)
+            self.assertEqual([x['id'] for x in self.get_events(after, before)], expected)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_listing_is_pruned(self):
+        bucket = self.bucket
+        bucket.listed = []
+        files = get_client_files(bucket, self.USER_ID, self.DEVICE_ID, UtcDateTime('2015-05-29T00:02:30.000Z'),
+                                 UtcDateTime('2015-05-29T00:03:30.000Z'), 'LOG', logger=self.logger)
+        names = [key.name[-20:-3] for (key, uploaded_at_ts, m) in files]
+        self.assertEqual(names, ['20150529000300000', '20150529000200000'])
+        # stopped at the first file created after the window
+        self.assertEqual(bucket.listed[-1][-20:-3], '20150529000400000')
+
+    def test_previous_file_earlier_hour(self):
+        bucket = self.bucket
+        prefix = sorted(bucket.contents)[0][:-20]
+        bucket.contents[prefix + '20150529050000000.gz'] = gzip_string('')
+        bucket.contents[prefix + '20150529070000000.gz'] = gzip_string('')
+        bucket.listed = []
+        files = get_client_files(bucket, self.USER_ID, self.DEVICE_ID, UtcDateTime('2015-05-29T06:10:00.000Z'),
+                                 UtcDateTime('2015-05-29T06:20:00.000Z'), 'LOG', logger=self.logger)
+        self.assertEqual([key.name[-20:-3] for (key, uploaded_at_ts, m) in files], ['20150529050000000'])
+
+    def test_latest_device_info(self):
+        bucket = self.bucket
+        prefix = sorted(bucket.contents)[0][:-24]
+        for minute in (0, 5):
+            events = [{'id': 'di-%d-%d' % (minute, n), 'timestamp': '2015-05-29T00:0%d:%02d.000Z' % (minute, n * 10),
+                       'build_number': minute} for n in range(3)]
+            bucket.contents[prefix + 'device_info-2015052900%02d00000.gz' % minute] = \
+                gzip_string('\n'.join([json.dumps(x) for x in events]))
+        after = UtcDateTime('2015-05-29T00:07:00.000Z')
+        before = UtcDateTime('2015-05-29T00:08:00.000Z')
+        ev = get_latest_device_info_event(self.conn, 'bucket', '', self.DEVICE_ID, after, before, logger=self.logger)
+        self.assertEqual(ev['id'], 'di-5-2')
+        cache_dir = tempfile.mkdtemp()
+        try:
+            set_t3_key_index(T3KeyIndex(os.path.join(cache_dir, 'index.sqlite')))
+            ev = get_latest_device_info_event(self.conn, 'bucket', '', self.DEVICE_ID, after, before, logger=self.logger)
+            self.assertEqual(ev['id'], 'di-5-2')
+            self.assertEqual(ev['user_id'], self.USER_ID)
+            self.assertEqual(ev['device_id'], self.DEVICE_ID)
+            before = UtcDateTime('2015-05-29T00:05:15.000Z')
+            ev = get_latest_device_info_event(self.conn, 'bucket', self.USER_ID, '', after, before, logger=self.logger)
+            self.assertEqual(ev['id'], 'di-5-1')
+            before = UtcDateTime('2015-05-29T00:05:00.000Z')
+            ev = get_latest_device_info_event(self.conn, 'bucket', self.USER_ID, self.DEVICE_ID, after, before,
+                                              logger=self.logger)
+            self.assertEqual(ev['id'], 'di-0-2')
+            self.assertEqual(get_latest_device_info_event(self.conn, 'bucket', '', 'NchoOther', after, before,
+                                                          logger=self.logger), None)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_iter_and_count(self):
+        after = UtcDateTime('2015-05-29T00:01:30.000Z')
+        before = UtcDateTime('2015-05-29T00:08:00.000Z')
+        events = get_client_events(self.conn, 'bucket', '', '', after, before, 'LOG', '', logger=self.logger,
+                                   event_type='ERROR')
+        self.assertEqual([x['id'] for x in events],
+                         [x['id'] for x in iter_client_events(self.conn, 'bucket', '', '', after, before, 'LOG', '',
+                                                              logger=self.logger, event_type='ERROR')])
+        self.assertEqual(len(events), count_client_events(self.conn, 'bucket', '', '', after, before, 'LOG', '',
+                                                          logger=self.logger, event_type='ERROR'))
+        self.assertTrue(all([x['event_type'] == 'ERROR' for x in events]))
+
+    def test_event_batch(self):
+        after = UtcDateTime('2015-05-29T00:01:30.000Z')
+        before = UtcDateTime('2015-05-29T00:08:00.000Z')
+        events = get_client_events(self.conn, 'bucket', '', '', after, before, 'LOG', '', logger=self.logger)
+        batch = get_client_event_batch(self.conn, 'bucket', '', '', after, before, 'LOG', '', logger=self.logger)
+        self.assertEqual(len(batch), len(events))
+        self.assertEqual([dict(x) for x in batch], events)
+        self.assertEqual(batch.counts('event_type'), {'WARN': 26, 'ERROR': 13})
+
+        batch = get_client_event_batch(self.conn, 'bucket', '', '', after, before, 'LOG', '', logger=self.logger,
+                                       fields=('id', 'message'))
+        self.assertEqual(sorted(batch[0].keys()), ['id', 'message', 'timestamp'])
+        self.assertEqual([x['message'] for x in batch], [x['message'] for x in events])
+
+
+class TestT3EventBatch(unittest.TestCase):
+    def setUp(self):
+        self.events = [{'id': u'a', 'timestamp': UtcDateTime('2015-05-29T00:01:02.003Z'), 'thread_id': 1,
+                        'event_type': u'WARN', 'message': u'caf\xe9\nline 2', 'client': u'c1', 'counter': 5},
+                       {'id': u'b', 'timestamp': UtcDateTime('2015-05-29T00:01:02.004Z'), 'thread_id': u'main',
+                        'event_type': u'ERROR', 'message': None, 'client': u'c2'},
+                       {'id': u'c', 'timestamp': UtcDateTime('2015-05-29T00:01:02.005Z'),
+                        'event_type': u'WARN', 'client': u'c1'}]
+        self.batch = T3EventBatch()
+        self.batch.extend(self.events)
+
+    def test_rows(self):
+        self.assertEqual(len(self.batch), 3)
+        for (row, ev) in zip(self.batch, self.events):
+            self.assertEqual(dict(row), ev)
+        self.assertEqual(self.batch[-1]['id'], u'c')
+        self.assertTrue('thread_id' not in self.batch[2])
+        self.assertEqual(self.batch[1].get('uploaded_at'), None)
+        self.assertRaises(IndexError, lambda: self.batch[3])
+
+    def test_update_row(self):
+        row = self.batch[0]
+        row['build_number'] = 12
+        row['client'] = u'c3'
+        del row['message']
+        self.assertEqual(self.batch[0]['build_number'], 12)
+        self.assertEqual(self.batch[0]['client'], u'c3')
+        self.assertTrue('message' not in self.batch[0])
+        self.assertEqual(self.batch.counts('client'), {u'c1': 1, u'c2': 1, u'c3': 1})
+
+    def test_columns(self):
+        self.assertEqual(self.batch.counts('event_type'), {u'WARN': 2, u'ERROR': 1})
+        self.assertEqual(self.batch.unique('client'), set([u'c1', u'c2']))
+        self.assertEqual(list(self.batch.column('timestamp')), [x['timestamp'].epoch_us for x in self.events])
+        self.assertRaises(ValueError, self.batch.column, 'message')
+
+
+class TestPingerEvents(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        contents = dict()
+        for minute in range(1, 10):
+            # a pinger file holds the events of the minute before it is uploaded
+            events = [{'client': 'client-%d' % (n % 2),
+                       'device': 'Ncho3168E8A8',
+                       'timestamp': '2015-05-29T00:0%d:%02d.000Z' % (minute - 1, n * 10),
+                       'message': 'message %d-%d' % (minute, n)} for n in range(6)]
+            name = '20150529/plog-2015052900%02d00000.gz' % minute
+            contents[name] = gzip_string('\n'.join([json.dumps(x) for x in events]))
+        self.bucket = FakeBucket(contents)
+        self.conn = FakeS3Connection(self.bucket)
+
+    def test_window(self):
+        events = get_pinger_events(self.conn, 'bucket', '', '', UtcDateTime('2015-05-29T00:02:30.000Z'),
+                                   UtcDateTime('2015-05-29T00:04:30.000Z'), '', logger=self.logger)
+        self.assertEqual(len(events), 12)
+        self.assertEqual(events[0]['message'], 'message 3-3')
+        self.assertEqual(events[-1]['message'], 'message 5-2')
+        self.assertEqual(events[0]['user_id'], 'client-1')
+        # listing starts at the window and stops right after the first file uploaded after it
+        self.assertEqual(self.bucket.listed, ['20150529/plog-2015052900%02d00000.gz' % x for x in range(3, 7)])
+
+
+class TestTroubleTickets(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        self.bucket = FakeBucket(dict())
+        self.conn = FakeS3Connection(self.bucket)
+        for n in range(3):
+            self.add_ticket(n)
+
+    def add_ticket(self, n):
+        ev = {'timestamp': '2015-05-29T00:00:%02d.000Z' % n, 'client': 'Ncho3168E8A8', 'user': 'user', 'message': n}
+        self.bucket.contents['ticket-%d.gz' % n] = gzip_string(json.dumps(ev))
+
+    def test_processed(self):
+        processed = dict()
+        events = get_trouble_ticket_events(self.conn, 'bucket', self.logger, processed=processed)
+        self.assertEqual([x['message'] for x in events], [0, 1, 2])
+        self.assertEqual(sorted(processed), ['ticket-0.gz', 'ticket-1.gz', 'ticket-2.gz'])
+        self.add_ticket(3)
+        del self.bucket.contents['ticket-0.gz']
+        events = get_trouble_ticket_events(self.conn, 'bucket', self.logger, processed=processed)
+        self.assertEqual([x['message'] for x in events], [3])
+        self.assertEqual([x['key_name'] for x in events], ['ticket-3.gz'])
+        self.assertEqual(sorted(processed), ['ticket-1.gz', 'ticket-2.gz', 'ticket-3.gz'])
+        # without state, everything is fetched
+        events = get_trouble_ticket_events(self.conn, 'bucket', self.logger)
+        self.assertEqual([x['message'] for x in events], [1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
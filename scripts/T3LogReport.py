@@ -26,7 +26,7 @@ from django.template.loader import render_to_string
 from django.core.mail import EmailMultiAlternatives
 from django.utils.html import strip_tags
 import os
-from AWS.db_reports import log_report, parse_dates, classify_log_events
+from AWS.db_reports import log_report, parse_dates
 
 try:
     from cloghandler import ConcurrentRotatingFileHandler as RFHandler
@@ -104,6 +104,16 @@ def main():
     parser.add_argument('--logdir',
                               help='Where to write the logfiles. Default is ./logs/<config-file-basename>',
                               default=None, type=str)
+    parser.add_argument('--group-messages',
+                              help='Group the errors and warnings with the same first line in the database, '
+                                   'and only list the first of each group',
+                              action='store_true',
+                              default=False)
+    parser.add_argument('--counts-only',
+                              help='Only report the event counts, from the hourly rollup when the period is '
+                                   'made of whole hours',
+                              action='store_true',
+                              default=False)
     parser.add_argument('-d', '--debug',
                               help='Debug',
                               action='store_true',
@@ -145,17 +155,16 @@ def main():
         logger.error("Invalid end time(%s)/period(%s)", args.end, args.period)
         exit(-1)
     logger.info("Running log report for the period %s to %s", start, end)
-    summary, error_list, warning_list = log_report(logger, config['general_config']['project'], config, start, end)
-    logger.info("Classifying log events")
-    clustered_error_list=classify_log_events(error_list)
+    summary, error_list, warning_list, clustered_error_list, clustered_warning_list = \
+        log_report(logger, config['general_config']['project'], config, start, end, limit=1000,
+                   group_messages=args.group_messages, aggregate_only=args.counts_only)
     logger.info("Clustered errors count %s", len(clustered_error_list))
-    clustered_warning_list=classify_log_events(warning_list)
     logger.info("Clustered warning count %s", len(clustered_warning_list))
     logger.info("Creating html report")
     template_dir = config['general_config']['src_root'] + '/T3Viewer/templates'
     settings.configure(DEBUG=True, TEMPLATE_DEBUG=True, TEMPLATE_DIRS=(template_dir,),
                        TEMPLATE_LOADERS=('django.template.loaders.filesystem.Loader',))
-    report_data = {'summary': summary, 'errors': error_list[:1000], 'warnings': warning_list[:1000],
+    report_data = {'summary': summary, 'errors': error_list, 'warnings': warning_list,
                    'clustered_errors': clustered_error_list,
                    'clustered_warnings': clustered_warning_list,
                    "general_config": config["general_config"]}
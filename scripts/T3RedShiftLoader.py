@@ -10,9 +10,12 @@ from django.conf import settings
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 
+from AWS.db_cache import get_db_result_cache
+from AWS.db_pool import DBConnectionPool, set_db_conn_pool
 from AWS.db_reports import parse_dates
-from AWS.redshift_handler import upload_logs, create_tables, delete_logs
+from AWS.redshift_handler import create_tables, migrate_tables, load_logs
 from AWS.s3_telemetry import create_s3_conn
+from AWS.s3t3_fetch import crawl_prefixes
 from AWS.s3t3_telemetry import T3_EVENT_CLASS_FILE_PREFIXES
 from misc.utc_datetime import UtcDateTime
 
@@ -35,11 +38,9 @@ def get_user_device_prefixes(logger, config, startdt_prefix):
     prefixes = []
     conn = create_s3_conn(aws_config["aws_access_key_id"], aws_config["aws_secret_access_key"])
     bucket_name = s3_config["client_t3_log_bucket"]
-    bucket = conn.get_bucket(bucket_name)
-    for l1_prefix in bucket.list(prefix=startdt_prefix + '/', delimiter='/'):
-        for l2_prefix in bucket.list(prefix=l1_prefix.name, delimiter='/'):
-            for l3_prefix in bucket.list(prefix=l2_prefix.name, delimiter='/'):
-                prefixes.append(l3_prefix.name + 'NachoMail')
+    # hash -> user -> device
+    for device_prefix in crawl_prefixes(conn, bucket_name, startdt_prefix + '/', 3, logger=logger):
+        prefixes.append(device_prefix + 'NachoMail')
     return prefixes
 
 
@@ -137,13 +138,36 @@ def main():
                         action='store_true',
                         default=False)
     parser.add_argument('--no-delete',
-                        help="Don't delete timespan before loading.",
+                        help="Don't replace the rows already loaded. Only COPY.",
+                        default=False,
+                        action="store_true")
+    parser.add_argument('--delete',
+                        help="Delete the timespan (and vacuum) before loading, instead of replacing the rows "
+                             "already loaded by id.",
                         default=False,
                         action="store_true")
     parser.add_argument('--prefix',
                         help="The table prefix",
                         default=None,
                         type=str)
+    parser.add_argument('--concurrency',
+                        help="How many event classes to load at once, each on its own connection",
+                        default=None,
+                        type=int)
+    parser.add_argument('--migrate',
+                        help="Deep copy the tables created with an older schema into the current one (sort key, "
+                             "dist key, encodings) before loading.",
+                        default=False,
+                        action="store_true")
+    parser.add_argument('--no-rollups',
+                        help="Don't update the hourly rollup tables for the loaded span.",
+                        default=False,
+                        action="store_true")
+    parser.add_argument('--incremental',
+                        help="Only load the files uploaded since the last incremental load (or since start the "
+                             "first time), up to end. Nothing is deleted.",
+                        default=False,
+                        action="store_true")
 
     args = parser.parse_args()
     config = args.config
@@ -208,10 +232,29 @@ def main():
 
     logger.info("Running T3 Redshift Uploader for the period %s to %s", start, end)
 
-    create_tables(logger, project, config, args.event_class, args.prefix)
-    if not args.no_delete:
-        delete_logs(logger, project, config, args.event_class, start, end, args.prefix)
-    upload_stats = upload_logs(logger, project, config, args.event_class, start, end, args.prefix)
+    # the steps below share their connections rather than connecting for each one
+    set_db_conn_pool(DBConnectionPool(logger=logger))
+
+    create_tables(logger, project, config, args.event_class, args.prefix, concurrency=args.concurrency)
+    if args.migrate:
+        migrate_tables(logger, project, config, args.event_class, args.prefix, concurrency=args.concurrency)
+    if args.incremental:
+        mode = 'incremental'
+    elif args.delete:
+        mode = 'delete'
+    elif args.no_delete:
+        mode = 'copy'
+    else:
+        mode = 'merge'
+    # loaded_end is the end of what is completely loaded, None if something failed
+    upload_stats, loaded_end = load_logs(logger, project, config, args.event_class, start, end, args.prefix,
+                                         concurrency=args.concurrency, mode=mode, rollups=not args.no_rollups)
+    if not args.prefix and args.event_class == 'ALL' and loaded_end is not None:
+        # the cached reports of the span can now be kept until it is loaded again
+        db_cache = get_db_result_cache(config, logger=logger)
+        if db_cache is not None:
+            db_cache.set_loaded(project, loaded_end)
+    set_db_conn_pool(None)
     get_upload_error_stats(logger, config, args.event_class, start, end)
     template_dir = config['general_config']['src_root'] + '/T3Viewer/templates'
     settings.configure(DEBUG=True, TEMPLATE_DEBUG=True, TEMPLATE_DIRS=(template_dir,),
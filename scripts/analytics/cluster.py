@@ -55,16 +55,18 @@ class Clusterer:
         added = new_cluster.add(token_list)
         assert added
         self.clusters.append(new_cluster)
+        return new_cluster
 
     def add(self, token_list):
+        """
+        Add a token list and return the cluster it was added to.
+        """
         if len(self.clusters) == 0:
-            self._add_cluster(token_list)
-            return
+            return self._add_cluster(token_list)
 
         # We have existing clusters. See if any of them matches
         for cluster in self.clusters:
             if cluster.add(token_list):
-                break
-        else:
-            # Nothing matches. Add a new cluster
-            self._add_cluster(token_list)
\ No newline at end of file
+                return cluster
+        # Nothing matches. Add a new cluster
+        return self._add_cluster(token_list)
\ No newline at end of file
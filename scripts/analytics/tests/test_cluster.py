@@ -0,0 +1,26 @@
+import unittest
+
+from analytics.cluster import Clusterer
+from analytics.token import TokenList, WhiteSpaceTokenizer
+
+
+class TestClusterer(unittest.TestCase):
+    def setUp(self):
+        self.clusterer = Clusterer()
+        self.tokenizer = WhiteSpaceTokenizer()
+
+    def add(self, message):
+        return self.clusterer.add(TokenList(self.tokenizer.process(message)))
+
+    def test_add_returns_cluster(self):
+        cluster1 = self.add('connection to server 1 failed')
+        cluster2 = self.add('connection to server 2 failed')
+        cluster3 = self.add('folder sync done')
+        self.assertTrue(cluster1 is cluster2)
+        self.assertFalse(cluster3 is cluster1)
+        self.assertEqual(self.clusterer.clusters, [cluster1, cluster3])
+        self.assertEqual(len(cluster1), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
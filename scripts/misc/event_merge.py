@@ -0,0 +1,46 @@
+import heapq
+from itertools import islice
+
+
+def timestamp_key(ev):
+    return ev['timestamp']
+
+
+def epoch_us_key(ev):
+    """
+    Key for events whose timestamp is a UtcDateTime. Cheaper than comparing UtcDateTime objects.
+    """
+    return ev['timestamp'].epoch_us
+
+
+def merge_events(streams, key=timestamp_key, limit=None):
+    """
+    Merge iterables of events that are each already ordered by key (e.g. the events
+    of one table or of one event class) into a single ordered list.
+
+    Only one event per stream is held in the heap and the streams are consumed
+    lazily, so with a limit the merge stops, and no more is read from the streams,
+    once <limit> events have been produced. Events with the same key keep the order
+    of streams, as a stable sort of the concatenated streams would.
+    """
+    if limit is not None and limit <= 0:
+        return []
+    merged = (x[3] for x in heapq.merge(*[_decorate(n, stream, key) for (n, stream) in enumerate(streams)]))
+    if limit is not None:
+        merged = islice(merged, limit)
+    return list(merged)
+
+
+def sort_events(events, key=timestamp_key):
+    """
+    Sort a list of events in place and return it. Use it for a single source that is
+    made of ordered runs (e.g. the files of a T3 prefix). The sort finds the runs and
+    merges them, so it costs O(n) when the events are already in order.
+    """
+    events.sort(key=key)
+    return events
+
+
+def _decorate(n, stream, key):
+    for (i, ev) in enumerate(stream):
+        yield key(ev), n, i, ev
@@ -0,0 +1,58 @@
+"""
+Per-event cost of the timestamp handling done by the T3 readers.
+
+Run from the scripts directory:
+    python -m misc.tests.bench_utc_datetime [-n <events>]
+
+"before" is what UtcDateTime did for every event timestamp before the fast
+path (dateutil parsing, ordering through float subtraction).
+"""
+import argparse
+import datetime
+import random
+import timeit
+
+import dateutil.parser
+import pytz
+
+from misc.utc_datetime import UtcDateTime
+
+
+def make_timestamps(count):
+    start = datetime.datetime(2015, 5, 29)
+    return [(start + datetime.timedelta(milliseconds=random.randint(0, 86400 * 1000))).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+            for n in range(count)]
+
+
+def old_parse(value):
+    return dateutil.parser.parse(str(value), ignoretz=True).replace(tzinfo=pytz.utc)
+
+
+def old_cmp(a, b):
+    delta = a.datetime - b.datetime
+    return cmp((float(delta.days) * 86400.0) + float(delta.seconds) + (float(delta.microseconds) / 1.e6), 0.0)
+
+
+def report(name, before, after, count):
+    print '%-8s before %8.2f us/event   after %8.2f us/event   x%.1f' % (name, before * 1e6 / count, after * 1e6 / count,
+                                                                     before / after)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark UtcDateTime parsing and ordering')
+    parser.add_argument('-n', dest='count', type=int, default=20000, help='number of events')
+    options = parser.parse_args()
+
+    timestamps = make_timestamps(options.count)
+    before = min(timeit.repeat(lambda: [old_parse(x) for x in timestamps], number=1, repeat=3))
+    after = min(timeit.repeat(lambda: [UtcDateTime(x) for x in timestamps], number=1, repeat=3))
+    report('parse', before, after, options.count)
+
+    dts = [UtcDateTime(x) for x in timestamps]
+    before = min(timeit.repeat(lambda: sorted(dts, cmp=old_cmp), number=1, repeat=3))
+    after = min(timeit.repeat(lambda: sorted(dts), number=1, repeat=3))
+    report('sort', before, after, options.count)
+
+
+if __name__ == '__main__':
+    main()
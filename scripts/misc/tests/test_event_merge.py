@@ -0,0 +1,56 @@
+import unittest
+
+from misc.event_merge import merge_events, sort_events, epoch_us_key
+from misc.utc_datetime import UtcDateTime
+
+
+def make_events(source, timestamps):
+    return [{'timestamp': timestamp, 'source': source} for timestamp in timestamps]
+
+
+class TestEventMerge(unittest.TestCase):
+    def test_merge(self):
+        streams = [make_events('a', [1, 4, 7]),
+                   make_events('b', [2, 3, 9]),
+                   [],
+                   make_events('c', [5, 6, 8])]
+        events = merge_events(streams)
+        self.assertEqual([ev['timestamp'] for ev in events], range(1, 10))
+
+    def test_ties_are_stable(self):
+        streams = [make_events('a', [1, 2, 2]),
+                   make_events('b', [2, 3])]
+        events = merge_events(streams)
+        self.assertEqual([(ev['timestamp'], ev['source']) for ev in events],
+                         [(1, 'a'), (2, 'a'), (2, 'a'), (2, 'b'), (3, 'b')])
+
+    def test_limit(self):
+        consumed = []
+
+        def stream(source, timestamps):
+            for ev in make_events(source, timestamps):
+                consumed.append(ev)
+                yield ev
+
+        events = merge_events([stream('a', range(0, 100, 2)), stream('b', range(1, 100, 2))], limit=4)
+        self.assertEqual([ev['timestamp'] for ev in events], [0, 1, 2, 3])
+        # no more than one event past the limit is read from each stream
+        self.assertTrue(len(consumed) <= 6)
+
+        self.assertEqual(merge_events([make_events('a', [1, 2])], limit=0), [])
+        self.assertEqual(len(merge_events([make_events('a', [1, 2])], limit=10)), 2)
+
+    def test_utc_datetime(self):
+        streams = [make_events('a', [UtcDateTime('2015-05-29T01:00:00.000Z'), UtcDateTime('2015-05-29T03:00:00.000Z')]),
+                   make_events('b', [UtcDateTime('2015-05-29T02:00:00.000Z')])]
+        events = merge_events(streams, key=epoch_us_key)
+        self.assertEqual([ev['source'] for ev in events], ['a', 'b', 'a'])
+
+    def test_sort_events(self):
+        events = make_events('a', [3, 1, 2])
+        self.assertTrue(sort_events(events) is events)
+        self.assertEqual([ev['timestamp'] for ev in events], [1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
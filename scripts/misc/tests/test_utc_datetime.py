@@ -1,5 +1,11 @@
+import cPickle
+import copy
+import datetime
 import unittest
-from misc.utc_datetime import UtcDateTime
+
+import pytz
+
+from misc.utc_datetime import UtcDateTime, parse_iso8601_utc
 
 
 class TestUtcDateTime(unittest.TestCase):
@@ -80,6 +86,46 @@ class TestUtcDateTime(unittest.TestCase):
         self.assertGreater(dt1a, dt2)
         self.assertLess(dt1a, dt3)
 
+        # aware datetimes compare by time, anything else is just not equal
+        self.assertTrue(dt1a == dt1a.datetime)
+        self.assertFalse(dt1a == dt1a.datetime.replace(tzinfo=None))
+        self.assertTrue(dt1a != dt1a.datetime.replace(tzinfo=None))
+        self.assertFalse(dt1a == 'now')
+        self.assertFalse(dt1a == None)
+
+    def test_fast_parse(self):
+        self.assertEqual(parse_iso8601_utc('2014-06-05T01:02:03.004Z'),
+                         datetime.datetime(2014, 6, 5, 1, 2, 3, 4000, pytz.utc))
+        self.assertEqual(parse_iso8601_utc('2014-06-05T01:02:03Z'), datetime.datetime(2014, 6, 5, 1, 2, 3, 0, pytz.utc))
+        self.assertEqual(parse_iso8601_utc(u'2014-06-05T01:02:03.123456Z'),
+                         datetime.datetime(2014, 6, 5, 1, 2, 3, 123456, pytz.utc))
+        for value in ('2014-06-05 01:02:03', '2014-06-05T01:02:03.004+00:00', '2014-06-05T01:02:03.0045678Z',
+                      '2014-13-05T01:02:03.004Z', '2014-06-05T01:02:03.004Z\n', 'now-1h'):
+            self.assertEqual(parse_iso8601_utc(value), None)
+
+    def test_slow_parse(self):
+        """
+        Formats not handled by the fast path give the same result as before.
+        """
+        self.assertEqual(UtcDateTime('2014-06-05T03:02:03.004+02:00'), UtcDateTime(self.test_vectors[0]))
+        self.assertEqual(UtcDateTime('2014-06-05 01:02:03.004'), UtcDateTime(self.test_vectors[0]))
+        self.assertEqual(UtcDateTime('2014-06-05T01:02:03.0040000Z'), UtcDateTime(self.test_vectors[0]))
+
+    def test_ordering(self):
+        dts = [UtcDateTime(x) for x in ['2014-06-15T01:02:03.004Z', '2013-06-15T01:02:03.004Z',
+                                        '2014-06-15T01:02:03.003Z', '1969-12-31T23:59:59.999Z']]
+        self.assertEqual([str(x) for x in sorted(dts)], ['1969-12-31T23:59:59.999Z', '2013-06-15T01:02:03.004Z',
+                                                         '2014-06-15T01:02:03.003Z', '2014-06-15T01:02:03.004Z'])
+        self.assertEqual(UtcDateTime('1970-01-01T00:00:01Z').epoch_us, 1000000)
+        self.assertEqual(len(set([UtcDateTime(self.test_vectors[0]), UtcDateTime(self.test_vectors[0])])), 1)
+        self.assertTrue(UtcDateTime(self.test_vectors[0]) > UtcDateTime(self.test_vectors[0]).datetime - datetime.timedelta(seconds=1))
+
+    def test_copy(self):
+        dt = UtcDateTime(self.test_vectors[0])
+        self.assertEqual(cPickle.loads(cPickle.dumps(dt)), dt)
+        self.assertEqual(cPickle.loads(cPickle.dumps(dt, cPickle.HIGHEST_PROTOCOL)), dt)
+        self.assertEqual(copy.deepcopy(dt), dt)
+
     def test_ticks(self):
         dt = UtcDateTime('2014-10-11T01:02:03.004Z')
         self.assertEqual(dt, UtcDateTime(dt.toticks()))
@@ -40,8 +40,37 @@ timezone_dict = {'FNT': -7200, 'AKDT': -28800, 'GST': 14400, 'PMDT': -7200, 'BOT
                  'PKT': 18000, 'HAY': -28800, 'WEST': 3600, 'FKT': -14400, 'GFT': -10800, 'WGST': -7200, 'H': 28800,
                  'ACST': 34200, 'EASST': -18000, 'SAMT': 14400}
 
+# The format of every timestamp in T3 and the telemetry tables. Parsed without dateutil.
+iso8601_utc_regex = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?Z\Z')
+
+epoch_ordinal = datetime.date(1970, 1, 1).toordinal()
+
+
+def parse_iso8601_utc(value):
+    """
+    Parse YYYY-MM-DDTHH:MM:SS[.ffffff]Z into an aware datetime. Return None if
+    value is in any other format.
+    """
+    m = iso8601_utc_regex.match(value)
+    if m is None:
+        return None
+    (year, month, day, hour, minute, second, fraction) = m.groups()
+    if fraction is None:
+        microsecond = 0
+    else:
+        microsecond = int(fraction) * (10 ** (6 - len(fraction)))
+    try:
+        return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                                 microsecond, pytz.utc)
+    except ValueError:
+        return None
+
+
+class UtcDateTime(object):
+    # Many of these are created per query (one per event), so keep them small.
+    # epoch_us (microseconds since 1970) is what they are ordered by.
+    __slots__ = ('datetime', 'epoch_us')
 
-class UtcDateTime:
     hours = ('h', 'hr', 'hrs')
     minutes = ('m', 'min', 'mins', 'minutes')
     seconds = ('s', 'sec', 'secs', 'seconds')
@@ -51,6 +80,10 @@ class UtcDateTime:
     def __init__(self, value=None):
         dt = None
         if isinstance(value, (str, unicode)):
+            dt = parse_iso8601_utc(value)
+            if dt is not None:
+                self._set(dt)
+                return
             if value.startswith('now'):
                 parts = value.split('-')
                 dt = datetime.datetime.utcnow().replace(microsecond=0)
@@ -100,9 +133,14 @@ class UtcDateTime:
             raise ValueError("Unsupported input type %s" % value.__class__)
         if dt:
             if dt.tzinfo is None:
-                self.datetime = dt.replace(tzinfo=pytz.utc)
+                self._set(dt.replace(tzinfo=pytz.utc))
             else:
-                self.datetime = dt.astimezone(pytz.utc)
+                self._set(dt.astimezone(pytz.utc))
+
+    def _set(self, dt):
+        self.datetime = dt
+        self.epoch_us = ((((dt.toordinal() - epoch_ordinal) * 86400 + dt.hour * 3600 + dt.minute * 60 + dt.second)
+                          * 1000000) + dt.microsecond)
 
     def __repr__(self):
         s = self.datetime.strftime('%Y-%m-%dT%H:%M:%S')
@@ -110,9 +148,58 @@ class UtcDateTime:
             return s + 'Z'
         return s + '.%03dZ' % int(self.datetime.microsecond / 1000.)
 
+    def __getstate__(self):
+        return self.datetime
+
+    def __setstate__(self, state):
+        self._set(state)
+
+    # Comparing two UtcDateTime is an integer comparison. Anything else goes through __sub__().
     def __cmp__(self, other):
+        if isinstance(other, UtcDateTime):
+            return cmp(self.epoch_us, other.epoch_us)
         return cmp(self - other, 0.0)
 
+    def __lt__(self, other):
+        try:
+            return self.epoch_us < other.epoch_us
+        except AttributeError:
+            return self.__cmp__(other) < 0
+
+    def __le__(self, other):
+        try:
+            return self.epoch_us <= other.epoch_us
+        except AttributeError:
+            return self.__cmp__(other) <= 0
+
+    def __gt__(self, other):
+        try:
+            return self.epoch_us > other.epoch_us
+        except AttributeError:
+            return self.__cmp__(other) > 0
+
+    def __ge__(self, other):
+        try:
+            return self.epoch_us >= other.epoch_us
+        except AttributeError:
+            return self.__cmp__(other) >= 0
+
+    def __eq__(self, other):
+        try:
+            return self.epoch_us == other.epoch_us
+        except AttributeError:
+            try:
+                return self.__cmp__(other) == 0
+            except (TypeError, ValueError):
+                # a naive datetime, or not a time at all
+                return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.epoch_us)
+
     def __sub__(self, other):
         """
         Return the elapsed time in seconds (with millisecond resolution).
@@ -12,6 +12,9 @@ import shutil
 from boto.s3.connection import S3Connection
 
 from AWS.s3_telemetry import create_s3_conn
+from AWS import s3t3_fetch
+from AWS.s3t3_cache import T3FileCache, set_t3_file_cache
+from AWS.s3t3_index import T3KeyIndex, set_t3_key_index
 from FreshDesk.config import FreshdeskConfig
 
 try:
@@ -310,6 +313,18 @@ def main():
         logger.error('Missing "prefix" in "aws" section')
         exit(1)
     TelemetryTable.PREFIX = options.aws_prefix
+    if 'aws_t3_fetch_concurrency' in dir(options):
+        s3t3_fetch.T3_FETCH_CONCURRENCY = options.aws_t3_fetch_concurrency
+    if 'aws_t3_cache_dir' in dir(options):
+        # sizes are in MB
+        cache_kwargs = {'logger': logger}
+        if 'aws_t3_cache_size' in dir(options):
+            cache_kwargs['max_size'] = options.aws_t3_cache_size * 1024 * 1024
+        if 'aws_t3_cache_memory_size' in dir(options):
+            cache_kwargs['memory_size'] = options.aws_t3_cache_memory_size * 1024 * 1024
+        set_t3_file_cache(T3FileCache(options.aws_t3_cache_dir, **cache_kwargs))
+    if 'aws_t3_index_file' in dir(options):
+        set_t3_key_index(T3KeyIndex(options.aws_t3_index_file, logger=logger))
 
     if options.email:
         emailConfig = EmailConfig(Config(options.email_config) if options.email_config else config_file)
@@ -419,6 +434,7 @@ def run_reports(options, email, logger):
                         kwargs['device_info_t3_bucket'] = options.aws_device_info_t3_bucket
                     if monitor_name == 'support':
                         kwargs['bucket_name'] = options.aws_support_t3_bucket
+                        kwargs['state_file'] = options.state_file
                     elif monitor_name == 'emails':
                         kwargs['support_t3_bucket'] = options.aws_support_t3_bucket
                 else:
@@ -515,6 +531,8 @@ def run_reports(options, email, logger):
 
     # Update timestamp in config if necessary after we have successfully
     # send the notification email
+    for monitor in monitors:
+        monitor.save_state()
     if options.do_update_timestamp:
         timestamp_state = TimestampConfig(Config(options.state_file, create=True))
         timestamp_state.last = options.end
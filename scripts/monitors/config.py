@@ -1,4 +1,5 @@
 import getpass
+import json
 import logging
 import keyring
 from misc.config import SectionConfig
@@ -113,3 +114,31 @@ class TimestampConfig(SectionConfig):
 
     def save(self):
         self.config_file.write()
+
+
+class TroubleTicketStateConfig(SectionConfig):
+    """
+    The trouble tickets (key name -> ETag) the support monitor has already reported.
+    """
+    SECTION = 'trouble_tickets'
+    KEYS = (
+        'processed',
+    )
+
+    def __init__(self, config_file):
+        SectionConfig.__init__(self, config_file)
+
+    def __getattr__(self, key):
+        if key == 'processed':
+            value = self.config_file.get(TroubleTicketStateConfig.SECTION, key)
+            return json.loads(value) if value else dict()
+        return SectionConfig.__getattr__(self, key)
+
+    def __setattr__(self, key, value):
+        if key == 'processed':
+            self.config_file.set(TroubleTicketStateConfig.SECTION, key, json.dumps(value, sort_keys=True))
+            return
+        SectionConfig.__setattr__(self, key, value)
+
+    def save(self):
+        self.config_file.write()
@@ -42,6 +42,8 @@ class Monitor(object):
     2. report() - Generate reporting information.
     3. attachment() - Optionally generate an attachment for the notification
                       email.
+    4. save_state() - Optionally save whatever the next run needs to know. It is
+                      only called once the notification has been sent.
 
     The user specifies the list of monitors to run in the command line. This
     script then invokes run(), report() and attachment() for each monitor.
@@ -76,6 +78,9 @@ class Monitor(object):
         """
         raise NotImplementedError()
 
+    def save_state(self):
+        pass
+
     def title(self):
         return self.desc[0].upper() + self.desc[1:]
 
@@ -7,7 +7,7 @@ from AWS.selectors import SelectorEqual
 from misc.html_elements import Table, TableRow, TableHeader, Bold, TableElement, Text, Paragraph
 from monitor_base import Monitor
 from misc.number_formatter import pretty_number
-from AWS.s3t3_telemetry import get_client_events
+from AWS.s3t3_telemetry import get_client_events, get_client_event_batch, count_client_events
 from AWS.events import DeviceInfoEvent, SupportEvent
 
 class MonitorCount(Monitor):
@@ -51,12 +51,9 @@ class MonitorUsers(MonitorCount):
         MonitorCount.__init__(self, *args, **kwargs)
 
     def get_active_device_count(self):
-        device_info_list = get_client_events(self.s3conn, self.device_info_t3_bucket, '', '', self.start,
-                                             self.end, 'DEVICEINFO', '', logger=self.logger)
-        clients = set()
-        for di in device_info_list:
-            clients.add(di['client'])
-        return len(clients)
+        device_info_events = get_client_event_batch(self.s3conn, self.device_info_t3_bucket, '', '', self.start,
+                                                    self.end, 'DEVICEINFO', '', logger=self.logger, fields=('client',))
+        return len(device_info_events.unique('client'))
 
     def run(self):
         self.logger.info('Querying %s...', self.desc)
@@ -358,9 +355,8 @@ class MonitorEvents(MonitorCount):
         MonitorCount.__init__(self, *args, **kwargs)
 
     def get_event_count(self):
-        event_list = get_client_events(self.s3conn, self.log_t3_bucket, '', '', self.start,
-                                             self.end, 'LOG', '', logger=self.logger)
-        return len(event_list)
+        return count_client_events(self.s3conn, self.log_t3_bucket, '', '', self.start,
+                                   self.end, 'LOG', '', logger=self.logger)
 
     def run(self):
         self.logger.info('Querying %s...', self.desc)
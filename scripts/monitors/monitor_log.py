@@ -11,8 +11,8 @@ from logtrace import LogTrace
 from analytics.token import TokenList, WhiteSpaceTokenizer
 from analytics.cluster import Clusterer
 from misc.threadpool import *
-from AWS.s3t3_telemetry import get_client_events, get_latest_device_info_event
-from AWS.events import LogEvent, DeviceInfoEvent
+from AWS.s3t3_telemetry import get_client_event_batch, get_latest_device_info_event
+from AWS.events import DeviceInfoEvent
 
 
 class MonitorLogTraceThread(ThreadPoolThread):
@@ -38,6 +38,8 @@ class MonitorLogTraceThread(ThreadPoolThread):
 
 
 class MonitorLog(Monitor):
+    LOG_EVENT_FIELDS = ('id', 'client', 'timestamp', 'uploaded_at', 'event_type', 'thread_id', 'message')
+
     def __init__(self, event_type=None, msg=None, rate_msg=None, isT3=False, log_t3_bucket=None, device_info_t3_bucket=None, s3conn=None, *args, **kwargs):
         super(MonitorLog, self).__init__(*args, **kwargs)
         self.event_type = event_type
@@ -55,16 +57,12 @@ class MonitorLog(Monitor):
 
     def _query(self):
         if self.isT3:
-            raw_events = get_client_events(self.s3conn, self.log_t3_bucket, userid='', deviceid='',
-                                           after=self.start, before=self.end,  event_class='LOG',
-                                           event_type=self.event_type, search='', logger=self.logger)
-            self.events = []
-            for ev in raw_events:
-                log_event = LogEvent(self.conn, id_=ev['id'], client=ev['client'], timestamp=ev['timestamp'],
-                             uploaded_at=ev['uploaded_at'], event_type=ev['event_type'], thread_id=ev['thread_id'],
-                                 message=ev['message'])
-                self.events.append(log_event)
-                self.event_count = len(self.events)
+            # a day of events is too big for a list of dicts. keep them in columns, with only the LogEvent fields
+            self.events = get_client_event_batch(self.s3conn, self.log_t3_bucket, userid='', deviceid='',
+                                                 after=self.start, before=self.end,  event_class='LOG',
+                                                 event_type=self.event_type, search='', logger=self.logger,
+                                                 fields=self.LOG_EVENT_FIELDS)
+            self.event_count = len(self.events)
         else:
             query = Query()
             query.add('event_type', SelectorEqual(self.event_type))
@@ -80,7 +78,7 @@ class MonitorLog(Monitor):
                 di_event = None
                 ev = get_latest_device_info_event(self.s3conn,
                                     self.device_info_t3_bucket, userid='', deviceid=client_id,
-                                    after=self.start, before=self.end, logger=self.logger)
+                                    after=self.start, before=end, logger=self.logger)
                 if ev:
                     di_event = DeviceInfoEvent(self.conn, id_=ev['id'], client=ev['client'], timestamp=ev['timestamp'],
                                     uploaded_at=ev['uploaded_at'], device_model=ev['device_model'], os_type=ev['os_type'],
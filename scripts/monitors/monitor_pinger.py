@@ -5,6 +5,7 @@ from AWS.query import Query
 from AWS.s3_telemetry import get_s3_events
 from AWS.s3t3_telemetry import get_pinger_events
 from AWS.selectors import SelectorEqual, SelectorContains
+from misc.event_merge import epoch_us_key, sort_events
 from misc.html_elements import Table, TableRow, TableHeader, Bold, TableElement, Text, Paragraph, Link, ListItem, \
     UnorderedList
 from misc.number_formatter import pretty_number
@@ -36,7 +37,8 @@ class MonitorPinger(Monitor):
                 all_events = get_pinger_events(self.s3conn, self.bucket_name, None, None, self.start, self.end, '', logger=self.logger)
             else:
                 all_events = get_s3_events(self.s3conn, self.bucket_name, self.path_prefix, "log", self.start, self.end, logger=self.logger)
-            pinger_telemetry[key] = sorted([ev for ev in all_events if self.start <= ev['timestamp'] < self.end], key=lambda x: x['timestamp'])
+            pinger_telemetry[key] = sort_events([ev for ev in all_events if self.start <= ev['timestamp'] < self.end],
+                                                 key=epoch_us_key)
         else:
             self.logger.info('Pulling results from cache for %s', self.desc)
         self.logger.info("Returning [%s] = %d events",key, len(pinger_telemetry[key]))
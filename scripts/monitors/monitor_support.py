@@ -7,14 +7,19 @@ from misc.number_formatter import pretty_number
 from misc.html_elements import *
 from monitors.monitor_base import get_client_telemetry_link
 from AWS.s3t3_telemetry import get_client_events, get_trouble_ticket_events, delete_trouble_ticket
+from misc.config import Config
+from monitors.config import TroubleTicketStateConfig
 
 class MonitorSupport(Monitor):
-    def __init__(self, freshdesk=None, isT3=False, bucket_name=None, s3conn=None, *args, **kwargs):
+    def __init__(self, freshdesk=None, isT3=False, bucket_name=None, s3conn=None, state_file=None, *args, **kwargs):
         kwargs.setdefault('desc', 'support requests')
         Monitor.__init__(self, *args, **kwargs)
         self.isT3 = isT3
         self.s3conn = s3conn
         self.bucket_name = bucket_name
+        # With a state file, only trouble tickets not reported by an earlier run are fetched
+        self.state_file = state_file
+        self.processed = None
         self.freshdesk = freshdesk
         self.freshdesk_api = FreshDesk(freshdesk['api_key']) if freshdesk and 'api_key' in freshdesk else None
 
@@ -32,7 +37,10 @@ class MonitorSupport(Monitor):
         self.logger.info('Querying %s...', self.desc)
         if self.isT3:
             if  'trouble-tickets' in self.bucket_name: # new support scheme
-                self.events = get_trouble_ticket_events(self.s3conn, self.bucket_name, self.logger)
+                if self.state_file:
+                    self.processed = TroubleTicketStateConfig(Config(self.state_file, create=True)).processed
+                self.events = get_trouble_ticket_events(self.s3conn, self.bucket_name, self.logger,
+                                                        processed=self.processed)
             else:
                 self.events = get_client_events(self.s3conn, self.bucket_name, userid='', deviceid='',
                             after=self.start, before=self.end, event_class='SUPPORT', search='', logger=self.logger)
@@ -122,3 +130,10 @@ class MonitorSupport(Monitor):
 
     def attachment(self):
         return None
+
+    def save_state(self):
+        if self.processed is None:
+            return
+        state = TroubleTicketStateConfig(Config(self.state_file, create=True))
+        state.processed = self.processed
+        state.save()